@@ -0,0 +1,190 @@
+'''
+    estadisticas.py
+    Estadísticas en streaming sobre una traza (o una captura en vivo) para análisis post-mortem.
+    Todas las estructuras tienen tamaño acotado, por lo que la memoria usada no depende del tamaño de la traza:
+        -Paquetes y bytes por Ethertype y por protocolo IP
+        -Paquetes y bytes por flujo (IP origen, IP destino, protocolo, puerto origen, puerto destino) con un
+        número máximo de flujos. Los paquetes de flujos nuevos que no caben se acumulan en un contador aparte
+        -Histograma de tamaños y de tiempos entre llegadas en intervalos de potencias de 2
+        -Media, desviación típica, mínimo y máximo del tiempo entre llegadas (algoritmo de Welford)
+    2020 EPS-UAM
+'''
+
+import math
+import socket
+import struct
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+#Número máximo de flujos distintos que se contabilizan
+MAX_FLOWS = 10000
+#Número de intervalos de los histogramas (el último acumula todos los valores mayores)
+HIST_BUCKETS = 16
+
+
+def log2Bucket(value:int) -> int:
+    '''
+        Nombre: log2Bucket
+        Descripción: Devuelve el intervalo del histograma para un valor: el intervalo i contiene los valores en [2^(i+5), 2^(i+6)),
+            salvo el primero, que contiene además los menores de 64, y el último, que contiene todos los mayores
+        Argumentos:
+            -value: valor entero no negativo
+        Retorno: Índice del intervalo
+    '''
+    return min(max(value.bit_length() - 6, 0), HIST_BUCKETS - 1)
+
+def bucketLabel(i:int) -> str:
+    low = 0 if i == 0 else 1 << (i + 5)
+    if i == HIST_BUCKETS - 1:
+        return '>={}'.format(low)
+    return '{}-{}'.format(low, (1 << (i + 6)) - 1)
+
+
+class RunningStats():
+    ''' Media y varianza en streaming (Welford), mínimo y máximo
+    '''
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x:float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def toDict(self) -> dict:
+        std = math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+        return {'n': self.n, 'mean': self.mean, 'std': std, 'min': self.min, 'max': self.max}
+
+
+class TraceStats():
+    ''' Estadísticas de una traza, actualizadas paquete a paquete con update()
+    '''
+    def __init__(self, maxFlows:int = MAX_FLOWS):
+        self.maxFlows = maxFlows
+        self.packets = 0
+        self.bytes = 0
+        self.capturedBytes = 0
+        self.firstTs = None
+        self.lastTs = None
+        #Ethertype -> [paquetes, bytes]
+        self.ethertypes = {}
+        #Protocolo IP -> [paquetes, bytes]
+        self.ipProtos = {}
+        #(IP origen, IP destino, protocolo, puerto origen, puerto destino) -> [paquetes, bytes]
+        self.flows = {}
+        self.flowsOverflow = [0, 0]
+        self.sizeHist = [0] * HIST_BUCKETS
+        self.iatHist = [0] * HIST_BUCKETS
+        #Tiempo entre llegadas en microsegundos
+        self.iat = RunningStats()
+
+    def update(self, header, data:bytes):
+        '''
+            Nombre: update
+            Descripción: Añade un paquete a las estadísticas
+            Argumentos:
+                -header: cabecera pcap (campos len, caplen y ts)
+                -data: bytes capturados del paquete (trama Ethernet)
+            Retorno: Ninguno
+        '''
+        length = header.len
+        ts = header.ts.tv_sec * 1000000 + header.ts.tv_usec
+        self.packets += 1
+        self.bytes += length
+        self.capturedBytes += header.caplen
+        self.sizeHist[log2Bucket(length)] += 1
+        if self.lastTs is not None:
+            #Las trazas pueden tener timestamps desordenados: se toma el valor absoluto
+            delta = abs(ts - self.lastTs)
+            self.iat.add(delta)
+            self.iatHist[log2Bucket(delta)] += 1
+        else:
+            self.firstTs = ts
+        self.lastTs = ts
+
+        if len(data) < 14:
+            return
+        ethertype, = struct.unpack_from('!H', data, 12)
+        off = 14
+        while ethertype in ETHERTYPE_VLAN and len(data) >= off + 4:
+            ethertype, = struct.unpack_from('!H', data, off + 2)
+            off += 4
+        self._count(self.ethertypes, ethertype, length)
+
+        if ethertype == ETHERTYPE_IPV4 and len(data) >= off + 20:
+            ihl = (data[off] & 0x0F) * 4
+            proto = data[off + 9]
+            fragOffset = struct.unpack_from('!H', data, off + 6)[0] & 0x1FFF
+            src = bytes(data[off + 12:off + 16])
+            dst = bytes(data[off + 16:off + 20])
+            l4 = off + ihl
+        elif ethertype == ETHERTYPE_IPV6 and len(data) >= off + 40:
+            proto = data[off + 6]
+            fragOffset = 0
+            src = bytes(data[off + 8:off + 24])
+            dst = bytes(data[off + 24:off + 40])
+            l4 = off + 40
+        else:
+            return
+        self._count(self.ipProtos, proto, length)
+        sport = dport = 0
+        if proto in (IPPROTO_TCP, IPPROTO_UDP) and fragOffset == 0 and len(data) >= l4 + 4:
+            sport, dport = struct.unpack_from('!HH', data, l4)
+        key = (src, dst, proto, sport, dport)
+        if key in self.flows or len(self.flows) < self.maxFlows:
+            self._count(self.flows, key, length)
+        else:
+            self.flowsOverflow[0] += 1
+            self.flowsOverflow[1] += length
+
+    def _count(self, table:dict, key, length:int):
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1, length]
+        else:
+            entry[0] += 1
+            entry[1] += length
+
+    def toDict(self, topFlows:int = 20) -> dict:
+        '''
+            Nombre: toDict
+            Descripción: Devuelve las estadísticas en un diccionario serializable a JSON
+            Argumentos:
+                -topFlows: número de flujos con más bytes que se incluyen
+            Retorno: Diccionario con las estadísticas
+        '''
+        def ip2str(ip):
+            return socket.inet_ntop(socket.AF_INET if len(ip) == 4 else socket.AF_INET6, ip)
+        flows = sorted(self.flows.items(), key=lambda kv: kv[1][1], reverse=True)[:topFlows]
+        duration = (self.lastTs - self.firstTs) / 1e6 if self.packets else 0.0
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'captured_bytes': self.capturedBytes,
+            'duration_s': duration,
+            'ethertypes': {'0x{:04X}'.format(k): {'packets': v[0], 'bytes': v[1]} for k, v in sorted(self.ethertypes.items())},
+            'ip_protocols': {str(k): {'packets': v[0], 'bytes': v[1]} for k, v in sorted(self.ipProtos.items())},
+            'flows': {
+                'tracked': len(self.flows),
+                'untracked_packets': self.flowsOverflow[0],
+                'untracked_bytes': self.flowsOverflow[1],
+                'top': [{'src': ip2str(k[0]), 'dst': ip2str(k[1]), 'proto': k[2], 'sport': k[3], 'dport': k[4],
+                         'packets': v[0], 'bytes': v[1]} for k, v in flows],
+            },
+            'size_histogram': {bucketLabel(i): n for i, n in enumerate(self.sizeHist)},
+            'interarrival_us': self.iat.toDict(),
+            'interarrival_histogram_us': {bucketLabel(i): n for i, n in enumerate(self.iatHist)},
+        }
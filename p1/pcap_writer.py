@@ -0,0 +1,197 @@
+'''
+    pcap_writer.py
+    Escritor de trazas pcap de alto rendimiento, alternativa a pcap_dump de rc1-pcap.
+    Los registros (cabecera + datos) se acumulan en un buffer grande en espacio de usuario y se escriben al fichero
+    con una sola llamada a write cuando el buffer se llena. Opcionalmente:
+        -Rota el fichero al superar un tamaño o un tiempo, manteniendo solo los últimos N ficheros (anillo)
+        -Escribe en un hilo aparte, de forma que la captura solo copia los datos al buffer
+    2020 EPS-UAM
+'''
+
+import os
+import queue
+import struct
+import threading
+import time
+
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_VERSION_MAJOR = 2
+PCAP_VERSION_MINOR = 4
+PCAP_GLOBAL_HLEN = 24
+PCAP_RECORD_HLEN = 16
+#Tamaño por defecto del buffer de escritura
+DEFAULT_BUFSIZE = 4 * 1024 * 1024
+#Número de buffers en modo de escritura en segundo plano
+DEFAULT_BUFFERS = 4
+
+
+class PcapDumpWriter():
+    ''' Escritor de trazas pcap con buffer, rotación de ficheros y escritura opcional en segundo plano.
+    '''
+    def __init__(self, fname:str, linktype:int = 1, snaplen:int = 65535, bufsize:int = DEFAULT_BUFSIZE,
+                 rotateBytes:int = 0, rotateSeconds:float = 0, ringSize:int = 0, background:bool = False,
+                 buffers:int = DEFAULT_BUFFERS):
+        '''
+            Argumentos:
+                -fname: nombre del fichero. Si hay rotación se numeran como base.00000.ext, base.00001.ext...
+                -linktype: tipo de enlace de la traza (1 = Ethernet)
+                -snaplen: tamaño máximo a guardar de cada paquete
+                -bufsize: tamaño (en bytes) de cada buffer de escritura
+                -rotateBytes: tamaño a partir del cual se pasa al siguiente fichero (0 = sin límite)
+                -rotateSeconds: tiempo a partir del cual se pasa al siguiente fichero (0 = sin límite)
+                -ringSize: número de ficheros que se conservan al rotar (0 = todos)
+                -background: si es True las escrituras a disco se hacen en un hilo aparte
+                -buffers: número de buffers en modo background. Si todos están pendientes de escribir, dump espera
+        '''
+        self.fname = fname
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.bufsize = max(bufsize, snaplen + PCAP_RECORD_HLEN)
+        self.rotateBytes = rotateBytes
+        self.rotateSeconds = rotateSeconds
+        self.ringSize = ringSize
+        self.rotating = rotateBytes > 0 or rotateSeconds > 0
+        self.fileIndex = 0
+        self.files = []
+        self.file = None
+        #Bytes del fichero actual (escritos o pendientes en el buffer) e instante de apertura
+        self.fileBytes = PCAP_GLOBAL_HLEN
+        self.fileOpened = time.monotonic()
+        self.packets = 0
+        self.bytes = 0
+        self.flushes = 0
+        self.closed = False
+        self.buf = bytearray(self.bufsize)
+        self.used = 0
+        self.error = None
+        self.background = background
+        if background:
+            self.free = queue.Queue()
+            for _ in range(max(buffers, 2) - 1):
+                self.free.put(bytearray(self.bufsize))
+            self.ops = queue.Queue()
+            self.thread = threading.Thread(target=self._writerLoop, name='pcap-writer')
+            self.thread.daemon = True
+            self.thread.start()
+        self._submit(('open', self._fileName()))
+
+    def _fileName(self) -> str:
+        if not self.rotating:
+            return self.fname
+        base, ext = os.path.splitext(self.fname)
+        return '{}.{:05d}{}'.format(base, self.fileIndex, ext or '.pcap')
+
+    def _writeAll(self, data):
+        #El fichero no tiene buffer (buffering=0): write puede escribir menos bytes de los pedidos
+        view = memoryview(data)
+        while view:
+            written = self.file.write(view)
+            view = view[written:]
+
+    #Operaciones sobre el fichero. Se ejecutan en orden en el hilo de escritura (o directamente si no hay hilo)
+    def _execute(self, op):
+        kind = op[0]
+        if kind == 'data':
+            buf, n = op[1], op[2]
+            self._writeAll(memoryview(buf)[:n])
+            self.flushes += 1
+        elif kind == 'open':
+            name = op[1]
+            self.file = open(name, 'wb', buffering=0)
+            self._writeAll(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, PCAP_VERSION_MAJOR, PCAP_VERSION_MINOR, 0, 0, self.snaplen, self.linktype))
+            self.files.append(name)
+            if self.ringSize > 0 and len(self.files) > self.ringSize:
+                try:
+                    os.remove(self.files.pop(0))
+                except OSError:
+                    pass
+        elif kind == 'close':
+            self.file.close()
+            self.file = None
+
+    def _writerLoop(self):
+        while True:
+            op = self.ops.get()
+            if op is None:
+                return
+            try:
+                if self.error is None:
+                    self._execute(op)
+            except OSError as e:
+                self.error = e
+            if op[0] == 'data':
+                self.free.put(op[1])
+
+    def _submit(self, op):
+        if self.background:
+            if self.error is not None:
+                raise self.error
+            self.ops.put(op)
+        else:
+            self._execute(op)
+
+    def _rotate(self):
+        self.flush()
+        self._submit(('close',))
+        self.fileIndex += 1
+        self._submit(('open', self._fileName()))
+        self.fileBytes = PCAP_GLOBAL_HLEN
+        self.fileOpened = time.monotonic()
+
+    def flush(self):
+        '''
+            Envía a disco (o al hilo de escritura) los registros acumulados en el buffer
+        '''
+        if self.used == 0:
+            return
+        if self.background:
+            self._submit(('data', self.buf, self.used))
+            self.buf = self.free.get()
+        else:
+            self._execute(('data', self.buf, self.used))
+        self.used = 0
+
+    def dump(self, header, data):
+        '''
+            Nombre: dump
+            Descripción: Añade un paquete a la traza. Equivalente a pcap_dump
+            Argumentos:
+                -header: cabecera pcap (campos len, caplen y ts.tv_sec, ts.tv_usec)
+                -data: bytes o memoryview con el contenido del paquete
+            Retorno: Ninguno
+        '''
+        if self.closed:
+            raise ValueError('El escritor está cerrado')
+        caplen = min(len(data), self.snaplen)
+        rec = PCAP_RECORD_HLEN + caplen
+        if self.rotating and self.fileBytes > PCAP_GLOBAL_HLEN:
+            if (self.rotateBytes > 0 and self.fileBytes + rec > self.rotateBytes) or \
+               (self.rotateSeconds > 0 and time.monotonic() - self.fileOpened >= self.rotateSeconds):
+                self._rotate()
+        if self.used + rec > self.bufsize:
+            self.flush()
+        off = self.used
+        struct.pack_into('<IIII', self.buf, off, header.ts.tv_sec, header.ts.tv_usec, caplen, header.len)
+        self.buf[off + PCAP_RECORD_HLEN:off + rec] = data[:caplen]
+        self.used = off + rec
+        self.fileBytes += rec
+        self.packets += 1
+        self.bytes += rec
+
+    def close(self):
+        '''
+            Escribe los registros pendientes, cierra el fichero y para el hilo de escritura
+        '''
+        if self.closed:
+            return
+        self.flush()
+        self._submit(('close',))
+        self.closed = True
+        if self.background:
+            self.ops.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+
+    def stats(self) -> dict:
+        return {'packets': self.packets, 'bytes': self.bytes, 'flushes': self.flushes, 'files': list(self.files)}
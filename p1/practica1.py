@@ -18,6 +18,10 @@ from argparse import RawTextHelpFormatter
 import time
 import logging
 import os
+import json
+from estadisticas import TraceStats
+from pcap_mmap import *
+from pcap_writer import PcapDumpWriter, DEFAULT_BUFSIZE
 
 ETH_FRAME_MAX = 1514
 PROMISC = 1
@@ -25,11 +29,17 @@ NO_PROMISC = 0
 TO_MS = 10
 num_paquete = 0
 TIME_OFFSET = 30*60
+#Número de paquetes a procesar por defecto
+DEFAULT_LIMIT = 50
+stats = None
 
 def signal_handler(nsignal,frame):
 	logging.info('Control C pulsado')
 	if handle:
-		pcap_breakloop(handle)
+		if args.mmap:
+			pcap_mmap_breakloop(handle)
+		else:
+			pcap_breakloop(handle)
 
 
 def procesa_paquete(us,header,data):
@@ -38,25 +48,15 @@ def procesa_paquete(us,header,data):
 	num_paquete += 1
 	
 
-	#imprimir los N primeros bytes
-	my_data_str = str(binascii.hexlify(data[:args.nbytes]))
-
-	i = 0
-
-	while i <= (int(args.nbytes)*2)+1 and i < (int(header.len)*2):
-		print(my_data_str[i], end = '')
-		if i %2 != 0:
-			print(' ', end = '')
-		i+=1
-
-	print("' ")
+	#imprimir los N primeros bytes (una sola llamada a print por paquete)
+	print(bytes(data[:args.nbytes]).hex(' '))
  
 	
 	#Escribir el tráfico al fichero de captura con el offset temporal
 	header.ts.tv_sec += TIME_OFFSET
 
-	if args.interface != False:
-		pcap_dump(pdumper, header, data)
+	if pdumper is not None:
+		pdumper.dump(header, data)
 
 
 	
@@ -68,6 +68,16 @@ if __name__ == "__main__":
 	parser.add_argument('--itf', dest='interface', default=False,help='Interfaz a abrir')
 	parser.add_argument('--nbytes', dest='nbytes', type=int, default=14,help='Número de bytes a mostrar por paquete')
 	parser.add_argument('--debug', dest='debug', default=False, action='store_true',help='Activar Debug messages')
+	parser.add_argument('--limit', dest='limit', type=int, default=DEFAULT_LIMIT,help='Número máximo de paquetes a procesar')
+	parser.add_argument('--all', dest='all', default=False, action='store_true',help='Procesar todos los paquetes (ignora --limit)')
+	parser.add_argument('--stats', dest='stats', default=False, action='store_true',help='Calcular estadísticas de la traza en lugar de mostrar los paquetes')
+	parser.add_argument('--json', dest='json', default=False,help='Fichero donde guardar las estadísticas en JSON (- para la salida estándar)')
+	parser.add_argument('--mmap', dest='mmap', default=False, action='store_true',help='Leer la traza con el lector mmap en Python (no necesita libpcap)')
+	parser.add_argument('--bufsize', dest='bufsize', type=int, default=DEFAULT_BUFSIZE,help='Tamaño (en bytes) del buffer de escritura de la captura')
+	parser.add_argument('--rotateMB', dest='rotateMB', type=float, default=0,help='Rotar el fichero de captura al alcanzar este tamaño en MB (0 = sin rotación)')
+	parser.add_argument('--rotateSeconds', dest='rotateSeconds', type=float, default=0,help='Rotar el fichero de captura cada este número de segundos (0 = sin rotación)')
+	parser.add_argument('--ring', dest='ring', type=int, default=0,help='Número de ficheros de captura a conservar al rotar (0 = todos)')
+	parser.add_argument('--bgFlush', dest='bgFlush', default=False, action='store_true',help='Escribir la captura a disco desde un hilo aparte')
 	args = parser.parse_args()
 
 	if args.debug:
@@ -80,6 +90,11 @@ if __name__ == "__main__":
 		parser.print_help()
 		sys.exit(-1)
 
+	if args.mmap and args.tracefile is False:
+		logging.error('El lector mmap solo se puede usar con --file')
+		parser.print_help()
+		sys.exit(-1)
+
 	signal.signal(signal.SIGINT, signal_handler)
 
 	errbuf = bytearray()
@@ -95,14 +110,40 @@ if __name__ == "__main__":
 		
 	#abrir un dumper para volcar el tráfico (si se ha especificado interfaz) 
 	if args.tracefile != False:
-		handle = pcap_open_offline(args.tracefile, errbuf)
+		if args.mmap:
+			handle = pcap_mmap_open_offline(args.tracefile, errbuf)
+			if handle is None:
+				logging.error('Error abriendo la traza: {}'.format(errbuf.decode('utf-8')))
+				sys.exit(-1)
+		else:
+			handle = pcap_open_offline(args.tracefile, errbuf)
+	elif args.stats:
+		pass
 	else:
-		descr = pcap_open_dead(DLT_EN10MB, ETH_FRAME_MAX)
 		name = 'captura.' + str(args.interface) + '.' + str(int(time.time())) +'.pcap'
-		pdumper = pcap_dump_open(descr, name)
+		pdumper = PcapDumpWriter(name, DLT_EN10MB, ETH_FRAME_MAX, bufsize=args.bufsize, rotateBytes=int(args.rotateMB*1e6),
+			rotateSeconds=args.rotateSeconds, ringSize=args.ring, background=args.bgFlush)
 
 
-	ret = pcap_loop(handle,50,procesa_paquete,None)
+	cnt = -1 if args.all else args.limit
+
+	if args.stats:
+		#En modo estadísticas solo se actualizan los contadores por paquete (memoria constante)
+		stats = TraceStats()
+		def actualiza_estadisticas(us,header,data):
+			global num_paquete
+			num_paquete += 1
+			stats.update(header,data)
+		callback = actualiza_estadisticas
+	else:
+		callback = procesa_paquete
+
+	t_inicio = time.perf_counter()
+	if args.mmap:
+		ret = pcap_mmap_loop(handle,cnt,callback,None)
+	else:
+		ret = pcap_loop(handle,cnt,callback,None)
+	t_total = time.perf_counter() - t_inicio
 
 	if ret == -1:
 		logging.error('Error al capturar un paquete')
@@ -111,13 +152,32 @@ if __name__ == "__main__":
 	elif ret == 0:
 		logging.debug('No mas paquetes o limite superado')
 	logging.info('{} paquetes procesados'.format(num_paquete))
+
+	if stats is not None:
+		resultado = stats.toDict()
+		resultado['processing'] = {
+			'wall_time_s': t_total,
+			'packets_per_s': num_paquete / t_total if t_total > 0 else 0.0,
+			'mbytes_per_s': stats.capturedBytes / t_total / 1e6 if t_total > 0 else 0.0,
+		}
+		logging.info('Rendimiento: {:.0f} paquetes/s, {:.1f} MB/s'.format(resultado['processing']['packets_per_s'],resultado['processing']['mbytes_per_s']))
+		if args.json == '-':
+			print(json.dumps(resultado,indent=2))
+		elif args.json != False:
+			with open(args.json,'w') as f:
+				json.dump(resultado,f,indent=2)
+		else:
+			print(json.dumps(resultado,indent=2))
 	
 	if descr !=None:
 		pcap_close(descr)
 
+	if args.mmap:
+		pcap_mmap_close(handle)
+
 	#si se ha creado un dumper cerrarlo
 	if pdumper != None:
-		pcap_dump_close(pdumper)
+		pdumper.close()
 	
 	
 
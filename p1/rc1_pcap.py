@@ -59,7 +59,11 @@ def mycallback(us, h, data):
 
 
 
-pcap = ctypes.cdll.LoadLibrary("libpcap.so")
+try:
+    pcap = ctypes.cdll.LoadLibrary("libpcap.so")
+except OSError:
+    # Sin libpcap el módulo se puede importar, pero solo funcionan los lectores de trazas que no dependen de ella (pcap_mmap)
+    pcap = None
 
 class _pcap_t():
     pass
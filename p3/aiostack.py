@@ -0,0 +1,189 @@
+'''
+    aiostack.py
+    API asyncio de la pila de protocolos.
+    Con EthernetTransport la recepción se integra en el bucle de eventos: el nivel Ethernet se arranca sin hilo de
+    recepción ni despachador y el descriptor de la captura (pcap_get_selectable_fd o el socket del anillo) se vigila con
+    loop.add_reader. Cada vez que hay tramas se procesan en el propio hilo del bucle, de forma que ARP, ICMP y UDP
+    completan directamente los futuros de arp.resolve, icmp.ping y los endpoints UDP.
+    Los endpoints UDP siguen el contrato de asyncio.DatagramProtocol (connection_made, datagram_received,
+    error_received y connection_lost).
+
+    Ejemplo:
+        transport = await openStack('eth0')
+        mac = await resolve(ip)
+        rtt = await ping(ip)
+        udpTransport, protocol = await createUDPEndpoint(MiProtocolo, remoteAddr=('10.0.0.1', 53))
+    2022 EPS-UAM
+'''
+
+import asyncio
+import errno
+import logging
+import threading
+from udp import *
+from icmp import *
+import ip as ipLayer
+
+
+class EthernetTransport():
+    ''' Recepción de tramas desde el bucle de eventos de asyncio. Sustituye al hilo de recepción (rxThread)
+    '''
+    def __init__(self, interface:str, rx:str = RX_PCAP, tx:str = TX_INJECT, zerocopy:bool = True, loop = None):
+        self.interface = interface
+        self.rx = rx
+        self.tx = tx
+        self.zerocopy = zerocopy
+        self.loop = loop
+        self.fd = -1
+        self.frames = 0
+
+    def start(self) -> bool:
+        '''
+            Arranca el nivel Ethernet sin hilos y registra el descriptor de la captura en el bucle de eventos.
+            Devuelve True o False en función de si se ha arrancado o no
+        '''
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        if startEthernetLevel(self.interface, zerocopy=self.zerocopy, tx=self.tx, rx=self.rx, background=False) != 0:
+            return False
+        self.fd = getSelectableFd()
+        if self.fd < 0:
+            logging.error('La captura no tiene un descriptor que se pueda vigilar')
+            stopEthernetLevel()
+            return False
+        self.loop.add_reader(self.fd, self._onReadable)
+        return True
+
+    def _onReadable(self):
+        n = pollFrames(-1)
+        if n > 0:
+            self.frames += n
+
+    def close(self):
+        if self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            self.fd = -1
+            stopEthernetLevel()
+
+
+async def openStack(interface:str, opts:bytes = None, rx:str = RX_PCAP, tx:str = TX_INJECT, routes:str = None) -> EthernetTransport:
+    '''
+        Nombre: openStack
+        Descripción: Esta función arranca la pila completa (Ethernet, ARP, IP, ICMP y UDP) sobre el bucle de eventos actual.
+            initIP hace una petición ARP gratuita bloqueante, por lo que se ejecuta en un hilo del executor mientras el
+            bucle sigue procesando las tramas recibidas.
+        Argumentos:
+            -interface: nombre de la interfaz
+            -opts: opciones IP (ver initIP)
+            -rx, tx: backends de captura y envío (ver startEthernetLevel)
+            -routes: fichero de rutas adicionales o None
+        Retorno: El EthernetTransport arrancado o None en caso de error
+    '''
+    transport = EthernetTransport(interface, rx, tx)
+    if not transport.start():
+        return None
+    initICMP()
+    initUDP()
+    ok = await asyncio.get_running_loop().run_in_executor(None, initIP, interface, opts)
+    if not ok or (routes and not loadRoutes(routes)):
+        transport.close()
+        return None
+    return transport
+
+
+class UDPTransport(asyncio.DatagramTransport):
+    ''' Transporte de un endpoint UDP de la pila. Las direcciones son tuplas (IP, puerto) con la IP como cadena
+        (o entero de 32 bits al enviar)
+    '''
+    def __init__(self, loop, protocol:asyncio.DatagramProtocol, localPort:int, remoteAddr:tuple = None, ownPort:bool = False):
+        super().__init__()
+        self._loop = loop
+        self._loopThread = threading.get_ident()
+        self._protocol = protocol
+        self._port = localPort
+        self._remote = remoteAddr
+        self._ownPort = ownPort
+        self._closing = False
+
+    def get_extra_info(self, name, default = None):
+        if name == 'sockname':
+            return (intToIp(ipLayer.myIP), self._port)
+        if name == 'peername':
+            return self._remote
+        return default
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        registerUDPPort(self._port, None)
+        if self._ownPort:
+            releaseUDPPort(self._port)
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def sendto(self, data, addr = None):
+        if self._closing:
+            return
+        if addr is None:
+            addr = self._remote
+        if addr is None:
+            raise ValueError('No se ha indicado dirección destino')
+        dstIP, dstPort = addr
+        if isinstance(dstIP, str):
+            dstIP = ipToInt(dstIP)
+        if nextHopIP(dstIP) is None:
+            self._protocol.error_received(OSError(errno.ENETUNREACH, 'No hay ruta hacia ' + intToIp(dstIP)))
+            return
+        #sendIPDatagram no se bloquea en ARP: si el siguiente salto no está resuelto el datagrama espera en su cola y
+        #el fallo (si lo hay) llega después a _sendDone
+        sendUDPDatagram(bytes(data), dstPort, dstIP, self._port, lambda ok: self._sendDone(ok, dstIP))
+
+    def _sendDone(self, ok:bool, dstIP:int):
+        #Se llama en el hilo que termina el envío (el del bucle, el de recepción o el de resolución ARP)
+        if ok:
+            return
+        exc = OSError(errno.EHOSTUNREACH, 'No se ha podido enviar el datagrama a ' + intToIp(dstIP))
+        if threading.get_ident() == self._loopThread:
+            self._protocol.error_received(exc)
+        else:
+            self._loop.call_soon_threadsafe(self._protocol.error_received, exc)
+
+    def _received(self, us, header, data, srcIP, srcPort:int):
+        #Se llama desde el procesado de tramas: en el hilo del bucle con EthernetTransport o en un trabajador si no
+        payload = bytes(data)
+        addr = (intToIp(int.from_bytes(srcIP, 'big')), srcPort)
+        if threading.get_ident() == self._loopThread:
+            self._protocol.datagram_received(payload, addr)
+        else:
+            self._loop.call_soon_threadsafe(self._protocol.datagram_received, payload, addr)
+
+
+async def createUDPEndpoint(protocolFactory, localPort:int = None, remoteAddr:tuple = None):
+    '''
+        Nombre: createUDPEndpoint
+        Descripción: Esta función crea un endpoint UDP sobre la pila, equivalente a loop.create_datagram_endpoint
+        Argumentos:
+            -protocolFactory: función sin argumentos que devuelve el protocolo (por ejemplo una subclase de
+            asyncio.DatagramProtocol)
+            -localPort: puerto local o None para usar uno de los reservados por initUDP (allocUDPPort)
+            -remoteAddr: tupla (IP, puerto) por defecto para sendto o None
+        Retorno: Tupla (transporte, protocolo). Lanza OSError si el puerto local ya está en uso
+    '''
+    loop = asyncio.get_running_loop()
+    ownPort = localPort is None
+    if ownPort:
+        localPort = allocUDPPort()
+    protocol = protocolFactory()
+    transport = UDPTransport(loop, protocol, localPort, remoteAddr, ownPort)
+    if not registerUDPPort(localPort, transport._received):
+        if ownPort:
+            releaseUDPPort(localPort)
+        raise OSError(errno.EADDRINUSE, 'El puerto UDP {} ya está en uso'.format(localPort))
+    protocol.connection_made(transport)
+    return transport, protocol
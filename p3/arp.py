@@ -13,12 +13,17 @@ import socket
 import struct
 import fcntl
 import time
+import threading
+import heapq
 from threading import Lock
-from expiringdict import ExpiringDict
 import uuid
+import asyncio
+from neighbor import *
 
 #Semáforo global 
 globalLock =Lock()
+#Indica si initARP ya ha terminado. Con la pila en el bucle de eventos pueden llegar tramas ARP antes
+arpInitialized = False
 #Dirección de difusión (Broadcast)
 broadcastAddr = bytes([0xFF]*6)
 #Cabecera ARP común a peticiones y respuestas. Específica para la combinación Ethernet/IP
@@ -26,17 +31,76 @@ ARPHeader = bytes([0x00,0x01,0x08,0x00,0x06,0x04])
 #longitud (en bytes) de la cabecera común ARP
 ARP_HLEN = 6
 
-#Variable que alamacenará que dirección IP se está intentando resolver
-requestedIP = None
-#Variable que alamacenará que dirección MAC resuelta o None si no se ha podido obtener
-resolvedMAC = None
-#Variable que alamacenará True mientras estemos esperando una respuesta ARP
-awaitingResponse = False
+#Número de peticiones ARP que se envían como máximo por resolución
+ARP_RETRIES = 3
+#Tiempo de espera (en segundos) de la primera respuesta ARP
+ARP_TIMEOUT = 0.6
+#Factor por el que se multiplica el tiempo de espera en cada reintento (1.0 = espera constante)
+ARP_BACKOFF = 1.0
+#Tiempo de espera máximo (en segundos) entre reintentos
+ARP_MAX_TIMEOUT = 5.0
+#Peticiones ARP broadcast por segundo como máximo (entre todas las resoluciones) y ráfaga máxima
+ARP_BROADCAST_RATE = 20.0
+ARP_BROADCAST_BURST = 20
+
+class PendingResolution():
+    ''' Resolución ARP en curso para una IP. Todos los hilos que quieren resolver la misma IP esperan
+        sobre el mismo Event, que se activa al recibir la respuesta o al agotar los reintentos.
+        Quien no quiera bloquearse puede añadir a callbacks una función, que se llamará con la MAC (o None) al terminar.
+    '''
+    __slots__ = ('ip', 'event', 'mac', 'callbacks', 'done')
+    def __init__(self, ip:int):
+        self.ip = ip
+        self.event = threading.Event()
+        self.mac = None
+        self.callbacks = []
+        self.done = False
+
+#Tabla de resoluciones en curso indexada por IP. Se protege con globalLock
+pendingResolutions = {}
+#Resoluciones sin bloqueo (requestResolution): heap de (instante del siguiente envío, secuencia, resolución, petición
+#ARP, envíos hechos, tiempo de espera). Lo atiende el hilo resolverThread y se protege con resolverCond
+resolverSchedule = []
+resolverCond = threading.Condition(threading.Lock())
+resolverSeq = 0
+resolverThread = None
+
+
+def completeResolution(pending:PendingResolution) -> None:
+    '''
+        Nombre: completeResolution
+        Descripción: Esta función termina una resolución (con pending.mac ya fijada o None): despierta a los hilos que
+            esperan en su Event y llama a sus callbacks. Solo tiene efecto la primera vez que se llama.
+        Argumentos:
+            -pending: resolución a terminar
+        Retorno: Ninguno
+    '''
+    with globalLock:
+        if pending.done:
+            return
+        pending.done = True
+        callbacks = pending.callbacks
+        pending.callbacks = []
+    pending.event.set()
+    for callback in callbacks:
+        try:
+            callback(pending.mac)
+        except Exception:
+            logging.exception('Error en un callback de resolución ARP')
+
+
+def setFutureResult(fut:asyncio.Future, value) -> None:
+    #Fija el resultado de un futuro de asyncio si no se ha cancelado o completado ya (para call_soon_threadsafe)
+    if not fut.done():
+        fut.set_result(value)
 
-#Variable para proteger la caché
-cacheLock = Lock()
-#Caché de ARP. Es un diccionario similar al estándar de Python solo que eliminará las entradas a los 10 segundos
-cache = ExpiringDict(max_len=100, max_age_seconds=10)
+#Caché de ARP (caché de vecinos con estados REACHABLE/STALE/PROBE y entradas negativas, ver neighbor.py). Es segura
+#para varios hilos
+cache = NeighborCache()
+#Límite global de peticiones broadcast, para que una ráfaga de destinos que no existen no inunde la red
+broadcastLimit = TokenBucket(ARP_BROADCAST_RATE, ARP_BROADCAST_BURST)
+#Peticiones broadcast enviadas y suprimidas por el límite. Se protegen con globalLock
+broadcastCounters = {'broadcasts': 0, 'broadcastsSuppressed': 0}
 
 
 
@@ -64,11 +128,78 @@ def printCache()->None:
         Argumentos: Ninguno
         Retorno: Ninguno
     '''
-    print('{:>12}\t\t{:>12}'.format('IP','MAC'))
-    with cacheLock:
-        for k in cache:
-            if k in cache:
-                print ('{:>12}\t\t{:>12}'.format(socket.inet_ntoa(struct.pack('!I',k)),':'.join(['{:02X}'.format(b) for b in cache[k]])))
+    print('{:>12}\t\t{:>12}\t\t{:>9}'.format('IP','MAC','Estado'))
+    for ip, mac, state in cache.items():
+        print ('{:>12}\t\t{:>12}\t\t{:>9}'.format(socket.inet_ntoa(struct.pack('!I',ip)),':'.join(['{:02X}'.format(b) for b in mac]),state))
+
+
+def configureARPCache(capacity:int = NEIGH_CAPACITY, reachableTime:float = NEIGH_REACHABLE_TIME, staleTime:float = NEIGH_STALE_TIME) -> None:
+    '''
+        Nombre: configureARPCache
+        Descripción: Esta función configura la capacidad y los tiempos de la caché ARP (ver neighbor.py)
+        Argumentos:
+            -capacity: número máximo de entradas
+            -reachableTime: tiempo (en segundos) durante el que una entrada confirmada no se comprueba
+            -staleTime: tiempo (en segundos) sin confirmar tras el que se descarta una entrada
+        Retorno: Ninguno
+    '''
+    cache.configure(capacity, reachableTime, staleTime)
+
+
+def configureARPLearning(enabled:bool, rate:float = NEIGH_LEARN_RATE, burst:int = NEIGH_LEARN_BURST) -> None:
+    '''
+        Nombre: configureARPLearning
+        Descripción: Esta función activa o desactiva el aprendizaje pasivo de la caché ARP a partir de las peticiones ARP
+            dirigidas a nosotros y de los datagramas IP recibidos de la red local (ver neighbor.py)
+        Argumentos:
+            -enabled: True para activarlo
+            -rate: entradas aprendidas por segundo como máximo
+            -burst: número de entradas que se pueden aprender de golpe
+        Retorno: Ninguno
+    '''
+    cache.configureLearning(enabled, rate, burst)
+
+
+def configureARPBackoff(hold:float = NEIGH_NEG_HOLD, maxHold:float = NEIGH_NEG_MAX_HOLD, broadcastRate:float = ARP_BROADCAST_RATE, broadcastBurst:int = ARP_BROADCAST_BURST) -> None:
+    '''
+        Nombre: configureARPBackoff
+        Descripción: Esta función configura la caché negativa y el límite de peticiones broadcast. Tras una resolución
+            fallida, las resoluciones de esa IP fallan en el acto durante hold segundos, tiempo que se duplica con cada
+            fallo consecutivo hasta maxHold
+        Argumentos:
+            -hold: tiempo de espera (en segundos) tras el primer fallo. 0 desactiva la caché negativa
+            -maxHold: tiempo de espera máximo
+            -broadcastRate: peticiones broadcast por segundo como máximo
+            -broadcastBurst: peticiones broadcast que se pueden enviar de golpe
+        Retorno: Ninguno
+    '''
+    global broadcastLimit
+    cache.configureNegative(hold, maxHold)
+    broadcastLimit = TokenBucket(broadcastRate, broadcastBurst)
+
+
+def getARPCacheStats() -> dict:
+    #Contadores de la caché ARP (aciertos, fallos, expulsiones, comprobaciones, entradas negativas, broadcasts...)
+    stats = cache.stats()
+    with globalLock:
+        stats.update(broadcastCounters)
+    return stats
+
+
+def sendARPBroadcast(frame:bytes) -> bool:
+    '''
+        Nombre: sendARPBroadcast
+        Descripción: Esta función envía una petición ARP broadcast si lo permite el límite global de ritmo
+        Argumentos:
+            -frame: petición ARP creada con createARPRequest
+        Retorno: True si se ha enviado y False si se ha suprimido por el límite
+    '''
+    allowed = broadcastLimit.take()
+    with globalLock:
+        broadcastCounters['broadcasts' if allowed else 'broadcastsSuppressed'] += 1
+    if allowed:
+        sendEthernetFrame(frame, len(frame), bytes([0x08,0x06]), broadcastAddr)
+    return allowed
 
 
 def processARPRequest(data:bytes,MAC:bytes)->None:
@@ -82,6 +213,8 @@ def processARPRequest(data:bytes,MAC:bytes)->None:
             -Comprobar si la IP destino de la petición ARP es la propia IP:
                 -Si no es la propia IP retornar
                 -Si es la propia IP:
+                    -Si el aprendizaje pasivo está activado, añadir a la caché la IP y MAC origen (el emisor nos va a
+                    enviar tráfico y así no hace falta resolverlo para contestarle)
                     -Construir una respuesta ARP llamando a createARPReply (descripción más adelante)
                     -Enviar la respuesta ARP usando el nivel Ethernet (sendEthernetFrame)
         Argumentos:
@@ -92,7 +225,7 @@ def processARPRequest(data:bytes,MAC:bytes)->None:
     global myIP
 
 
-    mac_org = data[2:8]
+    mac_org = bytes(data[2:8])
     if mac_org != MAC:
         return
 
@@ -106,6 +239,10 @@ def processARPRequest(data:bytes,MAC:bytes)->None:
     if ip_dest != ip_r:
         return
 
+    #Las peticiones con IP origen 0.0.0.0 son comprobaciones de direcciones duplicadas (RFC 5227)
+    if ip_org != bytes(4):
+        cache.learn(int.from_bytes(ip_org, 'big'), mac_org)
+
     frame = createARPReply(ip_org, mac_org)
 
     sendEthernetFrame(frame, len(frame), bytes([0x08,0x06]), mac_org)
@@ -125,19 +262,16 @@ def processARPReply(data:bytes,MAC:bytes)->None:
             -Comprobar si la IP destino de la petición ARP es la propia IP:
                 -Si no es la propia IP retornar
                 -Si es la propia IP:
-                    -Comprobar si la IP origen se corresponde con la solicitada (requestedIP). Si no se corresponde retornar
-                    -Copiar la MAC origen a la variable global resolvedMAC
+                    -Comprobar si hay una resolución en curso para la IP origen (pendingResolutions). Si no la hay, confirmar
+                    la entrada de la caché si está en PROBE con la misma MAC (respuesta a una comprobación unicast) y retornar
                     -Añadir a la caché ARP la asociación MAC/IP.
-                    -Cambiar el valor de la variable awaitingResponse a False
-                    -Cambiar el valor de la variable requestedIP a None
-        Las variables globales (requestedIP, awaitingResponse y resolvedMAC) son accedidas concurrentemente por la función ARPResolution y deben ser protegidas mediante un Lock.
+                    -Guardar la MAC en la resolución en curso, eliminarla de la tabla y despertar a todos los hilos que la esperan
+        La tabla pendingResolutions es accedida concurrentemente por la función ARPResolution y se protege con globalLock.
         Argumentos:
             -data: bytearray con el contenido de la trama ARP (después de la cabecera común)
             -MAC: dirección MAC origen extraída por el nivel Ethernet
         Retorno: Ninguno
     '''
-    global requestedIP,resolvedMAC,awaitingResponse,cache
-        
     mac_org = data[2:8]
 
     if mac_org != MAC:
@@ -158,18 +292,23 @@ def processARPReply(data:bytes,MAC:bytes)->None:
 
     
 
+    ip = int.from_bytes(ip_org, byteorder='big')
+
+    mac_org = bytes(mac_org)
+
     with globalLock:
-        if int.from_bytes(ip_org, byteorder='big') != requestedIP:
+        pending = pendingResolutions.pop(ip, None)
+        if pending is None:
+            #Solo se acepta como respuesta a una comprobación unicast en curso, para que una respuesta no solicitada
+            #(o falsificada) no cambie la MAC de una entrada
+            cache.confirmProbe(ip, mac_org)
             return
 
-        resolvedMAC = mac_org
-
-        awaitingResponse = False
+        cache.confirm(ip, mac_org)
 
-        with cacheLock:
-            cache[requestedIP] = resolvedMAC
+        pending.mac = mac_org
 
-        requestedIP = None
+    completeResolution(pending)
         
     return
 
@@ -214,6 +353,20 @@ def createARPReply(IP:int ,MAC:bytes) -> bytes:
     return frame
 
 
+def sendARPProbe(ip:int, mac:bytes) -> None:
+    '''
+        Nombre: sendARPProbe
+        Descripción: Esta función envía una petición ARP unicast a la MAC conocida de una IP, para comprobar una entrada
+            de la caché sin enviar un broadcast. La llama el hilo de refresco de la caché
+        Argumentos:
+            -ip: dirección a comprobar
+            -mac: MAC guardada en la caché para esa IP
+        Retorno: Ninguno
+    '''
+    arpR = createARPRequest(ip)
+    sendEthernetFrame(arpR, len(arpR), bytes([0x08,0x06]), mac)
+
+
 def process_arp_frame(us:ctypes.c_void_p,header:pcap_pkthdr,data:bytes,srcMac:bytes) -> None:
     '''
         Nombre: process_arp_frame
@@ -271,8 +424,13 @@ def initARP(interface:str) -> int:
     myIP = getIP(interface)
 
     myMAC = getHwAddr(interface)
+
+    cache.start(sendARPProbe)
+    startResolver()
     
     free_res = ARPResolution(myIP)
+    #La IP propia no debe quedar como inalcanzable
+    cache.clearUnreachable(myIP)
     if free_res:
         return -1
     
@@ -280,52 +438,255 @@ def initARP(interface:str) -> int:
     
     return 0
 
+def setARPTimings(retries:int = 3, timeout:float = 0.6, backoff:float = 1.0, maxTimeout:float = 5.0) -> None:
+    '''
+        Nombre: setARPTimings
+        Descripción: Esta función configura los reintentos de las resoluciones ARP. La espera tras la petición i-ésima
+            es min(timeout * backoff^i, maxTimeout)
+        Argumentos:
+            -retries: número máximo de peticiones ARP por resolución
+            -timeout: tiempo de espera (en segundos) tras la primera petición
+            -backoff: factor multiplicativo del tiempo de espera en cada reintento
+            -maxTimeout: tiempo de espera máximo entre reintentos
+        Retorno: Ninguno
+    '''
+    global ARP_RETRIES,ARP_TIMEOUT,ARP_BACKOFF,ARP_MAX_TIMEOUT
+    if retries < 1 or timeout <= 0 or backoff < 1.0:
+        raise ValueError('Parámetros de temporización ARP no válidos')
+    ARP_RETRIES = retries
+    ARP_TIMEOUT = timeout
+    ARP_BACKOFF = backoff
+    ARP_MAX_TIMEOUT = max(maxTimeout, timeout)
+
 def ARPResolution(ip:int) -> bytes:
     '''
         Nombre: ARPResolution
         Descripción: Esta función intenta realizar una resolución ARP para una IP dada y devuelve la dirección MAC asociada a dicha IP 
             o None en caso de que no haya recibido respuesta. Esta función debe realizar, al menos, las siguientes tareas:
                 -Comprobar si la IP solicitada existe en la caché:
-                -Si está en caché devolver la información de la caché
+                -Si está en caché devolver la información de la caché (aunque esté STALE: la caché la comprueba en segundo plano)
                 -Si no está en la caché:
-                    -Construir una petición ARP llamando a la función createARPRequest (descripción más adelante)
-                    -Enviar dicha petición
-                    -Comprobar si se ha recibido respuesta o no:
-                        -Si no se ha recibido respuesta reenviar la petición hasta un máximo de 3 veces. Si no se recibe respuesta devolver None
+                    -Si la IP tiene una entrada negativa vigente (no contestó hace poco) devolver None sin enviar nada
+                    -Si ya hay una resolución en curso para esa IP esperar a su resultado sin enviar nuevas peticiones
+                    -Si no, registrar la resolución en pendingResolutions y:
+                        -Construir una petición ARP llamando a la función createARPRequest (descripción más adelante)
+                        -Enviar dicha petición y esperar la respuesta sobre el Event de la resolución
+                        -Si no se ha recibido respuesta reenviar la petición hasta un máximo de ARP_RETRIES veces. Si no se recibe respuesta
+                        añadir una entrada negativa y devolver None. Las peticiones se envían con sendARPBroadcast (límite global de ritmo)
                         -Si se ha recibido respuesta devolver la dirección MAC
-            Esta función necesitará comunicarse con el la función de recepción (para comprobar si hay respuesta y la respuesta en sí) mediante 3 variables globales:
-                -awaitingResponse: indica si está True que se espera respuesta. Si está a False quiere decir que se ha recibido respuesta
-                -requestedIP: contiene la IP por la que se está preguntando
-                -resolvedMAC: contiene la dirección MAC resuelta (en caso de que awaitingResponse) sea False.
-            Como estas variables globales se leen y escriben concurrentemente deben ser protegidas con un Lock
+            La función de recepción (processARPReply) despierta a los hilos en cuanto llega la respuesta, por lo que la latencia
+            de la resolución es la del propio intercambio ARP. Se pueden resolver varias IPs distintas a la vez.
     '''
 
-    global requestedIP,awaitingResponse,resolvedMAC
+    mac = cache.lookup(ip)
+    if mac is not None:
+        return mac
+    if cache.isUnreachable(ip):
+        return None
+
+    with globalLock:
+        pending = pendingResolutions.get(ip)
+        if pending is not None:
+            owner = False
+        else:
+            pending = PendingResolution(ip)
+            pendingResolutions[ip] = pending
+            owner = True
+
+    if not owner:
+        pending.event.wait()
+        return pending.mac
 
+    arpR = createARPRequest(ip)
+    timeout = ARP_TIMEOUT
 
+    try:
+        for i in range(ARP_RETRIES):
+            sendARPBroadcast(arpR)
+            print("Se busca la IP: " + '.'.join(['{:02d}'.format(b) for b in ip.to_bytes(4,"big")]))
+            if pending.event.wait(timeout):
+                print("Se ha resuelto")
+                return pending.mac
+            timeout = min(timeout * ARP_BACKOFF, ARP_MAX_TIMEOUT)
+    except BaseException:
+        #Un error no dice nada de la IP: se termina la resolución sin entrada negativa
+        finishResolution(pending, False)
+        raise
+
+    #Sin respuesta tras todos los reintentos: se retira la resolución, se añade la entrada negativa y se despierta al
+    #resto de hilos (con mac None)
+    finishResolution(pending, True)
+    return pending.mac
+
+
+async def resolve(ip:int) -> bytes:
+    '''
+        Nombre: resolve
+        Descripción: Versión asíncrona (asyncio) de ARPResolution. En lugar de bloquear el hilo, la espera de la respuesta
+            se hace sobre un futuro del bucle de eventos, que se completa desde processARPReply (en el hilo que sea) a
+            través de los callbacks de la resolución. Comparte la caché, la tabla pendingResolutions y la temporización con
+            ARPResolution, por lo que varias corrutinas (o hilos) que resuelven la misma IP esperan a la misma petición.
+            Si se cancela la corrutina (por ejemplo con asyncio.wait_for) solo se retira su espera: si era la que enviaba
+            las peticiones, los reintentos que faltan pasan al hilo resolverThread, de modo que el resto de esperas siguen
+            y la IP solo se marca como inalcanzable si se agotan los reintentos.
+        Argumentos:
+            -ip: dirección a resolver
+        Retorno: La dirección MAC o None si no se ha recibido respuesta
+    '''
+    mac = cache.lookup(ip)
+    if mac is not None:
+        return mac
+    if cache.isUnreachable(ip):
+        return None
 
-    with cacheLock:
-        if ip in cache:
-            return cache[ip]
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    def onDone(mac):
+        loop.call_soon_threadsafe(setFutureResult, fut, mac)
 
     with globalLock:
-        awaitingResponse = True
-        requestedIP = ip
+        pending = pendingResolutions.get(ip)
+        if pending is not None:
+            owner = False
+        else:
+            pending = PendingResolution(ip)
+            pendingResolutions[ip] = pending
+            owner = True
+        pending.callbacks.append(onDone)
+
+    if not owner:
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            removeResolutionCallback(pending, onDone)
+            raise
 
-    
     arpR = createARPRequest(ip)
+    timeout = ARP_TIMEOUT
+    sent = 0
+
+    try:
+        while sent < ARP_RETRIES:
+            sendARPBroadcast(arpR)
+            sent += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except asyncio.TimeoutError:
+                pass
+            timeout = min(timeout * ARP_BACKOFF, ARP_MAX_TIMEOUT)
+    except asyncio.CancelledError:
+        #Solo se retira esta espera. La resolución sigue en el hilo resolverThread, que espera lo que queda del
+        #tiempo de espera actual, hace los reintentos que faltan y decide si la IP es inalcanzable
+        removeResolutionCallback(pending, onDone)
+        scheduleResolution(pending, arpR, time.monotonic() + timeout, sent, min(timeout * ARP_BACKOFF, ARP_MAX_TIMEOUT))
+        raise
+    except BaseException:
+        finishResolution(pending, False)
+        raise
+
+    finishResolution(pending, True)
+    return pending.mac
+
+
+def requestResolution(ip:int, callback) -> None:
+    '''
+        Nombre: requestResolution
+        Descripción: Versión sin bloqueo de ARPResolution. Si la IP está en la caché o tiene una entrada negativa vigente se
+            llama a callback en el acto. Si no, callback se añade a la resolución en curso para esa IP o se crea una nueva
+            que gestiona el hilo resolverThread (envíos, reintentos y entrada negativa con la misma temporización que
+            ARPResolution), y la función retorna sin esperar. callback se llama desde processARPReply al llegar la
+            respuesta o desde resolverThread al agotar los reintentos, por lo que debe ser breve y no bloquearse.
+        Argumentos:
+            -ip: dirección a resolver
+            -callback: función callback(mac) que se llama una sola vez con la MAC o None si no hay respuesta
+        Retorno: Ninguno
+    '''
+    mac = cache.lookup(ip)
+    if mac is not None or cache.isUnreachable(ip):
+        callback(mac)
+        return
 
-    i=0
+    with globalLock:
+        pending = pendingResolutions.get(ip)
+        if pending is not None:
+            pending.callbacks.append(callback)
+            return
+        pending = PendingResolution(ip)
+        pending.callbacks.append(callback)
+        pendingResolutions[ip] = pending
 
-    
-    while i < 3:
-        if awaitingResponse:
-            sendEthernetFrame(arpR, len(arpR), bytes([0x08,0x06]), broadcastAddr)
-            print("Se busca la IP: " + '.'.join(['{:02d}'.format(b) for b in ip.to_bytes(4,"big")]))
-            time.sleep(0.6)
-            i+= 1
-        else:
-            print("Se ha resuelto")
-            return resolvedMAC
-    
-    return None
+    scheduleResolution(pending, createARPRequest(ip), time.monotonic(), 0, ARP_TIMEOUT)
+
+
+def scheduleResolution(pending:PendingResolution, arpR:bytes, when:float, sent:int, timeout:float) -> None:
+    '''
+        Nombre: scheduleResolution
+        Descripción: Esta función programa el siguiente paso de una resolución en el hilo resolverThread: en el instante
+            when se envía otra petición (o se da por fallida si ya se han enviado ARP_RETRIES) y se espera timeout segundos
+        Argumentos:
+            -pending: resolución en curso (registrada en pendingResolutions)
+            -arpR: petición ARP creada con createARPRequest
+            -when: instante (time.monotonic) del siguiente paso
+            -sent: peticiones ya enviadas
+            -timeout: tiempo de espera tras la siguiente petición
+        Retorno: Ninguno
+    '''
+    global resolverSeq
+    with resolverCond:
+        resolverSeq += 1
+        heapq.heappush(resolverSchedule, (when, resolverSeq, pending, arpR, sent, timeout))
+        resolverCond.notify()
+
+
+def removeResolutionCallback(pending:PendingResolution, callback) -> None:
+    #Retira la función de una espera que ya no interesa (por ejemplo una corrutina cancelada)
+    with globalLock:
+        if callback in pending.callbacks:
+            pending.callbacks.remove(callback)
+
+
+def finishResolution(pending:PendingResolution, failed:bool) -> None:
+    '''
+        Nombre: finishResolution
+        Descripción: Esta función retira una resolución de pendingResolutions y la termina (completeResolution). Si no
+            ha llegado respuesta y failed es True (se han agotado los reintentos) se añade la entrada negativa de la IP
+        Argumentos:
+            -pending: resolución a terminar
+            -failed: True si se han agotado los reintentos
+        Retorno: Ninguno
+    '''
+    with globalLock:
+        if pendingResolutions.get(pending.ip) is pending:
+            del pendingResolutions[pending.ip]
+    if failed and pending.mac is None:
+        cache.markUnreachable(pending.ip)
+    completeResolution(pending)
+
+
+def resolverLoop() -> None:
+    #Hilo que envía las peticiones de las resoluciones sin bloqueo y da por fallidas las que agotan los reintentos
+    while True:
+        with resolverCond:
+            while not resolverSchedule or resolverSchedule[0][0] > time.monotonic():
+                resolverCond.wait(resolverSchedule[0][0] - time.monotonic() if resolverSchedule else None)
+            when, _, pending, arpR, sent, timeout = heapq.heappop(resolverSchedule)
+        if pending.done:
+            continue
+        if sent >= ARP_RETRIES:
+            finishResolution(pending, True)
+            continue
+        try:
+            sendARPBroadcast(arpR)
+        except Exception:
+            logging.exception('Error enviando la petición ARP')
+        logging.debug('Se busca la IP: ' + socket.inet_ntoa(pending.ip.to_bytes(4, 'big')))
+        scheduleResolution(pending, arpR, time.monotonic() + timeout, sent + 1, min(timeout * ARP_BACKOFF, ARP_MAX_TIMEOUT))
+
+
+def startResolver() -> None:
+    #Arranca el hilo de las resoluciones sin bloqueo (si no está ya arrancado)
+    global resolverThread
+    if resolverThread is not None and resolverThread.is_alive():
+        return
+    resolverThread = threading.Thread(target=resolverLoop, name='arp-resolver', daemon=True)
+    resolverThread.start()
@@ -0,0 +1,499 @@
+'''
+    benchmark.py
+    Micro-benchmarks de las partes críticas de la pila de protocolos.
+
+    Uso: python3 benchmark.py --test chksum
+    2022 EPS-UAM
+'''
+
+import argparse
+import os
+import sys
+import timeit
+from argparse import RawTextHelpFormatter
+
+
+def chksumOriginal(msg):
+    #Implementación original de ip.chksum (bucle Python de 2 en 2 bytes), como referencia de tiempos. Pliega la suma una
+    #sola vez, por lo que pierde el acarreo del plegado cuando la suma es grande y no sirve para comprobar resultados
+    s = 0
+    for i in range(0, len(msg), 2):
+        if (i+1) < len(msg):
+            s = s + (msg[i]+(msg[i+1] << 8))
+        else:
+            s += msg[i]
+    s = s + (s >> 16)
+    s = ~s & 0xffff
+    return s
+
+
+def chksumReference(msg):
+    #Checksum de RFC 1071 sumando palabra a palabra (en el mismo orden de bytes que chksum) y plegando hasta 16 bits
+    s = 0
+    for i in range(0, len(msg), 2):
+        s += msg[i] + (msg[i+1] << 8 if i + 1 < len(msg) else 0)
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+
+def timeCall(f, number:int) -> float:
+    #Devuelve el tiempo medio por llamada (en segundos) del mejor de 3 repeticiones
+    return min(timeit.repeat(f, number=number, repeat=3)) / number
+
+
+def bench_chksum(args):
+    import struct
+    from checksum import chksum, chksumPartial, chksumFold
+    print('{:>8} {:>14} {:>14} {:>10}'.format('Bytes', 'Original (us)', 'Nuevo (us)', 'Mejora'))
+    for size in (1, 20, 63, 64, 576, 1500, 9000, 16384, 65536):
+        msg = os.urandom(size)
+        assert chksum(msg) == chksumReference(msg)
+        assert chksum(bytes(size)) == chksumReference(bytes(size)) and chksum(b'\xff' * size) == chksumReference(b'\xff' * size)
+        number = max(1, 200000 // size)
+        t_old = timeCall(lambda: chksumOriginal(msg), number)
+        t_new = timeCall(lambda: chksum(msg), number * 10)
+        print('{:>8} {:>14.2f} {:>14.2f} {:>9.1f}x'.format(size, t_old * 1e6, t_new * 1e6, t_old / t_new))
+
+    #Cabecera IP a partir de una plantilla (como ip.writeIPHeader): suma parcial de la parte fija más los campos
+    #variables, frente a poner el checksum a 0 y recalcularlo sobre la cabecera completa
+    header = bytearray(os.urandom(20))
+    header[2:8] = bytes(6)
+    header[10:12] = bytes(2)
+    partial = chksumPartial(header)
+    def withTemplate():
+        struct.pack_into('!HHH', header, 2, 1500, 7, 0x2000)
+        a, b, c = struct.unpack_from('<HHH', header, 2)
+        struct.pack_into('!H', header, 10, chksumFold(partial + a + b + c))
+    def fullRecompute():
+        struct.pack_into('!HHH', header, 2, 1500, 7, 0x2000)
+        header[10:12] = bytes(2)
+        struct.pack_into('!H', header, 10, chksum(header))
+    withTemplate()
+    c1 = bytes(header)
+    fullRecompute()
+    assert bytes(header) == c1
+    t_tpl = timeCall(withTemplate, 100000)
+    t_full = timeCall(fullRecompute, 100000)
+    print('Cabecera de 20 bytes: recálculo completo {:.2f} us, plantilla {:.2f} us'.format(t_full * 1e6, t_tpl * 1e6))
+
+
+def bench_rx(args):
+    #Tramas por segundo leyendo una traza pcap con y sin el modo de recepción sin copias
+    import time
+    import ethernet
+    from rc1_pcap import pcap_open_offline, pcap_loop, pcap_close
+    if not args.file:
+        print('Se debe especificar una traza con --file')
+        sys.exit(-1)
+    def upper(us, header, data, srcMac):
+        pass
+    ethernet.registerCallback(upper, bytes([0x08,0x00]))
+    ethernet.registerCallback(upper, bytes([0x08,0x06]))
+    for zerocopy in (False, True):
+        errbuf = bytearray()
+        handle = pcap_open_offline(args.file, errbuf)
+        if not handle:
+            print('Error abriendo la traza: {}'.format(errbuf))
+            sys.exit(-1)
+        frames = [0]
+        def cb(us, header, data):
+            frames[0] += 1
+            #Para que no se descarte ninguna trama se toma como MAC propia la MAC destino de cada trama
+            ethernet.macAddress = bytes(data[:6])
+            ethernet.process_Ethernet_frame(us, header, data)
+        t = time.perf_counter()
+        pcap_loop(handle, -1, cb, None, zerocopy)
+        t = time.perf_counter() - t
+        pcap_close(handle)
+        print('{:>10}: {} tramas en {:.3f} s -> {:.0f} tramas/s'.format('sin copias' if zerocopy else 'copia', frames[0], t, frames[0] / t))
+
+
+def bench_reader(args):
+    #Paquetes por segundo leyendo una traza con libpcap (ctypes) y con el lector mmap en Python
+    import time
+    from rc1_pcap import pcap_open_offline, pcap_loop, pcap_close
+    from pcap_mmap import pcap_mmap_open_offline, pcap_mmap_loop, pcap_mmap_close
+    if not args.file:
+        print('Se debe especificar una traza con --file')
+        sys.exit(-1)
+    readers = (
+        ('libpcap', pcap_open_offline, pcap_loop, pcap_close),
+        ('libpcap sin copias', pcap_open_offline, lambda h, c, cb, u: pcap_loop(h, c, cb, u, True), pcap_close),
+        ('mmap', pcap_mmap_open_offline, pcap_mmap_loop, pcap_mmap_close),
+    )
+    for name, open_fn, loop_fn, close_fn in readers:
+        errbuf = bytearray()
+        try:
+            handle = open_fn(args.file, errbuf)
+        except AttributeError:
+            print('{:>20}: libpcap no disponible'.format(name))
+            continue
+        if not handle:
+            print('{:>20}: error abriendo la traza {}'.format(name, errbuf))
+            continue
+        stats = [0, 0]
+        def cb(us, header, data):
+            stats[0] += 1
+            stats[1] += header.caplen
+        t = time.perf_counter()
+        loop_fn(handle, -1, cb, None)
+        t = time.perf_counter() - t
+        close_fn(handle)
+        print('{:>20}: {} paquetes en {:.3f} s -> {:.0f} paquetes/s, {:.1f} MB/s'.format(name, stats[0], t, stats[0] / t, stats[1] / t / 1e6))
+
+
+def sendFrameOriginal(send, data, etherType, dstMac, srcMac):
+    #Implementación original de ethernet.sendEthernetFrame (concatenación de bytes en cada envío), como referencia.
+    #send recibe la trama ya construida (pcap_inject en el original)
+    frame = dstMac
+    frame += srcMac
+    frame += etherType
+    frame += data
+    if len(frame) < 60:
+        frame += bytes([0]*(60 - len(frame)))
+    send(bytes(frame))
+
+
+def bench_tx(args):
+    #Tramas por segundo enviadas trama a trama (implementación original y actual) y por lotes con sendEthernetFrames.
+    #Con los backends de libpcap y sin --itf se usa un handle de pcap_open_dead: se mide solo el coste en Python y ctypes
+    import time
+    import ethernet
+    from rc1_pcap import pcap_open_live, pcap_open_dead, pcap_close, pcap_inject
+    from txbackend import openTxBackend, TX_PACKET
+    handle = None
+    if args.tx == TX_PACKET:
+        if not args.itf:
+            print('El backend {} necesita una interfaz (--itf)'.format(TX_PACKET))
+            sys.exit(-1)
+    elif args.itf:
+        errbuf = bytearray()
+        handle = pcap_open_live(args.itf, 1514, 0, 10, errbuf)
+    else:
+        handle = pcap_open_dead(1, 1514)
+    if args.tx != TX_PACKET and not handle:
+        print('No se ha podido abrir el handle de pcap')
+        sys.exit(-1)
+    ethernet.macAddress = ethernet.getHwAddr(args.itf) if args.itf else bytes(6)
+    ethernet.txBackend = openTxBackend(args.tx, handle, args.itf)
+    if args.tx == TX_PACKET:
+        send = ethernet.txBackend.sock.send
+    else:
+        send = lambda frame: pcap_inject(handle, frame, len(frame))
+    etherType = bytes([0x88, 0xB5])
+    dstMac = bytes([0xFF] * 6)
+    total = 20000
+    batch = 32
+    print('Backend: {}'.format(args.tx))
+    print('{:>6} {:>16} {:>16} {:>16}'.format('Bytes', 'Original (tr/s)', 'Trama (tr/s)', 'Lote {} (tr/s)'.format(batch)))
+    for size in (64, 1514):
+        data = os.urandom(size - 14)
+        frames = [data] * batch
+        t = time.perf_counter()
+        for _ in range(total):
+            sendFrameOriginal(send, data, etherType, dstMac, ethernet.macAddress)
+        t_old = time.perf_counter() - t
+        t = time.perf_counter()
+        for _ in range(total):
+            ethernet.sendEthernetFrame(data, len(data), etherType, dstMac)
+        t_one = time.perf_counter() - t
+        t = time.perf_counter()
+        for _ in range(total // batch):
+            ethernet.sendEthernetFrames(frames, etherType, dstMac)
+        t_batch = time.perf_counter() - t
+        print('{:>6} {:>16.0f} {:>16.0f} {:>16.0f}'.format(size, total / t_old, total / t_one, (total // batch) * batch / t_batch))
+    ethernet.txBackend.close()
+    if handle:
+        pcap_close(handle)
+
+
+def bench_capture(args):
+    #Tramas por segundo capturadas con libpcap (pcap_loop) y con el anillo TPACKET_V3 (pcap_ring) mientras otro hilo
+    #envía tramas por la interfaz. Se puede usar --itf lo o un par veth en un namespace de red
+    import socket
+    import threading
+    import time
+    from rc1_pcap import pcap_open_live, pcap_loop, pcap_breakloop, pcap_close
+    from pcap_ring import pcap_ring_open_live, pcap_ring_loop, pcap_ring_breakloop, pcap_ring_close
+    if not args.itf:
+        print('Se debe especificar una interfaz con --itf')
+        sys.exit(-1)
+    total = 200000
+    frame = bytes([0xFF] * 6) + bytes(6) + bytes([0x88, 0xB5]) + bytes(50)
+    backends = (
+        ('libpcap', pcap_open_live, pcap_loop, pcap_breakloop, pcap_close),
+        ('anillo TPACKET_V3', pcap_ring_open_live, pcap_ring_loop, pcap_ring_breakloop, pcap_ring_close),
+    )
+    for name, open_fn, loop_fn, break_fn, close_fn in backends:
+        errbuf = bytearray()
+        try:
+            handle = open_fn(args.itf, 1514, 1, 100, errbuf)
+        except AttributeError:
+            print('{:>20}: libpcap no disponible'.format(name))
+            continue
+        if not handle:
+            print('{:>20}: error abriendo la interfaz {}'.format(name, errbuf))
+            continue
+        count = [0]
+        def cb(us, header, data):
+            count[0] += 1
+        rx = threading.Thread(target=loop_fn, args=(handle, -1, cb, None))
+        rx.start()
+        tx = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        tx.bind((args.itf, 0))
+        t = time.perf_counter()
+        for _ in range(total):
+            tx.send(frame)
+        #Se espera a que el hilo de captura deje de recibir tramas
+        last = -1
+        while last != count[0]:
+            last = count[0]
+            time.sleep(0.2)
+        t = time.perf_counter() - t - 0.2
+        break_fn(handle)
+        rx.join()
+        close_fn(handle)
+        tx.close()
+        print('{:>20}: {} de {} tramas en {:.3f} s -> {:.0f} tramas/s'.format(name, count[0], total, t, count[0] / t))
+
+
+def bench_filter(args):
+    #CPU del hilo de captura con y sin el filtro en el núcleo reinyectando por --itf una traza de una LAN cargada
+    #(--file) o, si no se indica, una traza sintética con un 5% de tramas para nosotros
+    import random
+    import socket
+    import threading
+    import time
+    import ethernet
+    from rc1_pcap import pcap_open_live, pcap_loop, pcap_breakloop, pcap_close
+    from pcap_ring import pcap_ring_open_live, pcap_ring_loop, pcap_ring_breakloop, pcap_ring_close
+    from pcap_mmap import pcap_mmap_open_offline, pcap_mmap_iter, pcap_mmap_close
+    if not args.itf:
+        print('Se debe especificar una interfaz con --itf')
+        sys.exit(-1)
+    ourMac = bytes([0x02, 0, 0, 0, 0, 0x01])
+    if args.file:
+        errbuf = bytearray()
+        trace = pcap_mmap_open_offline(args.file, errbuf)
+        if not trace:
+            print('Error abriendo la traza: {}'.format(errbuf))
+            sys.exit(-1)
+        frames = [bytes(data) for header, data in pcap_mmap_iter(trace)]
+        pcap_mmap_close(trace)
+        #Se toma como MAC propia la MAC destino unicast más frecuente de la traza
+        dsts = {}
+        for f in frames:
+            if not f[0] & 1:
+                dsts[f[:6]] = dsts.get(f[:6], 0) + 1
+        if dsts:
+            ourMac = max(dsts, key=dsts.get)
+    else:
+        rnd = random.Random(0)
+        frames = []
+        for i in range(100000):
+            dst = ourMac if i % 20 == 0 else bytes([0x02] + [rnd.randrange(256) for _ in range(5)])
+            etherType = rnd.choice((bytes([0x08, 0x00]), bytes([0x08, 0x06]), bytes([0x86, 0xDD])))
+            frames.append(dst + bytes([0x02] * 6) + etherType + bytes(rnd.randrange(46, 1000)))
+    def upper(us, header, data, srcMac):
+        pass
+    ethernet.registerCallback(upper, bytes([0x08, 0x00]))
+    ethernet.registerCallback(upper, bytes([0x08, 0x06]))
+    types = ethernet.registeredEthertypes()
+    ethernet.macAddress = ourMac
+    backends = (
+        ('libpcap', pcap_open_live, pcap_loop, pcap_breakloop, pcap_close),
+        ('anillo TPACKET_V3', pcap_ring_open_live, pcap_ring_loop, pcap_ring_breakloop, pcap_ring_close),
+    )
+    print('{} tramas, MAC propia {}'.format(len(frames), ourMac.hex(':')))
+    for name, open_fn, loop_fn, break_fn, close_fn in backends:
+        for filtered in (False, True):
+            errbuf = bytearray()
+            try:
+                handle = open_fn(args.itf, 1514, 1, 100, errbuf)
+            except AttributeError:
+                print('{:>20}: libpcap no disponible'.format(name))
+                break
+            if not handle:
+                print('{:>20}: error abriendo la interfaz {}'.format(name, errbuf))
+                break
+            if filtered:
+                if open_fn is pcap_ring_open_live:
+                    ethernet.ringHandle = handle
+                else:
+                    ethernet.handle = handle
+                ethernet.updateCaptureFilter()
+                ethernet.ringHandle = None
+                ethernet.handle = None
+            count = [0]
+            cpu = [0.0]
+            def cb(us, header, data):
+                count[0] += 1
+                ethernet.process_Ethernet_frame(us, header, data)
+            def rx():
+                t = time.thread_time()
+                loop_fn(handle, -1, cb, None)
+                cpu[0] = time.thread_time() - t
+            th = threading.Thread(target=rx)
+            th.start()
+            tx = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+            tx.bind((args.itf, 0))
+            for f in frames:
+                tx.send(f)
+            last = -1
+            while last != count[0]:
+                last = count[0]
+                time.sleep(0.2)
+            break_fn(handle)
+            th.join()
+            close_fn(handle)
+            tx.close()
+            print('{:>20} {:>10}: {:>7} tramas entregadas, CPU del hilo de captura {:.3f} s'.format(name,
+                'con filtro' if filtered else 'sin filtro', count[0], cpu[0]))
+
+
+def bench_udpcsum(args):
+    #Coste por datagrama del checksum UDP: pseudo-cabecera cacheada frente a construirla en cada envío, comprobación
+    #en recepción y la implementación original de chksum sobre pseudo-cabecera + datagrama
+    import struct
+    from checksum import chksumPartial, pseudoHeaderPartial, transportChecksum, transportChecksumValid
+    src, dst = 0x0a000001, 0x0a000002
+    print('{:>8} {:>16} {:>16} {:>16} {:>16}'.format('Bytes', 'Original (us)', 'Sin caché (us)', 'Con caché (us)',
+        'Comprobar (us)'))
+    for size in (8, 64, 512, 1472, 8972):
+        segment = bytearray(os.urandom(size))
+        segment[6:8] = b'\x00\x00'
+        number = max(1, 200000 // size)
+
+        def uncached():
+            pseudo = struct.pack('!IIxBH', src, dst, 17, len(segment))
+            return transportChecksum(chksumPartial(pseudo[:10]), segment)
+
+        t_old = timeCall(lambda: chksumOriginal(struct.pack('!IIxBH', src, dst, 17, len(segment)) + segment), number)
+        t_unc = timeCall(uncached, number * 10)
+        t_new = timeCall(lambda: transportChecksum(pseudoHeaderPartial(src, dst, 17), segment), number * 10)
+        struct.pack_into('!H', segment, 6, transportChecksum(pseudoHeaderPartial(src, dst, 17), segment))
+        assert transportChecksumValid(pseudoHeaderPartial(dst, src, 17), segment)
+        t_ver = timeCall(lambda: transportChecksumValid(pseudoHeaderPartial(dst, src, 17), segment), number * 10)
+        print('{:>8} {:>16.2f} {:>16.2f} {:>16.2f} {:>16.2f}'.format(size, t_old * 1e6, t_unc * 1e6, t_new * 1e6, t_ver * 1e6))
+
+
+class LockedNeighborCacheOriginal():
+    #Caché de vecinos con un único cerrojo para consultas y escrituras (diseño anterior de neighbor.NeighborCache,
+    #LRU con OrderedDict), como referencia
+    def __init__(self, capacity:int):
+        import threading
+        import time
+        from collections import OrderedDict
+        self.clock = time.monotonic
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.capacity = capacity
+        self.hits = self.misses = 0
+
+    def lookup(self, ip:int) -> bytes:
+        now = self.clock()
+        with self.lock:
+            n = self.entries.get(ip)
+            if n is None or now - n[1] < 0:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(ip)
+            self.hits += 1
+            return n[0]
+
+    def confirm(self, ip:int, mac:bytes):
+        with self.lock:
+            if ip not in self.entries and len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+            self.entries[ip] = (mac, self.clock())
+            self.entries.move_to_end(ip)
+
+
+def bench_neighbor(args):
+    #Consultas por segundo a la caché ARP con varios hilos emisores y un hilo que confirma entradas (respuestas ARP)
+    import random
+    import threading
+    import time
+    from neighbor import NeighborCache
+    hosts = 1000
+    lookups = 100000
+    print('{:>7} {:>22} {:>22} {:>8}'.format('Hilos', 'Con cerrojo (consultas/s)', 'Sin cerrojo (consultas/s)', 'Mejora'))
+    for nthreads in (1, 2, 4, 8):
+        results = []
+        for cache in (LockedNeighborCacheOriginal(4096), NeighborCache(4096)):
+            for ip in range(hosts):
+                cache.confirm(ip, bytes(6))
+            stop = threading.Event()
+            def writer():
+                while not stop.is_set():
+                    cache.confirm(random.randrange(hosts), bytes(6))
+                    time.sleep(0.0001)
+            def reader(ips):
+                lookup = cache.lookup
+                for ip in ips:
+                    lookup(ip)
+            ips = [random.randrange(hosts) for _ in range(lookups)]
+            threads = [threading.Thread(target=reader, args=(ips,)) for _ in range(nthreads)]
+            w = threading.Thread(target=writer)
+            w.start()
+            start = time.perf_counter()
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            w.join()
+            results.append(nthreads * lookups / elapsed)
+        print('{:>7} {:>22.0f} {:>22.0f} {:>7.2f}x'.format(nthreads, results[0], results[1], results[1] / results[0]))
+
+
+def bench_rtt(args):
+    #Coste por respuesta de RTTStats.add y memoria usada según el número de respuestas acumuladas, frente a guardar
+    #todas las muestras en una lista
+    import random
+    import time
+    from rttstats import RTTStats
+    print('{:>10} {:>16} {:>18} {:>16} {:>18}'.format('Respuestas', 'add (ns/resp)', 'Percentiles (ms)',
+        'Lista (bytes)', 'Histograma (bytes)'))
+    for n in (10000, 100000, 1000000):
+        samples = [int(random.lognormvariate(8, 1)) for _ in range(n)]
+        stats = RTTStats()
+        add = stats.add
+        start = time.perf_counter()
+        for rtt in samples:
+            add(rtt)
+        t_add = (time.perf_counter() - start) / n
+        start = time.perf_counter()
+        for p in (50, 90, 99, 99.9):
+            stats.percentile(p)
+        t_query = time.perf_counter() - start
+        listBytes = sys.getsizeof(samples) + sum(sys.getsizeof(v) for v in samples)
+        #Los enteros pequeños (hasta 256) son objetos compartidos por el intérprete
+        histBytes = sys.getsizeof(stats.histogram.counts) + sum(sys.getsizeof(c) for c in stats.histogram.counts if c > 256)
+        print('{:>10} {:>16.0f} {:>18.3f} {:>16} {:>18}'.format(n, t_add * 1e9, t_query * 1e3, listBytes, histBytes))
+
+
+BENCHMARKS = {
+    'chksum': bench_chksum,
+    'rx': bench_rx,
+    'reader': bench_reader,
+    'tx': bench_tx,
+    'capture': bench_capture,
+    'filter': bench_filter,
+    'rtt': bench_rtt,
+    'udpcsum': bench_udpcsum,
+    'neighbor': bench_neighbor,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de la pila de protocolos',
+    formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--test', dest='test', choices=sorted(BENCHMARKS), required=True, help='Benchmark a ejecutar')
+    parser.add_argument('--file', dest='file', default=False, help='Traza pcap a usar en los benchmarks de recepción y filtro')
+    parser.add_argument('--itf', dest='itf', default=None, help='Interfaz a usar en los benchmarks de envío y captura')
+    parser.add_argument('--tx', dest='tx', default='inject', choices=('inject', 'sendpacket', 'packet'), help='Backend de envío para el benchmark tx')
+    args = parser.parse_args()
+    BENCHMARKS[args.test](args)
+    sys.exit(0)
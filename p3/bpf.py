@@ -0,0 +1,104 @@
+'''
+    bpf.py
+    Filtros de captura en el núcleo para el nivel Ethernet.
+    El filtro deja pasar solo las tramas dirigidas a nuestra MAC o a broadcast con alguno de los Ethertypes registrados,
+    que son las únicas que procesa process_Ethernet_frame. Se puede generar de dos formas:
+        -Como expresión de filtro de libpcap, para compilarla con pcap_compile y aplicarla con pcap_setfilter
+        -Como programa BPF clásico ensamblado a mano, para aplicarlo con SO_ATTACH_FILTER a un socket AF_PACKET (por
+        ejemplo el del anillo de pcap_ring), sin necesidad de libpcap
+    2022 EPS-UAM
+'''
+
+import ctypes
+import socket
+import struct
+
+#Códigos de instrucción BPF clásico (linux/filter.h)
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_JEQ_K = 0x15
+BPF_RET_K = 0x06
+#Opciones de socket
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+#Longitud máxima aceptada por el filtro
+BPF_ACCEPT_LEN = 0x40000
+
+
+def filterExpression(mac:bytes, ethertypes:list) -> str:
+    '''
+        Nombre: filterExpression
+        Descripción: Genera la expresión de filtro de libpcap para una MAC y una lista de Ethertypes
+        Argumentos:
+            -mac: bytes con nuestra dirección MAC
+            -ethertypes: lista de Ethertypes (enteros). Si está vacía no se filtra por Ethertype
+        Retorno: Cadena con la expresión
+    '''
+    expr = '(ether dst {} or ether broadcast)'.format(':'.join('{:02x}'.format(b) for b in mac))
+    if ethertypes:
+        expr += ' and (' + ' or '.join('ether proto 0x{:04x}'.format(t) for t in sorted(ethertypes)) + ')'
+    return expr
+
+
+def filterProgram(mac:bytes, ethertypes:list) -> list:
+    '''
+        Nombre: filterProgram
+        Descripción: Ensambla el programa BPF clásico equivalente a filterExpression
+        Argumentos:
+            -mac: bytes con nuestra dirección MAC
+            -ethertypes: lista de Ethertypes (enteros). Si está vacía no se filtra por Ethertype
+        Retorno: Lista de instrucciones (code, jt, jf, k). Los saltos son relativos a la instrucción siguiente
+    '''
+    types = sorted(ethertypes)
+    macHi, macLo = struct.unpack('!HI', mac)
+    #Posiciones de las instrucciones de destino
+    checkType = 8
+    drop = checkType + 1 + len(types)
+    accept = drop + 1
+    prog = [
+        (BPF_LD_W_ABS, 0, 0, 2),                        #0: A = bytes 2-5 de la MAC destino
+        (BPF_JEQ_K, 0, 4 - 1 - 1, macLo),               #1: si no coincide -> 4 (comprobar broadcast)
+        (BPF_LD_H_ABS, 0, 0, 0),                        #2: A = bytes 0-1 de la MAC destino
+        (BPF_JEQ_K, checkType - 3 - 1, 0, macHi),       #3: si coincide -> comprobar Ethertype
+        (BPF_LD_W_ABS, 0, 0, 2),                        #4
+        (BPF_JEQ_K, 0, drop - 5 - 1, 0xFFFFFFFF),       #5: no es broadcast -> descartar
+        (BPF_LD_H_ABS, 0, 0, 0),                        #6
+        (BPF_JEQ_K, 0, drop - 7 - 1, 0xFFFF),           #7
+    ]
+    if types:
+        prog.append((BPF_LD_H_ABS, 0, 0, 12))           #8: A = Ethertype
+        for i, t in enumerate(types):
+            pos = checkType + 1 + i
+            prog.append((BPF_JEQ_K, accept - pos - 1, 0, t))
+    else:
+        prog.append((BPF_RET_K, 0, 0, BPF_ACCEPT_LEN))  #8: sin Ethertypes se acepta cualquier trama para nosotros
+    prog.append((BPF_RET_K, 0, 0, 0))                   #descartar
+    prog.append((BPF_RET_K, 0, 0, BPF_ACCEPT_LEN))      #aceptar
+    return prog
+
+
+class _sock_filter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_uint16), ('jt', ctypes.c_uint8), ('jf', ctypes.c_uint8), ('k', ctypes.c_uint32)]
+
+
+def attachFilter(sock:socket.socket, prog:list):
+    '''
+        Nombre: attachFilter
+        Descripción: Aplica un programa BPF clásico a un socket con SO_ATTACH_FILTER (sustituye al anterior)
+        Argumentos:
+            -sock: socket (AF_PACKET)
+            -prog: lista de instrucciones (code, jt, jf, k) generada con filterProgram
+        Retorno: Ninguno. Lanza OSError si el núcleo rechaza el programa
+    '''
+    insns = (_sock_filter * len(prog))(*prog)
+    #struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+    fprog = struct.pack('HL', len(prog), ctypes.addressof(insns))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def detachFilter(sock:socket.socket):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except OSError:
+        #No había filtro
+        pass
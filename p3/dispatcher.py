@@ -0,0 +1,177 @@
+'''
+    dispatcher.py
+    Despachador de tramas recibidas basado en un conjunto fijo de hilos trabajadores con colas acotadas.
+    Sustituye la creación de un hilo nuevo por cada trama en ethernet.process_frame.
+    2022 EPS-UAM
+'''
+
+import logging
+import threading
+from collections import deque
+
+#Políticas de desbordamiento de las colas de los trabajadores
+#Se descarta la trama que llega
+DROP_NEWEST = 'drop-newest'
+#Se descarta la trama más antigua de la cola para hacer hueco a la nueva
+DROP_OLDEST = 'drop-oldest'
+#El hilo de recepción espera a que haya hueco en la cola
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+#Valores por defecto
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_LEN = 256
+#Ethertype de ARP. Las tramas ARP tienen un trabajador reservado
+ETHERTYPE_ARP = 0x0806
+
+
+def flowKey(data) -> int:
+    '''
+        Nombre: flowKey
+        Descripción: Esta función calcula la clave de flujo de una trama Ethernet a partir del Ethertype y de la
+            dirección MAC origen. Todas las tramas de un mismo flujo se procesan en orden por el mismo trabajador.
+        Argumentos:
+            -data: bytes o memoryview con el contenido de la trama Ethernet
+        Retorno: Entero con la clave del flujo
+    '''
+    return hash(bytes(data[6:14]))
+
+
+class _Worker(threading.Thread):
+    ''' Hilo trabajador con su propia cola acotada. Procesa las tramas en orden de llegada.
+    '''
+    def __init__(self, dispatcher, index:int, maxlen:int):
+        threading.Thread.__init__(self, name='frame-worker-{}'.format(index))
+        self.daemon = True
+        self.dispatcher = dispatcher
+        self.queue = deque()
+        self.maxlen = maxlen
+        self.cond = threading.Condition()
+        self.running = True
+        #Contadores propios del trabajador (protegidos por cond)
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+
+    def put(self, item, policy:str) -> bool:
+        with self.cond:
+            if len(self.queue) >= self.maxlen:
+                if policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif policy == DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    while self.running and len(self.queue) >= self.maxlen:
+                        self.cond.wait()
+                    if not self.running:
+                        self.dropped += 1
+                        return False
+            self.queue.append(item)
+            self.enqueued += 1
+            self.cond.notify_all()
+            return True
+
+    def run(self):
+        callback = self.dispatcher.callback
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                us, header, data = self.queue.popleft()
+                #Avisamos a un posible productor bloqueado por cola llena
+                self.cond.notify_all()
+            try:
+                callback(us, header, data)
+            except Exception:
+                with self.cond:
+                    self.errors += 1
+                logging.exception('Error procesando una trama')
+            with self.cond:
+                self.processed += 1
+
+    def stop(self, drain:bool):
+        with self.cond:
+            self.running = False
+            if not drain:
+                self.dropped += len(self.queue)
+                self.queue.clear()
+            self.cond.notify_all()
+
+
+class FrameDispatcher():
+    ''' Despachador de tramas con un número fijo de hilos trabajadores.
+        Cada trabajador tiene una cola acotada. La trama se asigna a un trabajador en función de su clave de flujo
+        (Ethertype + MAC origen), por lo que las tramas de un mismo emisor y protocolo se procesan en orden.
+        Las tramas ARP se procesan en un trabajador reservado para que una resolución ARP bloqueada en otro trabajador
+        (por ejemplo al contestar a un ping) nunca espere a una respuesta ARP encolada detrás de ella.
+    '''
+    def __init__(self, callback, workers:int = DEFAULT_WORKERS, queueLen:int = DEFAULT_QUEUE_LEN, policy:str = DROP_NEWEST):
+        '''
+            Argumentos:
+                -callback: función a ejecutar por cada trama con prototipo funcion(us,header,data)
+                -workers: número de hilos trabajadores
+                -queueLen: longitud máxima de la cola de cada trabajador
+                -policy: política de desbordamiento (DROP_NEWEST, DROP_OLDEST o BLOCK)
+        '''
+        if workers < 1:
+            raise ValueError('El número de trabajadores debe ser al menos 1')
+        if queueLen < 1:
+            raise ValueError('La longitud de la cola debe ser al menos 1')
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Política de desbordamiento no soportada: {}'.format(policy))
+        self.callback = callback
+        self.policy = policy
+        self.workers = [_Worker(self, i, queueLen) for i in range(workers)]
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        for w in self.workers:
+            w.start()
+        self.started = True
+
+    def stop(self, drain:bool = False, timeout:float = 1.0):
+        '''
+            Para los trabajadores. Si drain es True se procesan antes las tramas ya encoladas.
+        '''
+        for w in self.workers:
+            w.stop(drain)
+        if self.started:
+            for w in self.workers:
+                w.join(timeout)
+        self.started = False
+
+    def selectWorker(self, data):
+        n = len(self.workers)
+        if n == 1:
+            return self.workers[0]
+        if len(data) >= 14 and (data[12] << 8 | data[13]) == ETHERTYPE_ARP:
+            return self.workers[0]
+        return self.workers[1 + flowKey(data) % (n - 1)]
+
+    def dispatch(self, us, header, data) -> bool:
+        '''
+            Encola una trama para su procesado en el trabajador que corresponde a su flujo.
+            Retorno: True si la trama se ha encolado y False si se ha descartado
+        '''
+        return self.selectWorker(data).put((us, header, data), self.policy)
+
+    def stats(self) -> dict:
+        '''
+            Devuelve un diccionario con los contadores agregados y la ocupación de cada cola.
+        '''
+        s = {'enqueued': 0, 'dropped': 0, 'processed': 0, 'errors': 0, 'queued': []}
+        for w in self.workers:
+            with w.cond:
+                s['enqueued'] += w.enqueued
+                s['dropped'] += w.dropped
+                s['processed'] += w.processed
+                s['errors'] += w.errors
+                s['queued'].append(len(w.queue))
+        return s
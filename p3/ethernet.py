@@ -12,6 +12,11 @@ import struct
 from binascii import hexlify
 import struct 
 import threading 
+from dispatcher import *
+from pcap_mmap import *
+from txbackend import *
+from pcap_ring import *
+from bpf import *
 
 #Tamaño máximo de una trama Ethernet (para las prácticas)
 ETH_FRAME_MAX = 1514
@@ -24,6 +29,27 @@ TO_MS = 10
 broadcastAddr = bytes([0xFF]*6)
 #Diccionario que alamacena para un Ethertype dado qué función de callback se debe ejecutar
 upperProtos = {}
+#Despachador de tramas recibidas (conjunto fijo de hilos). Si es None se crea un hilo por trama
+dispatcher = None
+#Recepción sin copias: pcap_loop entrega memoryviews sobre el buffer de libpcap (ver startEthernetLevel)
+zeroCopyRx = False
+#Recepción por lotes: número máximo de tramas por llamada a pcap_dispatch_batch (0 = pcap_loop trama a trama)
+rxBatch = 0
+#Pool de buffers de transmisión y backend de envío (se abre en startEthernetLevel)
+txPool = TxBufferPool()
+txBackend = None
+#Backends de captura: libpcap (pcap_loop) o anillo TPACKET_V3 propio (pcap_ring)
+RX_PCAP = 'pcap'
+RX_RING = 'ring'
+RX_BACKENDS = (RX_PCAP, RX_RING)
+rxBackend = RX_PCAP
+#Handle de la captura con anillo (solo con RX_RING)
+ringHandle = None
+#Handle de libpcap y MAC propia (se inicializan en startEthernetLevel)
+handle = None
+macAddress = None
+#Filtro de captura en el núcleo generado a partir de macAddress, broadcast y los Ethertypes de upperProtos
+captureFilter = True
 
 def getHwAddr(interface:str):
     '''
@@ -61,23 +87,24 @@ def process_Ethernet_frame(us:ctypes.c_void_p,header:pcap_pkthdr,data:bytes) ->
             -data: bytearray con el contenido de la trama Ethernet
         Retorno:
             -Ninguno
+        Los datos se recorren a través de un memoryview, por lo que el payload que se pasa al nivel superior no es una copia.
     '''
     global macAddress
     
-    data = bytes(data)
+    data = memoryview(data)
     
     eth_dest = data[:6]
-    eth_org = data[6:12]
-    eth_type = data[12:14]
     
     if eth_dest != macAddress and eth_dest != broadcastAddr:
         return
     
-    eth_r = struct.unpack('h', eth_type)
+    eth_r = struct.unpack_from('h', data, 12)
     
     if not eth_r in upperProtos:
         return
     
+    eth_org = bytes(data[6:12])
+    
     f = upperProtos[eth_r]
     
     f(us, header, data[14:], eth_org)
@@ -87,16 +114,103 @@ def process_frame(us:ctypes.c_void_p,header:pcap_pkthdr,data:bytes) -> None:
     '''
         Nombre: process_frame
         Descripción: Esta función se pasa a pcap_loop y se ejecutará cada vez que llegue una trama. La función
-        ejecutará la función process_Ethernet_frame en un hilo nuevo para evitar interbloqueos entre 2 recepciones
-        consecutivas de tramas dependientes. Esta función NO debe modifciarse
+        entrega la trama al despachador (dispatcher), que ejecutará process_Ethernet_frame en uno de sus hilos trabajadores
+        para evitar interbloqueos entre 2 recepciones consecutivas de tramas dependientes. Si no hay despachador
+        configurado se ejecuta process_Ethernet_frame en un hilo nuevo.
         Argumentos:
             -us: datos de usuarios pasados desde pcap_loop (en nuestro caso será None)
             -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
-            -data: bytearray con el contenido de la trama Ethernet
+            -data: bytearray con el contenido de la trama Ethernet. En modo sin copias (zeroCopyRx) es un memoryview
+            que solo es válido durante la llamada: las tramas que no son para nosotros se descartan sin copiarlas y el resto
+            se copia antes de pasarlas a otro hilo.
         Retorno:
             -Ninguno
     '''
-    threading.Thread(target=process_Ethernet_frame,args=(us,header,data)).start()
+    if isinstance(data, memoryview):
+        eth_dest = data[:6]
+        if eth_dest != macAddress and eth_dest != broadcastAddr:
+            return
+        data = bytes(data)
+    if dispatcher is not None:
+        dispatcher.dispatch(us,header,data)
+    else:
+        threading.Thread(target=process_Ethernet_frame,args=(us,header,data)).start()
+
+
+def replayTrace(fname:str, cnt:int = -1) -> int:
+    '''
+        Nombre: replayTrace
+        Descripción: Esta función inyecta en la pila las tramas de una traza pcap como si se hubieran recibido por la interfaz.
+            La traza se lee con el lector mmap (pcap_mmap), por lo que no se necesita libpcap. Se usa la dirección MAC
+            propia (macAddress) ya configurada para decidir qué tramas son para nosotros.
+        Argumentos:
+            -fname: ruta de la traza pcap
+            -cnt: número máximo de tramas a inyectar (-1 para todas)
+        Retorno: Número de tramas leídas o -1 si no se ha podido abrir la traza
+    '''
+    errbuf = bytearray()
+    h = pcap_mmap_open_offline(fname, errbuf)
+    if h is None:
+        logging.error('Error abriendo la traza {}: {}'.format(fname, errbuf.decode('utf-8')))
+        return -1
+    n = [0]
+    def replay(us, header, data):
+        n[0] += 1
+        process_frame(us, header, data)
+    pcap_mmap_loop(h, cnt, replay, None)
+    pcap_mmap_close(h)
+    return n[0]
+
+
+def process_frame_batch(batch:pcap_batch) -> None:
+    '''
+        Nombre: process_frame_batch
+        Descripción: Esta función procesa un lote de tramas obtenido con pcap_dispatch_batch, pasando cada una a process_frame.
+            Las tramas del lote son memoryview sobre el buffer del lote, que se reutiliza en la siguiente captura,
+            por lo que process_frame las copia antes de entregarlas a otro hilo.
+        Argumentos:
+            -batch: lote de tramas (pcap_batch)
+        Retorno:
+            -Ninguno
+    '''
+    for header,data in batch:
+        process_frame(None,header,data)
+
+
+def setFrameDispatcher(workers:int = DEFAULT_WORKERS, queueLen:int = DEFAULT_QUEUE_LEN, policy:str = DROP_NEWEST) -> FrameDispatcher:
+    '''
+        Nombre: setFrameDispatcher
+        Descripción: Esta función configura el despachador de tramas recibidas. Si ya había uno se para (descartando
+            las tramas pendientes) y se sustituye por el nuevo. Si workers es 0 se vuelve al modo de un hilo por trama.
+        Argumentos:
+            -workers: número de hilos trabajadores. Se recomiendan al menos 2 para que ARP tenga su propio trabajador
+            -queueLen: número máximo de tramas encoladas por trabajador
+            -policy: política de desbordamiento de las colas (DROP_NEWEST, DROP_OLDEST o BLOCK)
+        Retorno: El despachador creado o None
+    '''
+    global dispatcher
+    old = dispatcher
+    if workers > 0:
+        new = FrameDispatcher(process_Ethernet_frame, workers, queueLen, policy)
+        new.start()
+    else:
+        new = None
+    dispatcher = new
+    if old is not None:
+        old.stop()
+    return new
+
+
+def getDispatcherStats() -> dict:
+    '''
+        Nombre: getDispatcherStats
+        Descripción: Esta función devuelve los contadores de tramas encoladas, descartadas y procesadas por el despachador
+        Argumentos: Ninguno
+        Retorno: Diccionario con los contadores o None si no hay despachador
+    '''
+    if dispatcher is None:
+        return None
+    return dispatcher.stats()
 
 
 class rxThread(threading.Thread): 
@@ -106,16 +220,36 @@ class rxThread(threading.Thread):
     '''
     def __init__(self): 
         threading.Thread.__init__(self) 
+        self.running = True
               
     def run(self): 
         global handle
+        #Con el anillo TPACKET_V3 las tramas se entregan a process_frame igual que con pcap_loop
+        if rxBackend == RX_RING:
+            if ringHandle is not None:
+                pcap_ring_loop(ringHandle,-1,process_frame,None)
+            return
         #Ejecuta pcap_loop. OJO: handle debe estar inicializado con el resultado de pcap_open_live
-        if handle is not None:
-            pcap_loop(handle,-1,process_frame,None)
+        if handle is None:
+            return
+        if rxBatch > 0:
+            #Modo por lotes: cada llamada a pcap_dispatch devuelve todas las tramas disponibles (hasta rxBatch) de una vez
+            batch = pcap_batch(rxBatch)
+            while self.running:
+                pcap_dispatch_batch(handle,rxBatch,batch)
+                if batch.ret < 0:
+                    break
+                process_frame_batch(batch)
+        else:
+            pcap_loop(handle,-1,process_frame,None,zeroCopyRx)
     def stop(self):
         global handle
         #Para la ejecución de pcap_loop
-        if handle is not None:
+        self.running = False
+        if rxBackend == RX_RING:
+            if ringHandle is not None:
+                pcap_ring_breakloop(ringHandle)
+        elif handle is not None:
             pcap_breakloop(handle)
 
 
@@ -147,9 +281,75 @@ def registerCallback(callback_func: Callable[[ctypes.c_void_p,pcap_pkthdr,bytes]
     #logging.debug('Función no implementada')
 
     upperProtos[struct.unpack('h',ethertype)] = callback_func
+    #El filtro de captura se regenera para dejar pasar también el nuevo Ethertype
+    updateCaptureFilter()
+
+
+def registeredEthertypes() -> list:
+    #Ethertypes (enteros) con callback registrado. Las claves de upperProtos están en el orden de bytes de la máquina
+    return [int.from_bytes(struct.pack('h',k[0]),'big') for k in upperProtos]
+
+
+def updateCaptureFilter() -> int:
+    '''
+        Nombre: updateCaptureFilter
+        Descripción: Esta función aplica al handle de captura abierto un filtro que solo deja pasar las tramas dirigidas a
+            nuestra MAC o a broadcast con alguno de los Ethertypes registrados. Con libpcap la expresión se compila con
+            pcap_compile y se aplica con pcap_setfilter; con el anillo (RX_RING) se aplica un programa BPF clásico con
+            SO_ATTACH_FILTER. No hace nada si el filtro está desactivado (setCaptureFilter) o no hay captura abierta.
+        Argumentos: Ninguno
+        Retorno: 0 si todo es correcto, -1 en otro caso
+    '''
+    if not captureFilter or macAddress is None:
+        return 0
+    types = registeredEthertypes()
+    if ringHandle is not None:
+        try:
+            pcap_ring_setfilter(ringHandle, filterProgram(macAddress, types))
+        except OSError as e:
+            logging.error('Error aplicando el filtro de captura: {}'.format(e))
+            return -1
+    elif handle:
+        return applyPcapFilter(filterExpression(macAddress, types))
+    return 0
+
+
+def applyPcapFilter(expr:str) -> int:
+    #Compila y aplica una expresión de filtro de libpcap al handle de captura
+    fp = bpf_program()
+    if pcap_compile(handle, fp, expr, 1, PCAP_NETMASK_UNKNOWN) != 0:
+        logging.error('Error compilando el filtro "{}": {}'.format(expr, pcap_geterr(handle)))
+        return -1
+    ret = pcap_setfilter(handle, fp)
+    pcap_freecode(fp)
+    if ret != 0:
+        logging.error('Error aplicando el filtro de captura: {}'.format(pcap_geterr(handle)))
+        return -1
+    logging.debug('Filtro de captura: {}'.format(expr))
+    return 0
+
+
+def setCaptureFilter(enabled:bool) -> int:
+    '''
+        Nombre: setCaptureFilter
+        Descripción: Esta función activa o desactiva el filtro de captura en el núcleo (activado por defecto)
+        Argumentos:
+            -enabled: True para generar y aplicar el filtro, False para quitarlo y capturar todas las tramas
+        Retorno: 0 si todo es correcto, -1 en otro caso
+    '''
+    global captureFilter
+    captureFilter = enabled
+    if enabled:
+        return updateCaptureFilter()
+    if ringHandle is not None:
+        pcap_ring_setfilter(ringHandle, None)
+    elif handle:
+        #La expresión vacía acepta todas las tramas
+        return applyPcapFilter('')
+    return 0
     
 
-def startEthernetLevel(interface:str) -> int:
+def startEthernetLevel(interface:str, zerocopy:bool = False, batch:int = 0, tx:str = TX_INJECT, rx:str = RX_PCAP, background:bool = True) -> int:
     '''
         Nombre: startEthernetLevel
         Descripción: Esta función recibe el nombre de una interfaz de red e inicializa el nivel Ethernet. 
@@ -157,13 +357,21 @@ def startEthernetLevel(interface:str) -> int:
                 -Comprobar si el nivel Ethernet ya estaba inicializado (mediante una variable global). Si ya estaba inicializado devolver -1.
                 -Obtener y almacenar en una variable global la dirección MAC asociada a la interfaz que se especifica
                 -Abrir la interfaz especificada en modo promiscuo usando la librería rc1-pcap
+                -Aplicar el filtro de captura en el núcleo (updateCaptureFilter)
                 -Arrancar un hilo de recepción (rxThread) que llame a la función pcap_loop. 
                 -Si todo es correcto marcar la variable global de nivel incializado a True
         Argumentos:
             -Interface: nombre de la interfaz sobre la que inicializar el nivel Ethernet
+            -zerocopy: si es True la recepción usa el modo sin copias de rc1_pcap (memoryview sobre el buffer de libpcap)
+            -batch: si es mayor que 0 la recepción se hace por lotes de hasta batch tramas con pcap_dispatch_batch
+            -tx: backend de envío de tramas (TX_INJECT, TX_SENDPACKET o TX_PACKET)
+            -rx: backend de captura (RX_PCAP o RX_RING). Con RX_RING no se usa libpcap: la captura se hace con un anillo
+            TPACKET_V3 (pcap_ring), zerocopy y batch no tienen efecto y el envío se hace siempre con TX_PACKET
+            -background: si es False no se arrancan el hilo de recepción ni el despachador. Las tramas se reciben llamando a
+            pollFrames cuando el descriptor de getSelectableFd esté listo (por ejemplo desde un bucle de asyncio)
         Retorno: 0 si todo es correcto, -1 en otro caso
     '''
-    global macAddress,handle,levelInitialized,recvThread
+    global macAddress,handle,levelInitialized,recvThread,zeroCopyRx,rxBatch,txBackend,rxBackend,ringHandle
     handle = None
     levelInitialized = False
     #logging.debug('Función no implementada')
@@ -178,20 +386,91 @@ def startEthernetLevel(interface:str) -> int:
         return -1
     
     macAddress = getHwAddr(interface)
-    handle = pcap_open_live(interface, ETH_FRAME_MAX, PROMISC, TO_MS, errbuf)
+    zeroCopyRx = zerocopy
+    rxBatch = batch
+    rxBackend = rx
+    if rx == RX_RING:
+        ringHandle = pcap_ring_open_live(interface, ETH_FRAME_MAX, PROMISC, TO_MS, errbuf)
+        if not ringHandle:
+            logging.error('No se puede abrir el anillo de captura: {}'.format(errbuf.decode('utf-8', 'replace')))
+            return -1
+        tx = TX_PACKET
+    else:
+        handle = pcap_open_live(interface, ETH_FRAME_MAX, PROMISC, TO_MS, errbuf)
     
-    if not handle:
+        if not handle:
+            return -1
+
+    if updateCaptureFilter() != 0:
+        closeCapture()
         return -1
 
-    recvThread = rxThread()
-    recvThread.daemon = True
-    recvThread.start()
+    try:
+        txBackend = openTxBackend(tx, handle, interface)
+    except (OSError, ValueError) as e:
+        logging.error('No se puede abrir el backend de envío {}: {}'.format(tx, e))
+        closeCapture()
+        return -1
+
+    if background:
+        if dispatcher is None:
+            setFrameDispatcher()
+
+        recvThread = rxThread()
+        recvThread.daemon = True
+        recvThread.start()
+    else:
+        recvThread = None
+        if handle:
+            pcap_setnonblock(handle, 1, errbuf)
 
     levelInitialized = True
     return 0
 
+def getSelectableFd() -> int:
+    '''
+        Nombre: getSelectableFd
+        Descripción: Esta función devuelve el descriptor de fichero de la captura, que se puede vigilar con select/poll
+            o con loop.add_reader de asyncio para saber cuándo hay tramas que recoger con pollFrames
+        Argumentos: Ninguno
+        Retorno: Descriptor de fichero o -1 si no hay captura abierta
+    '''
+    if ringHandle is not None:
+        return pcap_ring_get_selectable_fd(ringHandle)
+    if handle:
+        return pcap_get_selectable_fd(handle)
+    return -1
+
+
+def pollFrames(cnt:int = -1) -> int:
+    '''
+        Nombre: pollFrames
+        Descripción: Esta función procesa sin bloquear las tramas ya recibidas, llamando a process_Ethernet_frame en el
+            hilo actual (sin despachador). Se usa cuando el nivel se ha arrancado con background=False
+        Argumentos:
+            -cnt: número máximo de tramas a procesar (-1 = todas las disponibles)
+        Retorno: Número de tramas procesadas o -1 en caso de error
+    '''
+    if ringHandle is not None:
+        return pcap_ring_dispatch(ringHandle, cnt, process_Ethernet_frame, None)
+    if handle:
+        return pcap_dispatch(handle, cnt, process_Ethernet_frame, None, zeroCopyRx)
+    return -1
+
+
+def closeCapture():
+    #Cierra el handle de captura abierto (libpcap o anillo)
+    global handle,ringHandle
+    if ringHandle is not None:
+        pcap_ring_close(ringHandle)
+        ringHandle = None
+    if handle:
+        pcap_close(handle)
+        handle = None
+
+
 def stopEthernetLevel()->int:
-    global macAddress,handle,levelInitialized,recvThread
+    global macAddress,handle,levelInitialized,recvThread,txBackend
     '''
         Nombre: stopEthernetLevel
         Descripción_ Esta función parará y liberará todos los recursos necesarios asociados al nivel Ethernet. 
@@ -203,12 +482,23 @@ def stopEthernetLevel()->int:
         Retorno: 0 si todo es correcto y -1 en otro caso
     '''
     #logging.debug('Función no implementada')
-    if not handle:
+    if not handle and not ringHandle:
         return -1
  
-    recvThread.stop()
+    if recvThread is not None:
+        recvThread.stop()
+        if ringHandle is not None:
+            #El anillo se desproyecta al cerrarlo: hay que esperar a que el hilo de recepción salga del bucle
+            recvThread.join()
+        recvThread = None
+
+    setFrameDispatcher(0)
 
-    pcap_close(handle)
+    if txBackend is not None:
+        txBackend.close()
+        txBackend = None
+
+    closeCapture()
 
     levelInitialized = False
     return 0
@@ -223,7 +513,7 @@ def sendEthernetFrame(data:bytes,length:int,etherType:int,dstMac:bytes) -> int:
                     deben obtenerse de las variables que han sido inicializadas en startEthernetLevel
                 -Comprobar los límites de Ethernet. Si la trama es muy pequeña se debe rellenar con 0s mientras que 
                     si es muy grande se debe devolver error.
-                -Llamar a pcap_inject para enviar la trama y comprobar el retorno de dicha llamada. En caso de que haya error notificarlo
+                -Enviar la trama con el backend de envío (por defecto pcap_inject) y comprobar el retorno de dicha llamada. En caso de que haya error notificarlo
         Argumentos:
             -data: datos útiles o payload a encapsular dentro de la trama Ethernet
             -length: longitud de los datos útiles expresada en bytes
@@ -233,23 +523,43 @@ def sendEthernetFrame(data:bytes,length:int,etherType:int,dstMac:bytes) -> int:
     '''
     global macAddress,handle, levelInitialized
 
-
-
-    frame = dstMac
-    frame += macAddress
-    frame += etherType
-    frame += data
-    
-    length += 14
-
-    if length < ETH_FRAME_MIN:
-        frame += bytes([0]*(ETH_FRAME_MIN - length))
-        length = ETH_FRAME_MIN
-
-    if length > ETH_FRAME_MAX:
+    if txBackend is None or length + 14 > ETH_FRAME_MAX:
         return -1
 
-    pcap_inject(handle, bytes(frame), length)
+    #La trama se construye en un buffer del pool y se envía con el backend configurado
+    txb = txPool.get()
+    n = buildFrame(txb, dstMac, macAddress, etherType, data[:length], ETH_FRAME_MIN)
+    ret = txBackend.send(txb, n)
+    txPool.put(txb)
+    return ret
 
-    
-    return 0
\ No newline at end of file
+
+def sendEthernetFrames(frames:list,etherType:bytes,dstMac:bytes) -> int:
+    '''
+        Nombre: sendEthernetFrames
+        Descripción: Esta función envía varias tramas Ethernet con el mismo tipo y la misma MAC destino, por ejemplo todos
+            los fragmentos de un datagrama IP. Cada elemento de frames es el payload de una trama. Las tramas se construyen
+            en buffers del pool de transmisión y se entregan juntas al backend de envío (con el backend packet se envían
+            con una sola llamada a sendmmsg por cada TX_BATCH_MAX tramas).
+        Argumentos:
+            -frames: lista de payloads (bytes, bytearray o memoryview)
+            -etherType: valor de tipo Ethernet a incluir en las tramas
+            -dstMac: Dirección MAC destino a incluir en las tramas
+        Retorno: Número de tramas enviadas correctamente. Las tramas que superan el tamaño máximo no se envían
+    '''
+    if txBackend is None:
+        return 0
+    txbs = []
+    lengths = []
+    for data in frames:
+        txb = txPool.get()
+        n = buildFrame(txb, dstMac, macAddress, etherType, data, ETH_FRAME_MIN)
+        if n < 0:
+            txPool.put(txb)
+            continue
+        txbs.append(txb)
+        lengths.append(n)
+    sent = txBackend.sendBatch(txbs, lengths)
+    for txb in txbs:
+        txPool.put(txb)
+    return sent
@@ -8,6 +8,10 @@
 from ip import *
 from threading import Lock
 import struct
+import asyncio
+import os
+from collections import OrderedDict
+from rttstats import *
 
 ICMP_PROTO = 1
 
@@ -16,9 +20,25 @@ ICMP_ECHO_REQUEST_TYPE = 8
 ICMP_ECHO_REPLY_TYPE = 0
 
 timeLock = Lock()
-icmp_send_times = {}
+#ECHO_REQUEST pendientes de respuesta: (IP destino, icmp_id, icmp_seqnum) -> instante de envío en microsegundos.
+#Está en orden de envío, por lo que las peticiones caducadas se eliminan desde el principio. Se protege con timeLock
+icmp_send_times = OrderedDict()
+#Número máximo de peticiones pendientes. Al superarlo se da por perdida la más antigua
+ICMP_OUTSTANDING_MAX = 65536
+#Tiempo (en segundos) tras el que una petición sin respuesta se da por perdida
+ICMP_TIMEOUT = 1.0
+#Estadísticas de RTT (RTTStats) por IP destino. Se protegen con timeLock
+pingStats = {}
+#Si es True se muestra el RTT de cada respuesta
+printRTT = True
+#Pings asíncronos (ping) pendientes de respuesta. La clave es (IP destino, icmp_id, icmp_seqnum) y el valor una función
+#que se llama con el instante de recepción (time.monotonic()). Se protege con timeLock
+pingWaiters = {}
+#Identificador y último número de secuencia de los pings asíncronos
+PING_ID = os.getpid() & 0xffff
+pingSeqNum = 0
 
-def process_ICMP_message(us,header,data,srcIp):
+def process_ICMP_message(us,header,data,srcIp,dstIp=None):
     '''
         Nombre: process_ICMP_message
         Descripción: Esta función procesa un mensaje ICMP. Esta función se ejecutará por cada datagrama IP que contenga
@@ -44,17 +64,19 @@ def process_ICMP_message(us,header,data,srcIp):
             -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
             -data: array de bytes con el conenido del mensaje ICMP
             -srcIP: dirección IP que ha enviado el datagrama actual.
+            -dstIP: dirección IP destino del datagrama actual.
         Retorno: Ninguno
     '''
 
-    suma = data[:2] + bytes([0x00, 0x00]) + data[4:]
+    #Checksum del mensaje sin el propio campo checksum, sumando los dos trozos sin concatenarlos
+    suma = chksumPartial(data[4:], chksumPartial(data[:2]))
 
 
-    if(chksum(suma) != int.from_bytes(data[2:4], "big")):
+    if(chksumFold(suma) != int.from_bytes(data[2:4], "big")):
         return
 
-    type = data[:1]
-    code = data[1:2]
+    type = bytes(data[:1])
+    code = bytes(data[1:2])
 
     logging.debug("Tipo: " + str(type))
     logging.debug("Codigo: " + str(code))
@@ -62,10 +84,19 @@ def process_ICMP_message(us,header,data,srcIp):
     if int.from_bytes(type, "big") == ICMP_ECHO_REQUEST_TYPE:
         sendICMPMessage(data[8:], ICMP_ECHO_REPLY_TYPE, int.from_bytes(code, "big"), int.from_bytes(data[4:6], "big"), int.from_bytes(data[6:8], "big"), int.from_bytes(srcIp, "big"))
     elif int.from_bytes(type, "big") == ICMP_ECHO_REPLY_TYPE:
+        key = (int.from_bytes(srcIp, "big"), int.from_bytes(data[4:6], "big"), int.from_bytes(data[6:8], "big"))
         with timeLock:
-            value = icmp_send_times[int.from_bytes(srcIp, "big")+int.from_bytes(data[4:6], "big")+int.from_bytes(data[6:8], "big")]
-        sub = header.ts.tv_sec - value
-        print("Estimación del RTT: " + str(sub))
+            waiter = pingWaiters.pop(key, None)
+            sent = icmp_send_times.pop(key, None)
+            if sent is not None:
+                #RTT en microsegundos con la marca de tiempo de captura de la respuesta
+                rtt = header.ts.tv_sec * 1000000 + header.ts.tv_usec - sent
+                pingStats[key[0]].add(rtt)
+        if waiter is not None:
+            waiter(time.monotonic())
+        #Las respuestas duplicadas o que llegan después de caducar la petición se ignoran
+        if sent is not None and printRTT:
+            print("Estimación del RTT: {:.3f} ms".format(rtt / 1000))
 
     
     return
@@ -81,8 +112,8 @@ def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
                 -Añadir los datos al mensaje ICMP
                 -Calcular el checksum y añadirlo al mensaje donde corresponda
                 -Si type es ICMP_ECHO_REQUEST_TYPE
-                    -Guardar el tiempo de envío (llamando a time.time()) en el diccionario icmp_send_times
-                    usando como clave el valor de dstIp+icmp_id+icmp_seqnum
+                    -Guardar el tiempo de envío en microsegundos en el diccionario icmp_send_times
+                    usando como clave la tupla (dstIP, icmp_id, icmp_seqnum) y contarlo en pingStats
                     -Se debe proteger al acceso al diccionario usando la variable timeLock
 
                 -Llamar a sendIPDatagram para enviar el mensaje ICMP
@@ -125,14 +156,168 @@ def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
         if(len(icmp_message) % 2 != 0): 
             icmp_message=type.to_bytes(1, "big")+ code.to_bytes(1, "big") + int(0).to_bytes(1, byteorder="big") + checksum.to_bytes(2, "big") + icmp_seqnum.to_bytes(2, "big") +data
 
-        if type == ICMP_ECHO_REQUEST_TYPE:
-            with timeLock:
-                icmp_send_times[dstIP+icmp_id+icmp_seqnum] = time.time()
+        if type != ICMP_ECHO_REQUEST_TYPE:
+            return sendIPDatagram(dstIP, icmp_message, bytes([0x01]))
+
+        key = (dstIP, icmp_id, icmp_seqnum)
+        with timeLock:
+            stats = pingStats.get(dstIP)
+            if stats is None:
+                stats = pingStats[dstIP] = RTTStats()
+            #Una petición anterior con la misma clave (número de secuencia reutilizado) se da por perdida
+            if icmp_send_times.pop(key, None) is not None:
+                stats.lost += 1
+            if len(icmp_send_times) >= ICMP_OUTSTANDING_MAX:
+                oldest, _ = icmp_send_times.popitem(last=False)
+                pingStats[oldest[0]].lost += 1
+            icmp_send_times[key] = time.time_ns() // 1000
+            stats.sent += 1
 
-        return sendIPDatagram(dstIP, icmp_message, bytes([0x01]))
+        if sendIPDatagram(dstIP, icmp_message, bytes([0x01])):
+            return True
+        with timeLock:
+            if icmp_send_times.pop(key, None) is not None:
+                stats.sent -= 1
+        return False
     else:
         return False
 
+
+def expireRequests(now:int = None) -> int:
+    '''
+        Nombre: expireRequests
+        Descripción: Da por perdidas las peticiones ECHO_REQUEST enviadas hace más de ICMP_TIMEOUT segundos. Como
+            icmp_send_times está en orden de envío, solo se recorren las peticiones caducadas
+        Argumentos:
+            -now: instante actual en microsegundos (time.time_ns() // 1000) o None
+        Retorno: Número de peticiones eliminadas
+    '''
+    if now is None:
+        now = time.time_ns() // 1000
+    limit = now - int(ICMP_TIMEOUT * 1000000)
+    n = 0
+    with timeLock:
+        while icmp_send_times:
+            key = next(iter(icmp_send_times))
+            if icmp_send_times[key] > limit:
+                break
+            del icmp_send_times[key]
+            pingStats[key[0]].lost += 1
+            n += 1
+    return n
+
+
+def getPingStats(dstIP:int) -> RTTStats:
+    with timeLock:
+        return pingStats.get(dstIP)
+
+
+def exportPingStats() -> dict:
+    '''
+        Nombre: exportPingStats
+        Descripción: Exporta las estadísticas de todos los destinos (incluido el histograma de RTT) en un diccionario
+            serializable con json. Se puede llamar en cualquier momento, también mientras se reciben respuestas
+        Argumentos:
+            -Ninguno
+        Retorno: Diccionario IP destino (cadena) -> estadísticas (ver RTTStats.export)
+    '''
+    with timeLock:
+        return {intToIp(dstIP): stats.export() for dstIP, stats in pingStats.items()}
+
+
+def resetPingStats() -> None:
+    with timeLock:
+        icmp_send_times.clear()
+        pingStats.clear()
+
+
+def pingTargets(targets:list, count:int, interval:float = 1.0, timeout:float = 1.0, data:bytes = b'ping', quiet:bool = True) -> dict:
+    '''
+        Nombre: pingTargets
+        Descripción: Envía count ECHO_REQUEST a cada destino, repartidos por turnos entre todos los destinos, a razón
+            de uno cada interval segundos (interval 0: modo flood, tan rápido como se pueda). Mientras envía caduca las
+            peticiones sin respuesta y al terminar espera timeout segundos a las respuestas que faltan.
+        Argumentos:
+            -targets: lista de enteros de 32 bits con las IP destino
+            -count: número de peticiones por destino
+            -interval: tiempo (en segundos) entre dos envíos consecutivos
+            -timeout: tiempo (en segundos) tras el que una petición sin respuesta se da por perdida
+            -data: datos a incluir en cada mensaje
+            -quiet: no mostrar el RTT de cada respuesta
+        Retorno: Diccionario IP destino -> RTTStats
+    '''
+    global ICMP_TIMEOUT, printRTT
+    ICMP_TIMEOUT = timeout
+    verbose = printRTT
+    printRTT = not quiet
+    targetSet = set(targets)
+    with timeLock:
+        for dstIP in targets:
+            pingStats[dstIP] = RTTStats()
+    try:
+        start = time.monotonic()
+        n = 0
+        for seq in range(count):
+            for dstIP in targets:
+                if interval > 0:
+                    delay = start + n * interval - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                sendICMPMessage(data, ICMP_ECHO_REQUEST_TYPE, 0, PING_ID, seq & 0xffff, dstIP)
+                n += 1
+                expireRequests()
+        #Espera a las respuestas que faltan
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with timeLock:
+                pending = any(key[1] == PING_ID and key[0] in targetSet for key in icmp_send_times)
+            if not pending:
+                break
+            time.sleep(0.01)
+        expireRequests()
+    finally:
+        printRTT = verbose
+    with timeLock:
+        return {dstIP: pingStats[dstIP] for dstIP in targets}
+
+
+async def ping(dstIP:int, timeout:float = 1.0, data:bytes = b'ping asyncio') -> float:
+    '''
+        Nombre: ping
+        Descripción: Versión asíncrona (asyncio) del envío de un ECHO_REQUEST. Resuelve antes el siguiente salto con
+            arp.resolve (para que el RTT no incluya la resolución ARP), envía la petición y espera la respuesta
+            sobre un futuro que completa process_ICMP_message. Se pueden lanzar miles de pings concurrentes desde un mismo
+            bucle de eventos: cada uno usa un número de secuencia distinto.
+        Argumentos:
+            -dstIP: entero de 32 bits con la IP destino
+            -timeout: tiempo máximo de espera de la respuesta (en segundos)
+            -data: datos a incluir en el mensaje
+        Retorno: RTT en segundos o None si no hay ruta, no se resuelve el siguiente salto o no llega respuesta a tiempo
+    '''
+    global pingSeqNum
+    hop = nextHopIP(dstIP)
+    if hop is None or await resolve(hop) is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    with timeLock:
+        pingSeqNum = (pingSeqNum + 1) & 0xffff
+        key = (dstIP, PING_ID, pingSeqNum)
+        pingWaiters[key] = lambda t: loop.call_soon_threadsafe(setFutureResult, fut, t)
+
+    try:
+        sent = time.monotonic()
+        if not sendICMPMessage(data, ICMP_ECHO_REQUEST_TYPE, 0, key[1], key[2], dstIP):
+            return None
+        try:
+            return await asyncio.wait_for(fut, timeout) - sent
+        except asyncio.TimeoutError:
+            return None
+    finally:
+        with timeLock:
+            pingWaiters.pop(key, None)
+
    
 def initICMP():
     '''
@@ -6,8 +6,15 @@
     2022 EPS-UAM
 '''
 import math
+import struct
+import time
+import threading
+from collections import deque
 from ethernet import *
 from arp import *
+from checksum import *
+from reassembly import *
+from routing import *
 from fcntl import ioctl
 import subprocess
 SIOCGIFMTU = 0x8921
@@ -19,31 +26,32 @@ protocols={}
 IP_MIN_HLEN = 20
 #Tamaño máximo de la cabecera IP
 IP_MAX_HLEN = 60
-def chksum(msg):
-    '''
-        Nombre: chksum
-        Descripción: Esta función calcula el checksum IP sobre unos datos de entrada dados (msg)
-        Argumentos:
-            -msg: array de bytes con el contenido sobre el que se calculará el checksum
-        Retorno: Entero de 16 bits con el resultado del checksum en ORDEN DE RED
-    '''
-    s = 0
-    y = 0x07E6       
-    for i in range(0, len(msg), 2):
-        if (i+1) < len(msg):
-            a = msg[i] 
-            b = msg[i+1]
-            s = s + (a+(b << 8))
-        elif (i+1)==len(msg):
-            s += msg[i]
-        else:
-            raise 'Error calculando el checksum'
-    y = y & 0x00ff
-    s = s + (s >> 16)
-    s = ~s & 0xffff
-
-    return s
-
+#Motor de reensamblado de fragmentos recibidos
+reassembler = IPReassembler()
+#Caché de plantillas de cabecera IP indexada por (IP destino, protocolo, opciones)
+ipHeaderTemplates = {}
+#Número máximo de plantillas en la caché
+IP_TEMPLATE_CACHE_MAX = 256
+#Tabla de rutas (se rellena en initIP con la red de la interfaz y el gateway por defecto)
+routingTable = RoutingTable()
+#Caché de siguiente salto por IP destino: ruta, MAC resuelta y MTU ya calculados. La MAC se vuelve a comprobar en
+#cada uso contra la caché de vecinos (consulta sin cerrojos), por lo que un cambio de MAC, una expulsión o una
+#comprobación fallida en ARP se notan en el siguiente envío y no al caducar la entrada
+nextHopCache = {}
+#Tiempo de validez (en segundos) de una entrada de la caché de siguiente salto
+NEXTHOP_TTL = 10
+#Número máximo de entradas en la caché de siguiente salto
+NEXTHOP_CACHE_MAX = 1024
+#Datagramas en espera de la resolución ARP por siguiente salto. Con la cola llena se descarta el más antiguo
+IP_PENDING_QUEUE_MAX = 64
+#Número máximo de siguientes saltos con datagramas en espera
+IP_PENDING_HOPS_MAX = 1024
+#Colas de datagramas (listas de tramas ya construidas y función done) en espera de la resolución ARP, indexadas por la
+#IP del siguiente salto. Se protegen con pendingLock
+pendingQueues = {}
+pendingLock = threading.Lock()
+#Contadores de las colas de espera. Se protegen con pendingLock
+pendingCounters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
 def getMTU(interface):
     '''
         Nombre: getMTU
@@ -102,7 +110,8 @@ def process_IP_datagram(us,header,data,srcMac):
                 -Extraer los campos de la cabecera IP (includa la longitud de la cabecera)
                 -Calcular el checksum sobre los bytes de la cabecera IP
                     -Comprobar que el resultado del checksum es 0. Si es distinto el datagrama se deja de procesar
-                -Analizar los bits de de MF y el offset. Si el offset tiene un valor != 0 dejar de procesar el datagrama (no vamos a reensamblar)
+                -Analizar los bits de de MF y el offset. Si es un fragmento (MF activo u offset != 0) entregarlo al motor de
+                reensamblado (reassembler) y continuar solo cuando el datagrama esté completo
                 -Loggear (usando logging.debug) el valor de los siguientes campos:
                     -Longitud de la cabecera IP
                     -IPID
@@ -110,15 +119,16 @@ def process_IP_datagram(us,header,data,srcMac):
                     -Valor de offset
                     -IP origen y destino
                     -Protocolo
+                -Si el aprendizaje pasivo de ARP está activado y el origen es de la red local, añadir su MAC a la caché ARP
                 -Comprobar si tenemos registrada una función de callback de nivel superior consultando el diccionario protocols y usando como
                 clave el valor del campo protocolo del datagrama IP.
                     -En caso de que haya una función de nivel superior registrada, debe llamarse a dicha funciñón 
-                    pasando los datos (payload) contenidos en el datagrama IP.
+                    pasando los datos (payload) contenidos en el datagrama IP y las IP origen y destino.
         
         Argumentos:
             -us: Datos de usuario pasados desde la llamada de pcap_loop. En nuestro caso será None
             -header: cabecera pcap_pktheader
-            -data: array de bytes con el contenido del datagrama IP
+            -data: array de bytes (o memoryview) con el contenido del datagrama IP
             -srcMac: MAC origen de la trama Ethernet que se ha recibido
         Retorno: Ninguno
     '''
@@ -131,14 +141,13 @@ def process_IP_datagram(us,header,data,srcMac):
     offset = bytes([data[6] & int.from_bytes(b'\x1f', "big")]) + data[7:8]
     tlive = data[8:9]
     proto = data[9:10]
-    IPorg = data[12:16]
+    IPorg = bytes(data[12:16])
     IPdest = data[16:20]
 
-    suma = data[:10] + data[12:int.from_bytes(ihl,"big")*4]
+    #Checksum de la cabecera sin el propio campo checksum, sumando los dos trozos sin concatenarlos
+    suma = chksumPartial(data[12:int.from_bytes(ihl,"big")*4], chksumPartial(data[:10]))
 
-    if(chksum(suma) != int.from_bytes(data[10:12],"big")):
-        return
-    if(int.from_bytes(offset,"big") != 0):
+    if(chksumFold(suma) != int.from_bytes(data[10:12],"big")):
         return
 
     logging.debug("\nLongitud de la cabecera IP: " + str(int.from_bytes(ihl,"big")*4))
@@ -153,9 +162,25 @@ def process_IP_datagram(us,header,data,srcMac):
 
 
     
+    #Aprendizaje pasivo (si está activado) de la MAC de los vecinos de la red local que nos envían tráfico
+    if cache.learning:
+        src = int.from_bytes(IPorg, "big")
+        if src != myIP and (src ^ myIP) & netmask == 0 and src | netmask != 0xffffffff and not srcMac[0] & 0x01:
+            cache.learn(src, srcMac)
+
+    hlen = int.from_bytes(ihl,"big")*4
+    tlen = int.from_bytes(data[2:4],"big")
+    payload = data[hlen:tlen]
+
+    if int.from_bytes(mf,"big") != 0 or int.from_bytes(offset,"big") != 0:
+        key = (int.from_bytes(IPorg,"big"), int.from_bytes(IPdest,"big"), int.from_bytes(proto,"big"), int.from_bytes(ipid,"big"))
+        payload = reassembler.add(key, int.from_bytes(offset,"big")*8, int.from_bytes(mf,"big") != 0, payload)
+        if payload is None:
+            return
+
     f = protocols[int.from_bytes(proto, "big")]
     
-    f(us, header, data[int.from_bytes(ihl,"big")*4:], IPorg)
+    f(us, header, payload, IPorg, bytes(IPdest))
     
 
 
@@ -170,12 +195,13 @@ def registerIPProtocol(callback,protocol):
             llamada process_ICMP_message asocaida al valor de protocolo 1. 
         Argumentos:
             -callback_fun: función de callback a ejecutar cuando se reciba el protocolo especificado. 
-                La función que se pase como argumento debe tener el siguiente prototipo: funcion(us,header,data,srcIp):
+                La función que se pase como argumento debe tener el siguiente prototipo: funcion(us,header,data,srcIp,dstIp):
                 Dónde:
                     -us: son los datos de usuarios pasados por pcap_loop (en nuestro caso este valor será siempre None)
                     -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
                     -data: payload del datagrama IP. Es decir, la cabecera IP NUNCA se pasa hacia arriba.
                     -srcIP: dirección IP que ha enviado el datagrama actual.
+                    -dstIP: dirección IP destino del datagrama actual (la propia, broadcast o multicast).
                 La función no retornará nada. Si un datagrama se quiere descartar basta con hacer un return sin valor y dejará de procesarse.
             -protocol: valor del campo protocolo de IP para el cuál se quiere registrar una función de callback.
         Retorno: Ninguno 
@@ -213,6 +239,13 @@ def initIP(interface,opts=None):
     defaultGW = getDefaultGW(interface)
 
     ipOpts = opts
+    ipHeaderTemplates.clear()
+
+    routingTable.clear()
+    routingTable.add(myIP & netmask, maskToPrefix(netmask), 0, MTU)
+    if defaultGW:
+        routingTable.add(0, 0, defaultGW, MTU)
+    nextHopCache.clear()
 
     registerCallback(process_IP_datagram, bytes([0x08,0x00]))
 
@@ -221,21 +254,342 @@ def initIP(interface,opts=None):
     return True
 
 
-def sendIPDatagram(dstIP,data,protocol):
+def addRoute(network:int, prefixlen:int, gateway:int = 0, mtu:int = None):
+    '''
+        Nombre: addRoute
+        Descripción: Esta función añade una ruta a la tabla de rutas del nivel IP
+        Argumentos:
+            -network: entero de 32 bits con la dirección de red
+            -prefixlen: longitud del prefijo de red
+            -gateway: entero de 32 bits con la IP del siguiente salto o 0 si la red está directamente conectada
+            -mtu: MTU a usar hacia esa red o None para usar la de la interfaz
+        Retorno: Ninguno
+    '''
+    routingTable.add(network, prefixlen, gateway, mtu)
+    nextHopCache.clear()
+
+def loadRoutes(fname:str) -> bool:
+    '''
+        Nombre: loadRoutes
+        Descripción: Esta función añade a la tabla de rutas las rutas de un fichero (formato descrito en routing.py)
+        Argumentos:
+            -fname: nombre del fichero de rutas
+        Retorno: True o False en función de si se han cargado las rutas o no
+    '''
+    try:
+        n = routingTable.load(fname)
+    except (OSError, ValueError) as e:
+        logging.error('Error cargando las rutas: {}'.format(e))
+        return False
+    nextHopCache.clear()
+    logging.debug('Cargadas {} rutas de {}'.format(n, fname))
+    return True
+
+
+class NextHop():
+    ''' Entrada de la caché de siguiente salto: IP y MAC del siguiente salto, MTU de la ruta, instante de caducidad y
+        versión de la tabla de rutas con la que se calculó
+    '''
+    __slots__ = ('ip', 'mac', 'mtu', 'expires', 'version')
+    def __init__(self, ip:int, mac:bytes, mtu:int, expires:float, version:int):
+        self.ip = ip
+        self.mac = mac
+        self.mtu = mtu
+        self.expires = expires
+        self.version = version
+
+
+def nextHopIP(dstIP:int) -> int:
+    '''
+        Nombre: nextHopIP
+        Descripción: Esta función devuelve la IP del siguiente salto hacia un destino según la tabla de rutas: el gateway
+            de la ruta o el propio destino si la red está directamente conectada
+        Argumentos:
+            -dstIP: entero de 32 bits con la IP destino
+        Retorno: Entero de 32 bits con la IP del siguiente salto o None si no hay ruta
+    '''
+    route = routingTable.lookup(dstIP)
+    if route is None:
+        return None
+    return route.gateway if route.gateway else dstIP
+
+
+def getNextHop(dstIP:int, block:bool = True) -> NextHop:
+    '''
+        Nombre: getNextHop
+        Descripción: Esta función devuelve el siguiente salto hacia una IP destino. Si hay una entrada válida en la caché
+            nextHopCache y la caché de vecinos (cache) sigue teniendo la misma MAC para el siguiente salto se devuelve
+            directamente; si la MAC ha cambiado o ya no está (expulsada, caducada o sin respuesta a una comprobación) la
+            entrada se descarta. En otro caso se busca la ruta en la tabla de rutas (prefijo más largo),
+            se resuelve la MAC del gateway (o del propio destino si la red está directamente conectada) con ARPResolution
+            y se guarda el resultado en la caché.
+            Con block a False no se espera a ARP: si la MAC no está en la caché ARP se devuelve un NextHop sin MAC
+            (mac None), que no se guarda en nextHopCache, para que el llamante deje el datagrama en espera.
+        Argumentos:
+            -dstIP: entero de 32 bits con la IP destino
+            -block: si es False no se bloquea en la resolución ARP
+        Retorno: El siguiente salto (NextHop) o None si no hay ruta o no se ha podido resolver la MAC (con block a False,
+            si el siguiente salto tiene una entrada negativa en la caché ARP)
+    '''
+    now = time.monotonic()
+    nh = nextHopCache.get(dstIP)
+    if nh is not None and nh.expires > now and nh.version == routingTable.version:
+        if cache.lookup(nh.ip) == nh.mac:
+            return nh
+        nextHopCache.pop(dstIP, None)
+
+    version = routingTable.version
+    route = routingTable.lookup(dstIP)
+    if route is None:
+        logging.debug('No hay ruta hacia ' + intToIp(dstIP))
+        return None
+    hop = route.gateway if route.gateway else dstIP
+    if block:
+        mac = ARPResolution(hop)
+    else:
+        mac = cache.lookup(hop)
+        if mac is None and not cache.isUnreachable(hop):
+            return NextHop(hop, None, route.mtu or MTU, now, version)
+    if mac is None:
+        nextHopCache.pop(dstIP, None)
+        return None
+
+    nh = NextHop(hop, mac, route.mtu or MTU, now + NEXTHOP_TTL, version)
+    if len(nextHopCache) >= NEXTHOP_CACHE_MAX:
+        nextHopCache.clear()
+    nextHopCache[dstIP] = nh
+    return nh
+
+
+class IPHeaderTemplate():
+    ''' Cabecera IP precompilada para un destino, protocolo y opciones dados. Contiene todos los campos fijos ya
+        colocados (longitud total, IPID, flags/offset y checksum a 0) y la suma parcial del checksum de esos campos.
+    '''
+    __slots__ = ('header', 'partial')
+    def __init__(self, header:bytearray):
+        self.header = header
+        self.partial = chksumPartial(header)
+
+
+def getIPHeaderTemplate(dstIP:int, protocol:bytes, opts:bytes) -> IPHeaderTemplate:
+    '''
+        Nombre: getIPHeaderTemplate
+        Descripción: Esta función devuelve la plantilla de cabecera IP para un destino, protocolo y opciones, creándola
+            y guardándola en la caché ipHeaderTemplates si no existe.
+        Argumentos:
+            -dstIP: entero de 32 bits con la IP destino
+            -protocol: bytes (o bytearray) con el valor del campo protocolo
+            -opts: bytes (o bytearray) con las opciones IP o None. Se rellenan con ceros hasta un múltiplo de 4 bytes
+        Retorno: La plantilla (IPHeaderTemplate)
+    '''
+    #La clave debe ser hashable: un bytearray se convierte a bytes
+    protocol = bytes(protocol)
+    if opts is not None:
+        opts = bytes(opts)
+    key = (dstIP, protocol, opts)
+    tpl = ipHeaderTemplates.get(key)
+    if tpl is not None:
+        return tpl
+
+    if opts is None:
+        opts = bytes()
+    opts = bytes(opts) + bytes((4 - len(opts) % 4) % 4)
+    longhead = IP_MIN_HLEN + len(opts)
+
+    header = bytearray(longhead)
+    #Versión + IHL, tipo de servicio, TTL, protocolo, IP origen, IP destino y opciones
+    header[0] = 64 + longhead // 4
+    header[1] = 0x16
+    header[8] = 0x80
+    header[9:10] = protocol
+    struct.pack_into('!II', header, 12, myIP, dstIP)
+    header[IP_MIN_HLEN:] = opts
+
+    tpl = IPHeaderTemplate(header)
+    if len(ipHeaderTemplates) >= IP_TEMPLATE_CACHE_MAX:
+        ipHeaderTemplates.clear()
+    ipHeaderTemplates[key] = tpl
+    return tpl
+
+
+def writeIPHeader(tpl:IPHeaderTemplate, buf:bytearray, offset:int, tlen:int, ipid:int, flagsandoffset:int) -> None:
+    '''
+        Nombre: writeIPHeader
+        Descripción: Esta función escribe en buf, a partir de offset, una cabecera IP copiada de una plantilla, escribiendo en
+            el sitio solo los campos variables (longitud total, IPID y flags/offset) y el checksum, que se obtiene sumando a
+            la suma parcial de la plantilla la de esos tres campos.
+        Argumentos:
+            -tpl: plantilla obtenida con getIPHeaderTemplate
+            -buf: bytearray donde se escribe la cabecera
+            -offset: posición de buf donde empieza la cabecera
+            -tlen: longitud total del datagrama o fragmento
+            -ipid: valor del campo IPID
+            -flagsandoffset: entero de 16 bits con las banderas y el offset (en unidades de 8 bytes)
+        Retorno: Ninguno
+    '''
+    buf[offset:offset + len(tpl.header)] = tpl.header
+    struct.pack_into('!HHH', buf, offset + 2, tlen, ipid & 0xffff, flagsandoffset)
+    a, b, c = struct.unpack_from('<HHH', buf, offset + 2)
+    struct.pack_into('!H', buf, offset + 10, chksumFold(tpl.partial + a + b + c))
+
+
+def buildIPHeader(tpl:IPHeaderTemplate, tlen:int, ipid:int, flagsandoffset:int) -> bytearray:
+    '''
+        Nombre: buildIPHeader
+        Descripción: Esta función construye una cabecera IP nueva a partir de una plantilla (ver writeIPHeader)
+        Argumentos:
+            -tpl: plantilla obtenida con getIPHeaderTemplate
+            -tlen: longitud total del datagrama o fragmento
+            -ipid: valor del campo IPID
+            -flagsandoffset: entero de 16 bits con las banderas y el offset (en unidades de 8 bytes)
+        Retorno: bytearray con la cabecera completa
+    '''
+    header = bytearray(len(tpl.header))
+    writeIPHeader(tpl, header, 0, tlen, ipid, flagsandoffset)
+    return header
+
+
+def buildIPFragments(tpl:IPHeaderTemplate, data:bytes, ipid:int, mtu:int) -> list:
+    '''
+        Nombre: buildIPFragments
+        Descripción: Esta función construye todos los fragmentos de un datagrama en un único buffer reservado de una vez.
+            Cada fragmento lleva todos los datos que caben en la MTU redondeados hacia abajo a múltiplo de 8 bytes (el
+            offset se expresa en unidades de 8 bytes), salvo el último. Todos menos el último llevan activo MF.
+        Argumentos:
+            -tpl: plantilla de cabecera obtenida con getIPHeaderTemplate
+            -data: payload completo del datagrama
+            -ipid: valor del campo IPID, común a todos los fragmentos
+            -mtu: MTU del siguiente salto
+        Retorno: Lista de memoryview, una por fragmento (cabecera + datos), sobre el buffer común
+    '''
+    longhead = len(tpl.header)
+    fraglen = (mtu - longhead) & ~7
+    if fraglen <= 0:
+        raise ValueError('MTU {} demasiado pequeña para la cabecera IP'.format(mtu))
+    datanum = max(1, math.ceil(len(data) / fraglen))
+    buf = bytearray(datanum * longhead + len(data))
+    view = memoryview(buf)
+    frags = []
+    pos = 0
+    for i in range(datanum):
+        first = i * fraglen
+        chunk = data[first:first + fraglen]
+        flagsandoffset = first >> 3
+        if i < datanum - 1:
+            flagsandoffset |= 0x2000
+        tlen = longhead + len(chunk)
+        writeIPHeader(tpl, buf, pos, tlen, ipid, flagsandoffset)
+        buf[pos + longhead:pos + tlen] = chunk
+        frags.append(view[pos:pos + tlen])
+        pos += tlen
+    return frags
+
+
+def reportSend(done, ok:bool) -> None:
+    #Llama a la función done de un datagrama (si la hay) con el resultado del envío
+    if done is not None:
+        try:
+            done(ok)
+        except Exception:
+            logging.exception('Error en la función done de un datagrama IP')
+
+
+def queueIPDatagram(hop:int, frames:list, done) -> bool:
+    '''
+        Nombre: queueIPDatagram
+        Descripción: Esta función deja un datagrama ya construido en la cola del siguiente salto mientras se resuelve su MAC.
+            El primer datagrama de la cola lanza la resolución sin bloqueo (requestResolution), que llama a
+            flushPendingQueue con el resultado. Si la cola está llena se descarta el datagrama más antiguo.
+        Argumentos:
+            -hop: entero de 32 bits con la IP del siguiente salto
+            -frames: lista con el datagrama o sus fragmentos
+            -done: función done(ok) que se llamará con el resultado del envío o None
+        Retorno: True si el datagrama se ha quedado en espera o False si hay demasiados siguientes saltos pendientes
+    '''
+    dropped = None
+    with pendingLock:
+        queue = pendingQueues.get(hop)
+        new = queue is None
+        if new:
+            if len(pendingQueues) >= IP_PENDING_HOPS_MAX:
+                pendingCounters['dropped'] += 1
+                queue = None
+            else:
+                queue = pendingQueues[hop] = deque()
+        if queue is not None:
+            if len(queue) >= IP_PENDING_QUEUE_MAX:
+                dropped = queue.popleft()
+                pendingCounters['dropped'] += 1
+            queue.append((frames, done))
+            pendingCounters['queued'] += 1
+    if queue is None:
+        reportSend(done, False)
+        return False
+    if dropped is not None:
+        reportSend(dropped[1], False)
+    if new:
+        requestResolution(hop, lambda mac: flushPendingQueue(hop, mac))
+    return True
+
+
+def flushPendingQueue(hop:int, mac:bytes) -> None:
+    '''
+        Nombre: flushPendingQueue
+        Descripción: Esta función termina la espera de los datagramas de un siguiente salto. Si se ha resuelto la MAC
+            se envían todos en bloque con sendEthernetFrames; si no, se descartan. En ambos casos se llama a la función
+            done de cada datagrama con el resultado. Se llama desde processARPReply o desde el hilo de resolución ARP
+        Argumentos:
+            -hop: entero de 32 bits con la IP del siguiente salto
+            -mac: MAC del siguiente salto o None si no se ha podido resolver
+        Retorno: Ninguno
+    '''
+    with pendingLock:
+        queue = pendingQueues.pop(hop, None)
+        if queue:
+            pendingCounters['flushed' if mac is not None else 'failed'] += len(queue)
+    if not queue:
+        return
+    if mac is None:
+        logging.debug('Se descartan {} datagramas hacia {}: no se ha podido resolver la MAC'.format(len(queue), intToIp(hop)))
+        for frames, done in queue:
+            reportSend(done, False)
+        return
+    sent = sendEthernetFrames([f for frames, done in queue for f in frames], bytes([0x08,0x00]), mac)
+    for frames, done in queue:
+        reportSend(done, sent >= len(frames))
+        sent -= len(frames)
+
+
+def getPendingStats() -> dict:
+    #Contadores de las colas de espera de resolución ARP y número de datagramas en espera
+    with pendingLock:
+        stats = dict(pendingCounters)
+        stats['hops'] = len(pendingQueues)
+        stats['waiting'] = sum(len(q) for q in pendingQueues.values())
+    return stats
+
+
+def sendIPDatagram(dstIP,data,protocol,done=None):
     global IPID, ipOpts
     '''
         Nombre: sendIPDatagram
         Descripción: Esta función construye un datagrama IP y lo envía. En caso de que los datos a enviar sean muy grandes la función
         debe generar y enviar el número de fragmentos IP que sean necesarios.
         Esta función debe realizar, al menos, las siguientes tareas:
-            -Determinar si se debe fragmentar o no y calcular el número de fragmentos
+            -Obtener el siguiente salto (MAC y MTU) una sola vez por datagrama, sin bloquearse en la resolución ARP
+            -Determinar si se debe fragmentar o no y calcular el número de fragmentos. Los fragmentos se construyen
+            en un único buffer (buildIPFragments) y se envían en bloque con sendEthernetFrames
             -Para cada datagrama o fragmento:
-                -Construir la cabecera IP con los valores que corresponda.Incluir opciones en caso de que ipOpts sea distinto de None
-                -Calcular el checksum sobre la cabecera y añadirlo a la cabecera
+                -Construir la cabecera IP con los valores que corresponda a partir de la plantilla precompilada para el destino,
+                protocolo y opciones (getIPHeaderTemplate). Incluir opciones en caso de que ipOpts sea distinto de None
+                -Calcular el checksum sobre la cabecera y añadirlo a la cabecera (a partir de la suma parcial de la plantilla)
                 -Añadir los datos a la cabecera IP
                 -En el caso de que sea un fragmento ajustar los valores de los campos MF y offset de manera adecuada
-                -Enviar el datagrama o fragmento llamando a sendEthernetFrame. Para determinar la dirección MAC de destino
-                al enviar los datagramas se debe hacer unso de la máscara de red:                  
+                -Enviar el datagrama llamando a sendEthernetFrame. La dirección MAC de destino y la MTU se
+                obtienen del siguiente salto (getNextHop), que usa la tabla de rutas y la caché nextHopCache
+            -Si la MAC del siguiente salto aún no se conoce, dejar el datagrama (o sus fragmentos) en la cola del siguiente
+            salto (queueIPDatagram) y retornar sin esperar. La cola se envía en bloque al llegar la respuesta ARP y se
+            descarta si la resolución falla
             -Para cada datagrama (no fragmento):
                 -Incrementar la variable IPID en 1.
         Argumentos:
@@ -243,33 +597,16 @@ def sendIPDatagram(dstIP,data,protocol):
             -data: array de bytes con los datos a incluir como payload en el datagrama
             -protocol: valor numérico del campo IP protocolo que indica el protocolo de nivel superior de los datos
             contenidos en el payload. Por ejemplo 1, 6 o 17.
-        Retorno: True o False en función de si se ha enviado el datagrama correctamente o no
+            -done: función done(ok) que se llama una vez con el resultado final del envío (también si el datagrama ha
+            esperado a la resolución ARP) o None
+        Retorno: True o False en función de si se ha enviado el datagrama correctamente (o se ha quedado en espera de la
+        resolución ARP) o no
           
     '''
-    ip_header = bytes()
-    longhead = 0
-
     ret = 0
-    
-    if ipOpts != None:
-        while (len(ipOpts) % 4) != 0:
-            ipOpts += bytes([0x00])
-        longhead = len(ipOpts)
-    
 
-    longhead += 20
-    
-    versionandihl = (64 + int(longhead/4)).to_bytes(1, "big")
-
-    typeservice = bytes([0x16])
-    
-    tlen = (longhead + len(data)).to_bytes(2, "big")
-    
-    flagsandoffset = bytes([0x00, 0x00])
-    
-    tlive = bytes([0x80])
-
-    hchecksum = bytes([0x00, 0x00])
+    tpl = getIPHeaderTemplate(dstIP, protocol, ipOpts)
+    longhead = len(tpl.header)
 
     iporg=myIP.to_bytes(4, "big")
     ipdst=dstIP.to_bytes(4, "big")
@@ -279,97 +616,36 @@ def sendIPDatagram(dstIP,data,protocol):
 
     print("Enviando datagrama IP desde " + '.'.join(['{:02d}'.format(b) for b in iporg]) + " hasta " + '.'.join(['{:02d}'.format(b) for b in ipdst]))
     
-    
-    if len(data) > (MTU - longhead):
-
-        
-        newdatalen= MTU - longhead
-
-        datanum= math.ceil(len(data)/newdatalen)
-
-
-        
-        i = 0
-        offsetaux=0
-
-
-        while i < datanum:
-
-            if i == datanum -1:
-                flagsandoffset= int(offsetaux/8).to_bytes(2, "big")
-            else:
-                flagsandoffset= int(8192+int(offsetaux/8)).to_bytes(2, "big")
-
-
-            if i == datanum -1:
-                tlen = (len(data[offsetaux:]) + longhead).to_bytes(2, "big")
-            else:
-                tlen = int(newdatalen + longhead).to_bytes(2, "big")
-
-            
-            hchecksum = bytes([0x00, 0x00])
-
-            ip_header = versionandihl + typeservice + tlen + IPID.to_bytes(2, "big") + flagsandoffset + tlive + protocol + hchecksum + iporg + ipdst 
-            if ipOpts != None:
-                ip_header+= ipOpts
-
-            hchecksum = chksum(ip_header).to_bytes(2, "big")
-            
-            ip_header = versionandihl + typeservice + tlen + IPID.to_bytes(2, "big") + flagsandoffset + tlive + protocol + hchecksum + iporg + ipdst
-            
-            if ipOpts != None:
-                ip_header+= ipOpts
-           
-            if i == datanum -1:
-                ipdatagram = ip_header + data[offsetaux:]
-            
-            else:
-                ipdatagram = ip_header + data[offsetaux:(offsetaux+newdatalen)]
+    #Siguiente salto (MAC y MTU) desde la caché, consultando la tabla de rutas y la caché ARP solo si no está o ha caducado
+    nh = getNextHop(dstIP, block=False)
+    if nh is None:
+        reportSend(done, False)
+        return False
 
-            
-            offsetaux+=newdatalen
+    if len(data) > (nh.mtu - longhead):
 
-            if(dstIP & netmask == myIP & netmask):
-                dstmac = ARPResolution(dstIP)
-            else:
-                dstmac = ARPResolution(defaultGW)
-        
-            if dstmac == None: 
-                return False
-        
-            
-            ret+=sendEthernetFrame(ipdatagram, len(ipdatagram), bytes([0x08,0x00]), dstmac)
-            i+=1
+        #Todos los fragmentos en un único buffer, enviados en bloque a la MAC ya resuelta
+        frames = buildIPFragments(tpl, data, IPID, nh.mtu)
     
     else:
 
-        ip_header = versionandihl + typeservice + tlen + IPID.to_bytes(2, "big") + flagsandoffset + tlive + protocol + hchecksum + iporg + ipdst
-
-        if ipOpts != None:
-            ip_header+= ipOpts
-
-        hchecksum = chksum(ip_header).to_bytes(2, "big")
-            
-        ip_header = versionandihl + typeservice + tlen + IPID.to_bytes(2, "big") + flagsandoffset + tlive + protocol + hchecksum + iporg + ipdst
+        frames = [buildIPHeader(tpl, longhead + len(data), IPID, 0) + data]
 
-        if ipOpts != None:
-            ip_header+= ipOpts
 
-        ipdatagram = ip_header + data
-
-        if(dstIP & netmask == myIP & netmask):
-            dstmac = ARPResolution(dstIP)
-        else:
-            dstmac = ARPResolution(defaultGW)
-        
-        if dstmac == None: 
-                return False
+    IPID+=1
 
-                
-        ret+=sendEthernetFrame(ipdatagram, len(ipdatagram), bytes([0x08,0x00]), dstmac)
+    if nh.mac is None:
+        #MAC aún sin resolver: el datagrama espera en la cola del siguiente salto
+        logging.debug('Datagrama IP en espera de la resolución ARP de ' + intToIp(nh.ip))
+        return queueIPDatagram(nh.ip, frames, done)
 
+    if len(frames) > 1:
+        if sendEthernetFrames(frames, bytes([0x08,0x00]), nh.mac) != len(frames):
+            ret = -1
+    else:
+        ret+=sendEthernetFrame(frames[0], len(frames[0]), bytes([0x08,0x00]), nh.mac)
 
-    IPID+=1
+    reportSend(done, ret >= 0)
 
     if(ret <0):
         return False
@@ -377,4 +653,3 @@ def sendIPDatagram(dstIP,data,protocol):
     print("Datagrama IP enviado")
 
     return True
-
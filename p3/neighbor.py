@@ -0,0 +1,549 @@
+'''
+    neighbor.py
+    Caché de vecinos (IP -> MAC) para ARP, con capacidad configurable y una máquina de estados al estilo de Linux:
+        -REACHABLE: confirmada hace menos de reachableTime segundos
+        -STALE: confirmada hace más de reachableTime segundos. Se sigue usando para enviar, pero el primer uso lanza una
+        comprobación en segundo plano
+        -PROBE: comprobación en curso. Se envían hasta ucastProbes peticiones ARP unicast a la MAC conocida, una cada
+        retransTime segundos, mientras la entrada se sigue usando. Si no hay respuesta la entrada se elimina y el
+        siguiente envío hace una resolución completa (broadcast)
+    Las entradas REACHABLE que se usan cuando ya ha pasado refreshAhead * reachableTime se comprueban por adelantado,
+    de forma que un destino en uso no llega a caducar. Las entradas que no se usan durante staleTime se descartan.
+    Las transiciones por tiempo se evalúan al consultar la entrada; solo las comprobaciones necesitan un hilo (el
+    hilo de refresco), que se limita a enviar las peticiones programadas.
+
+    Las consultas (lookup) no toman ningún cerrojo: leen el diccionario de entradas con una sola operación atómica y
+    las entradas publicadas no se modifican (una confirmación publica una entrada nueva). Solo las escrituras
+    (confirmaciones, expulsiones, caducidad y el paso a PROBE, que ocurre una vez por ciclo de refresco) se serializan
+    con un cerrojo. Los contadores de las consultas son por hilo; cuando un hilo termina sus contadores se suman a un
+    total común, de modo que los hilos de vida corta (un hilo por trama) no hacen crecer la lista de contadores.
+    Cuando la caché está llena se expulsa una entrada con el algoritmo CLOCK (aproximación de LRU, O(1) amortizado):
+    las consultas solo marcan la entrada como referenciada y la expulsión recorre un anillo con las entradas dando una
+    segunda oportunidad a las marcadas.
+
+    Opcionalmente (configureLearning) la caché aprende de forma pasiva asociaciones IP -> MAC observadas en el tráfico
+    recibido (peticiones ARP y datagramas IP de la red local). Las entradas aprendidas se crean STALE, por lo que su
+    primer uso las comprueba con una petición unicast, y nunca sustituyen a una entrada REACHABLE. Tampoco cambian la
+    MAC de una entrada confirmada por una respuesta a nuestras peticiones (solicited), aunque ya sea STALE: una MAC
+    distinta solo lanza una comprobación unicast a la MAC conocida. El aprendizaje está limitado con un cubo de testigos
+    para que una ráfaga de tráfico no pueda llenar la caché.
+
+    La caché también guarda entradas negativas para las IP que no han contestado: durante un tiempo de espera, que se
+    duplica con cada resolución fallida consecutiva (hasta negMaxHold), las resoluciones de esa IP fallan en el acto
+    sin enviar peticiones. Cualquier confirmación o aprendizaje de la IP elimina su entrada negativa.
+    2022 EPS-UAM
+'''
+
+import heapq
+import logging
+import threading
+import time
+import weakref
+
+NEIGH_REACHABLE = 'REACHABLE'
+NEIGH_STALE = 'STALE'
+NEIGH_PROBE = 'PROBE'
+
+#Número máximo de entradas (una red /22 tiene 1022 hosts)
+NEIGH_CAPACITY = 4096
+#Tiempo (en segundos) durante el que una entrada confirmada es REACHABLE
+NEIGH_REACHABLE_TIME = 30.0
+#Fracción de NEIGH_REACHABLE_TIME a partir de la cual una entrada en uso se comprueba por adelantado
+NEIGH_REFRESH_AHEAD = 0.8
+#Tiempo (en segundos) desde la última confirmación tras el que se descarta una entrada que no se ha comprobado
+NEIGH_STALE_TIME = 120.0
+#Peticiones unicast por comprobación y tiempo (en segundos) entre ellas
+NEIGH_UCAST_PROBES = 3
+NEIGH_RETRANS_TIME = 1.0
+#Entradas aprendidas de forma pasiva por segundo y ráfaga máxima
+NEIGH_LEARN_RATE = 50.0
+NEIGH_LEARN_BURST = 100
+#Tiempo de espera (en segundos) tras la primera resolución fallida de una IP, máximo y número máximo de entradas
+#negativas
+NEIGH_NEG_HOLD = 1.0
+NEIGH_NEG_MAX_HOLD = 60.0
+NEIGH_NEG_CAPACITY = 4096
+
+#Posiciones de los contadores por hilo de las consultas
+_HITS = 0
+_STALE_HITS = 1
+_MISSES = 2
+_NEGATIVE_HITS = 3
+
+
+class TokenBucket():
+    ''' Cubo de testigos para limitar el ritmo de un evento: rate eventos por segundo con ráfagas de hasta burst.
+        Es seguro para varios hilos
+    '''
+    def __init__(self, rate:float, burst:int):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Parámetros del límite de ritmo no válidos')
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def take(self) -> bool:
+        #Consume un testigo. Devuelve False si no hay ninguno disponible
+        now = time.monotonic()
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class _ReaderToken():
+    ''' Objeto que se guarda en el threading.local de la caché junto a los contadores de un hilo. Se libera al terminar
+        el hilo, y con él se dispara el weakref.finalize que acumula sus contadores
+    '''
+    __slots__ = ('__weakref__',)
+
+
+class Neighbor():
+    ''' Entrada de la caché de vecinos. ip, mac, confirmed y solicited (confirmada por una respuesta a nuestras
+        peticiones, no aprendida) no cambian una vez publicada; state y probes solo se cambian con el cerrojo de la
+        caché y referenced lo marcan las consultas
+    '''
+    __slots__ = ('ip', 'mac', 'state', 'confirmed', 'solicited', 'probes', 'slot', 'referenced')
+    def __init__(self, ip:int, mac:bytes, confirmed:float, slot:int, solicited:bool = True):
+        self.ip = ip
+        self.mac = mac
+        self.solicited = solicited
+        self.state = NEIGH_REACHABLE
+        self.confirmed = confirmed
+        self.probes = 0
+        self.slot = slot
+        self.referenced = True
+
+
+class NeighborCache():
+    ''' Caché de vecinos. Todas las operaciones son seguras para varios hilos y las consultas no se bloquean.
+        Contadores (stats): hits (de ellos staleHits con la entrada STALE o PROBE), misses, evictions (expulsiones por
+        capacidad), expired (descartadas por staleTime), probes (peticiones unicast enviadas), confirmations, failures
+        (comprobaciones sin respuesta), learned (entradas aprendidas), learnRejected (no se sustituye una entrada
+        REACHABLE o confirmada), learnDropped (descartadas por el límite de ritmo), unreachable (resoluciones fallidas) y
+        negativeHits (resoluciones que han fallado en el acto por una entrada negativa). readers es el número de hilos
+        vivos con contadores propios
+    '''
+    def __init__(self, capacity:int = NEIGH_CAPACITY, reachableTime:float = NEIGH_REACHABLE_TIME,
+                 staleTime:float = NEIGH_STALE_TIME, refreshAhead:float = NEIGH_REFRESH_AHEAD,
+                 ucastProbes:int = NEIGH_UCAST_PROBES, retransTime:float = NEIGH_RETRANS_TIME):
+        self.lock = threading.Lock()
+        self.entries = {}
+        #Anillo de CLOCK: IP de cada posición (None si está libre), posiciones libres y manecilla
+        self.ring = []
+        self.freeSlots = []
+        self.hand = 0
+        self.counters = dict.fromkeys(('evictions', 'expired', 'probes', 'confirmations', 'failures', 'learned',
+                                       'learnRejected', 'learnDropped', 'unreachable'), 0)
+        #Aprendizaje pasivo (desactivado por defecto) y su límite de ritmo
+        self.learning = False
+        self.learnLimit = TokenBucket(NEIGH_LEARN_RATE, NEIGH_LEARN_BURST)
+        #Entradas negativas: ip -> (instante hasta el que falla, resoluciones fallidas consecutivas)
+        self.negative = {}
+        self.negHold = NEIGH_NEG_HOLD
+        self.negMaxHold = NEIGH_NEG_MAX_HOLD
+        self.negCapacity = NEIGH_NEG_CAPACITY
+        #Contadores de las consultas de cada hilo vivo ([hits, staleHits, misses, negativeHits]) por número de lector,
+        #y suma de los de los hilos que ya han terminado. Se protegen con counterLock
+        self.local = threading.local()
+        self.readerCounters = {}
+        self.retiredCounters = [0, 0, 0, 0]
+        self.readerSeq = 0
+        self.counterLock = threading.Lock()
+        self.configure(capacity, reachableTime, staleTime, refreshAhead, ucastProbes, retransTime)
+        #Comprobaciones programadas: montículo de (instante, secuencia, ip)
+        self.probeFunction = None
+        self.schedule = []
+        self.scheduleSeq = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.thread = None
+
+    def configure(self, capacity:int = NEIGH_CAPACITY, reachableTime:float = NEIGH_REACHABLE_TIME,
+                  staleTime:float = NEIGH_STALE_TIME, refreshAhead:float = NEIGH_REFRESH_AHEAD,
+                  ucastProbes:int = NEIGH_UCAST_PROBES, retransTime:float = NEIGH_RETRANS_TIME):
+        '''
+            Nombre: configure
+            Descripción: Cambia los parámetros de la caché (ver las constantes NEIGH_* del módulo). Si la nueva
+                capacidad es menor que el número de entradas se expulsan las sobrantes
+            Retorno: Ninguno. Lanza ValueError si algún parámetro no es válido
+        '''
+        if capacity < 1 or reachableTime <= 0 or staleTime < reachableTime or not 0 < refreshAhead <= 1 \
+                or ucastProbes < 1 or retransTime <= 0:
+            raise ValueError('Parámetros de la caché de vecinos no válidos')
+        with self.lock:
+            self.reachableTime = reachableTime
+            self.refreshTime = reachableTime * refreshAhead
+            self.staleTime = staleTime
+            self.refreshAhead = refreshAhead
+            self.ucastProbes = ucastProbes
+            self.retransTime = retransTime
+            while len(self.entries) > capacity:
+                self._evict()
+            #Se reconstruye el anillo con las entradas que quedan
+            self.capacity = capacity
+            self.ring = [n.ip for n in self.entries.values()] + [None] * (capacity - len(self.entries))
+            for slot, ip in enumerate(self.ring[:len(self.entries)]):
+                self.entries[ip].slot = slot
+            self.freeSlots = list(range(capacity - 1, len(self.entries) - 1, -1))
+            self.hand = 0
+
+    def _readerCounters(self) -> list:
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = [0, 0, 0, 0]
+            token = _ReaderToken()
+            with self.counterLock:
+                self.readerSeq += 1
+                reader = self.readerSeq
+                self.readerCounters[reader] = counters
+            weakref.finalize(token, self._retireCounters, reader)
+            self.local.token = token
+            self.local.counters = counters
+            return counters
+
+    def _retireCounters(self, reader:int):
+        #Suma al total los contadores de un hilo que ha terminado
+        with self.counterLock:
+            counters = self.readerCounters.pop(reader, None)
+            if counters is not None:
+                self.retiredCounters = [a + b for a, b in zip(self.retiredCounters, counters)]
+
+    def lookup(self, ip:int) -> bytes:
+        '''
+            Nombre: lookup
+            Descripción: Busca la MAC de una IP sin tomar ningún cerrojo. Si la entrada es STALE o está cerca de dejar de
+                ser REACHABLE programa una comprobación en segundo plano, sin dejar de devolverla
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+            Retorno: La MAC o None si no está en la caché
+        '''
+        n = self.entries.get(ip)
+        counters = self._readerCounters()
+        if n is None:
+            counters[_MISSES] += 1
+            return None
+        age = time.monotonic() - n.confirmed
+        if age >= self.refreshTime and n.state != NEIGH_PROBE:
+            return self._lookupSlow(ip, counters)
+        n.referenced = True
+        counters[_HITS] += 1
+        if age >= self.reachableTime:
+            counters[_STALE_HITS] += 1
+        return n.mac
+
+    def _lookupSlow(self, ip:int, counters:list) -> bytes:
+        #Caducidad o paso a PROBE de una entrada: se repite la comprobación con el cerrojo
+        now = time.monotonic()
+        with self.lock:
+            n = self.entries.get(ip)
+            if n is None:
+                counters[_MISSES] += 1
+                return None
+            age = now - n.confirmed
+            if n.state != NEIGH_PROBE:
+                if age >= self.staleTime:
+                    self._remove(n)
+                    self.counters['expired'] += 1
+                    counters[_MISSES] += 1
+                    return None
+                n.state = NEIGH_PROBE
+                n.probes = 0
+                self._scheduleProbe(ip, now)
+            n.referenced = True
+        counters[_HITS] += 1
+        if age >= self.reachableTime:
+            counters[_STALE_HITS] += 1
+        return n.mac
+
+    def _remove(self, n:Neighbor):
+        #Con el cerrojo tomado
+        del self.entries[n.ip]
+        self.ring[n.slot] = None
+        self.freeSlots.append(n.slot)
+
+    def _evict(self):
+        #Expulsa una entrada con CLOCK. Con el cerrojo tomado y la caché no vacía
+        ring = self.ring
+        entries = self.entries
+        while True:
+            ip = ring[self.hand]
+            self.hand = (self.hand + 1) % len(ring)
+            if ip is None:
+                continue
+            n = entries[ip]
+            if n.referenced:
+                n.referenced = False
+                continue
+            self._remove(n)
+            self.counters['evictions'] += 1
+            return
+
+    def confirm(self, ip:int, mac:bytes):
+        '''
+            Nombre: confirm
+            Descripción: Añade o actualiza una entrada confirmada (por ejemplo al recibir una respuesta ARP), que pasa a
+                REACHABLE. Si la caché está llena se expulsa una entrada
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+                -mac: bytes con la MAC
+            Retorno: Ninguno
+        '''
+        now = time.monotonic()
+        with self.lock:
+            self._publish(ip, mac, now)
+            self.counters['confirmations'] += 1
+            self.negative.pop(ip, None)
+
+    def confirmProbe(self, ip:int, mac:bytes) -> bool:
+        '''
+            Nombre: confirmProbe
+            Descripción: Confirma una entrada con una respuesta que no corresponde a ninguna resolución en curso. Solo
+                se acepta si la entrada se está comprobando (PROBE) y la respuesta trae la MAC conocida, a la que se han
+                enviado las peticiones unicast
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+                -mac: bytes con la MAC
+            Retorno: True si se ha confirmado la entrada
+        '''
+        now = time.monotonic()
+        with self.lock:
+            n = self.entries.get(ip)
+            if n is None or n.state != NEIGH_PROBE or n.mac != mac:
+                return False
+            self._publish(ip, mac, now)
+            self.counters['confirmations'] += 1
+        return True
+
+    def _publish(self, ip:int, mac:bytes, confirmed:float, solicited:bool = True):
+        #Con el cerrojo tomado. Se publica una entrada nueva para que las consultas concurrentes vean la anterior o
+        #esta completa
+        old = self.entries.get(ip)
+        if old is not None:
+            slot = old.slot
+        else:
+            if not self.freeSlots:
+                self._evict()
+            slot = self.freeSlots.pop()
+            self.ring[slot] = ip
+        self.entries[ip] = Neighbor(ip, mac, confirmed, slot, solicited)
+
+    def configureLearning(self, enabled:bool, rate:float = NEIGH_LEARN_RATE, burst:int = NEIGH_LEARN_BURST):
+        '''
+            Nombre: configureLearning
+            Descripción: Activa o desactiva el aprendizaje pasivo
+            Argumentos:
+                -enabled: True para aprender de las observaciones pasadas a learn
+                -rate: entradas aprendidas por segundo como máximo
+                -burst: número de entradas que se pueden aprender de golpe
+            Retorno: Ninguno
+        '''
+        limit = TokenBucket(rate, burst)
+        with self.lock:
+            self.learnLimit = limit
+            self.learning = enabled
+
+    def learn(self, ip:int, mac:bytes) -> bool:
+        '''
+            Nombre: learn
+            Descripción: Aprende de forma pasiva la MAC de una IP observada en el tráfico recibido. La entrada se crea
+                STALE (se comprobará con una petición unicast en su primer uso) y nunca sustituye a una entrada REACHABLE
+                con otra MAC. Tampoco cambia la MAC de una entrada confirmada por una respuesta a nuestras peticiones: en
+                ese caso se pasa la entrada a PROBE para comprobar la MAC conocida (si no contesta la entrada se elimina y
+                la siguiente resolución es completa). No hace nada si el aprendizaje está desactivado o se ha superado el
+                ritmo permitido
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+                -mac: bytes con la MAC
+            Retorno: True si se ha añadido o cambiado la entrada
+        '''
+        if not self.learning:
+            return False
+        #Caso habitual (vecino ya conocido con la misma MAC) sin tomar el cerrojo
+        n = self.entries.get(ip)
+        if n is not None and n.mac == mac:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            n = self.entries.get(ip)
+            if n is not None:
+                if n.mac == mac:
+                    return False
+                if n.solicited:
+                    self.counters['learnRejected'] += 1
+                    if n.state != NEIGH_PROBE:
+                        n.state = NEIGH_PROBE
+                        n.probes = 0
+                        self._scheduleProbe(ip, now)
+                    return False
+                if n.state == NEIGH_REACHABLE and now - n.confirmed < self.reachableTime:
+                    self.counters['learnRejected'] += 1
+                    return False
+            if not self.learnLimit.take():
+                self.counters['learnDropped'] += 1
+                return False
+            self._publish(ip, bytes(mac), now - self.reachableTime, False)
+            self.counters['learned'] += 1
+            self.negative.pop(ip, None)
+        return True
+
+    def configureNegative(self, hold:float = NEIGH_NEG_HOLD, maxHold:float = NEIGH_NEG_MAX_HOLD, capacity:int = NEIGH_NEG_CAPACITY):
+        '''
+            Nombre: configureNegative
+            Descripción: Configura las entradas negativas
+            Argumentos:
+                -hold: tiempo de espera (en segundos) tras la primera resolución fallida (0 desactiva la caché negativa)
+                -maxHold: tiempo de espera máximo
+                -capacity: número máximo de entradas negativas
+            Retorno: Ninguno
+        '''
+        if hold < 0 or maxHold < hold or capacity < 1:
+            raise ValueError('Parámetros de la caché negativa no válidos')
+        with self.lock:
+            self.negHold = hold
+            self.negMaxHold = maxHold
+            self.negCapacity = capacity
+            self.negative = {}
+
+    def isUnreachable(self, ip:int) -> bool:
+        '''
+            Nombre: isUnreachable
+            Descripción: Comprueba sin tomar el cerrojo si una IP tiene una entrada negativa vigente, en cuyo caso su
+                resolución debe fallar sin enviar peticiones
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+            Retorno: True si la IP se debe dar por inalcanzable
+        '''
+        neg = self.negative.get(ip)
+        if neg is None or time.monotonic() >= neg[0]:
+            return False
+        self._readerCounters()[_NEGATIVE_HITS] += 1
+        return True
+
+    def markUnreachable(self, ip:int) -> float:
+        '''
+            Nombre: markUnreachable
+            Descripción: Registra una resolución fallida. El tiempo de espera es hold * 2^(fallos consecutivos - 1),
+                hasta maxHold. Si la última entrada negativa caducó hace más de maxHold se vuelve a empezar
+            Argumentos:
+                -ip: entero de 32 bits con la IP
+            Retorno: Tiempo de espera (en segundos) asignado
+        '''
+        now = time.monotonic()
+        with self.lock:
+            self.counters['unreachable'] += 1
+            if self.negHold == 0:
+                return 0.0
+            neg = self.negative.pop(ip, None)
+            failures = 1 if neg is None or now - neg[0] > self.negMaxHold else neg[1] + 1
+            hold = min(self.negHold * (2 ** min(failures - 1, 32)), self.negMaxHold)
+            if len(self.negative) >= self.negCapacity:
+                #Se descarta la entrada negativa más antigua (los diccionarios mantienen el orden de inserción)
+                del self.negative[next(iter(self.negative))]
+            self.negative[ip] = (now + hold, failures)
+            return hold
+
+    def clearUnreachable(self, ip:int):
+        with self.lock:
+            self.negative.pop(ip, None)
+
+    def _stateOf(self, n:Neighbor, now:float) -> str:
+        if n.state == NEIGH_REACHABLE and now - n.confirmed >= self.reachableTime:
+            return NEIGH_STALE
+        return n.state
+
+    def state(self, ip:int) -> str:
+        #Estado actual de una entrada (sin contarlo como uso) o None si no está
+        n = self.entries.get(ip)
+        return None if n is None else self._stateOf(n, time.monotonic())
+
+    def __contains__(self, ip:int) -> bool:
+        return ip in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def remove(self, ip:int) -> bool:
+        with self.lock:
+            n = self.entries.get(ip)
+            if n is None:
+                return False
+            self._remove(n)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.ring = [None] * self.capacity
+            self.freeSlots = list(range(self.capacity - 1, -1, -1))
+            self.hand = 0
+            self.negative = {}
+
+    def items(self) -> list:
+        #Copia de las entradas como lista de (ip, mac, estado). No toma el cerrojo
+        now = time.monotonic()
+        return [(n.ip, n.mac, self._stateOf(n, now)) for n in self.entries.copy().values()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+        with self.counterLock:
+            readers = [self.retiredCounters] + list(self.readerCounters.values())
+        stats['hits'] = sum(c[_HITS] for c in readers)
+        stats['staleHits'] = sum(c[_STALE_HITS] for c in readers)
+        stats['misses'] = sum(c[_MISSES] for c in readers)
+        stats['negativeHits'] = sum(c[_NEGATIVE_HITS] for c in readers)
+        stats['readers'] = len(readers) - 1
+        stats['negativeEntries'] = len(self.negative)
+        stats['entries'] = len(self.entries)
+        stats['capacity'] = self.capacity
+        return stats
+
+    def start(self, probeFunction):
+        '''
+            Nombre: start
+            Descripción: Arranca el hilo de refresco (si no está ya arrancado)
+            Argumentos:
+                -probeFunction: función probeFunction(ip, mac) que envía una petición ARP unicast
+            Retorno: Ninguno
+        '''
+        self.probeFunction = probeFunction
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._refreshThread, name='neighbor-refresh', daemon=True)
+        self.thread.start()
+
+    def _scheduleProbe(self, ip:int, when:float):
+        with self.cond:
+            self.scheduleSeq += 1
+            heapq.heappush(self.schedule, (when, self.scheduleSeq, ip))
+            self.cond.notify()
+
+    def _refreshThread(self):
+        while True:
+            with self.cond:
+                while not self.schedule or self.schedule[0][0] > time.monotonic():
+                    self.cond.wait(self.schedule[0][0] - time.monotonic() if self.schedule else None)
+                when, _, ip = heapq.heappop(self.schedule)
+            with self.lock:
+                n = self.entries.get(ip)
+                if n is None or n.state != NEIGH_PROBE:
+                    #Ya se ha confirmado o eliminado
+                    continue
+                if n.probes >= self.ucastProbes:
+                    self._remove(n)
+                    self.counters['failures'] += 1
+                    continue
+                n.probes += 1
+                self.counters['probes'] += 1
+                mac = n.mac
+            try:
+                self.probeFunction(ip, mac)
+            except Exception:
+                logging.exception('Error enviando la comprobación ARP')
+            self._scheduleProbe(ip, time.monotonic() + self.retransTime)
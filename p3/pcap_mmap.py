@@ -0,0 +1,152 @@
+'''
+    pcap_mmap.py
+    Lector de trazas pcap en Python puro, alternativa a pcap_open_offline de rc1-pcap que no necesita libpcap.
+    El fichero se proyecta en memoria con mmap y las cabeceras se leen con struct.unpack_from, por lo que los datos
+    de cada paquete se entregan como memoryview sobre el fichero, sin copias.
+    Soporta los formatos con timestamps en microsegundos y en nanosegundos y ambos órdenes de bytes.
+    Las funciones siguen la misma firma que las de rc1-pcap (pcap_loop, pcap_next, pcap_breakloop, pcap_close).
+    2020 EPS-UAM
+'''
+
+import mmap
+import struct
+from typing import Callable
+
+#Números mágicos de la cabecera global (leídos en little-endian)
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAP_MAGIC_USEC_SWAPPED = 0xD4C3B2A1
+PCAP_MAGIC_NSEC_SWAPPED = 0x4D3CB2A1
+PCAP_GLOBAL_HLEN = 24
+PCAP_RECORD_HLEN = 16
+
+
+class pcap_mmap_pkthdr():
+    # Cabecera de paquete compatible con pcap_pkthdr de rc1-pcap: header.ts.tv_sec y header.ts.tv_usec se resuelven
+    # sobre el propio objeto. En trazas con nanosegundos tv_usec se redondea y tv_nsec conserva el valor exacto
+    __slots__ = ('len','caplen','tv_sec','tv_usec','tv_nsec')
+    def __init__(self,len=0,caplen=0,tv_sec=0,tv_usec=0,tv_nsec=0):
+        self.len = len
+        self.caplen = caplen
+        self.tv_sec = tv_sec
+        self.tv_usec = tv_usec
+        self.tv_nsec = tv_nsec
+    @property
+    def ts(self):
+        return self
+
+
+class pcap_mmap_t():
+    # Descriptor de una traza abierta con pcap_mmap_open_offline
+    def __init__(self,fname:str):
+        self.file = open(fname,'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError('Fichero vacío')
+        self.view = memoryview(self.mm)
+        if len(self.mm) < PCAP_GLOBAL_HLEN:
+            self.close()
+            raise ValueError('Fichero demasiado corto para ser una traza pcap')
+        magic, = struct.unpack_from('<I',self.mm,0)
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            endian = '<'
+        elif magic in (PCAP_MAGIC_USEC_SWAPPED, PCAP_MAGIC_NSEC_SWAPPED):
+            endian = '>'
+        else:
+            self.close()
+            raise ValueError('Número mágico desconocido: 0x{:08X}'.format(magic))
+        self.nano = magic in (PCAP_MAGIC_NSEC, PCAP_MAGIC_NSEC_SWAPPED)
+        self.version_major,self.version_minor,self.thiszone,self.sigfigs,self.snaplen,self.linktype = struct.unpack_from(endian+'HHiIII',self.mm,4)
+        self.record = struct.Struct(endian+'IIII')
+        self.pos = PCAP_GLOBAL_HLEN
+        self.breakloop = False
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            #Todavía hay memoryview de paquetes vivos: el mmap se liberará cuando desaparezcan
+            pass
+        self.file.close()
+
+
+def pcap_mmap_open_offline(fname:str,errbuf:bytearray) -> pcap_mmap_t:
+    #Equivalente a pcap_open_offline. Devuelve None y rellena errbuf en caso de error
+    if fname is None:
+        raise ValueError("El objeto fname no puede ser None")
+    if errbuf is None:
+        raise ValueError("El objeto errbuf no puede ser None")
+    try:
+        return pcap_mmap_t(fname)
+    except (OSError,ValueError) as e:
+        errbuf.extend(str(e).encode('utf-8'))
+        return None
+
+def pcap_mmap_iter(handle:pcap_mmap_t):
+    # Generador de tuplas (cabecera, memoryview) con los paquetes de la traza a partir de la posición actual.
+    # Termina al final del fichero o al encontrar un registro truncado
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    unpack = handle.record.unpack_from
+    mm = handle.mm
+    view = handle.view
+    size = len(mm)
+    nano = handle.nano
+    pos = handle.pos
+    while pos + PCAP_RECORD_HLEN <= size:
+        tv_sec,tv_frac,caplen,length = unpack(mm,pos)
+        start = pos + PCAP_RECORD_HLEN
+        end = start + caplen
+        if end > size:
+            break
+        pos = end
+        handle.pos = pos
+        if nano:
+            header = pcap_mmap_pkthdr(length,caplen,tv_sec,tv_frac // 1000,tv_frac)
+        else:
+            header = pcap_mmap_pkthdr(length,caplen,tv_sec,tv_frac,tv_frac * 1000)
+        yield header,view[start:end]
+
+def pcap_mmap_next(handle:pcap_mmap_t,header) -> memoryview:
+    # Equivalente a pcap_next: rellena header y devuelve los datos del siguiente paquete, o None si no hay más
+    for h,data in pcap_mmap_iter(handle):
+        header.len = h.len
+        header.caplen = h.caplen
+        header.ts.tv_sec = h.tv_sec
+        header.ts.tv_usec = h.tv_usec
+        return data
+    return None
+
+def pcap_mmap_loop(handle:pcap_mmap_t,cnt:int,callback_fun:Callable,user) -> int:
+    # Equivalente a pcap_loop: llama a callback_fun(user,header,data) por cada paquete hasta procesar cnt paquetes
+    # (todos si cnt <= 0). data es un memoryview sobre el fichero, válido mientras la traza siga abierta.
+    # Retorno: 0 si se han procesado todos los paquetes pedidos, -2 si se ha llamado a pcap_mmap_breakloop y
+    # -1 si la traza termina en un registro truncado
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.breakloop = False
+    n = 0
+    for header,data in pcap_mmap_iter(handle):
+        callback_fun(user,header,data)
+        n += 1
+        if handle.breakloop:
+            handle.breakloop = False
+            return -2
+        if cnt > 0 and n >= cnt:
+            return 0
+    if handle.pos != len(handle.mm):
+        return -1
+    return 0
+
+def pcap_mmap_breakloop(handle:pcap_mmap_t):
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.breakloop = True
+
+def pcap_mmap_close(handle:pcap_mmap_t):
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.close()
@@ -0,0 +1,192 @@
+'''
+    pcap_ring.py
+    Captura en vivo con un socket AF_PACKET y un anillo PACKET_RX_RING (TPACKET_V3) proyectado en memoria, alternativa
+    a pcap_open_live/pcap_loop de rc1-pcap que no necesita libpcap.
+    El núcleo copia las tramas directamente en bloques del anillo compartido con el proceso. El bucle de captura recorre
+    en Python los bloques que el núcleo ha entregado (sin una llamada al sistema por trama: solo un poll cuando no hay
+    ningún bloque listo) y pasa cada trama al callback como memoryview sobre el anillo. Al terminar un bloque se
+    devuelve al núcleo.
+    Las funciones siguen la misma firma que las de rc1-pcap (pcap_loop, pcap_breakloop, pcap_close).
+    2022 EPS-UAM
+'''
+
+import mmap
+import select
+import socket
+import struct
+from typing import Callable
+from pcap_mmap import pcap_mmap_pkthdr
+from bpf import attachFilter, detachFilter
+
+#Constantes de linux/if_packet.h
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+PACKET_MR_PROMISC = 1
+PACKET_OUTGOING = 4
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ETH_P_ALL = 0x0003
+
+#Desplazamientos dentro de la cabecera de bloque (tpacket_block_desc)
+BLOCK_STATUS_OFF = 8
+BLOCK_NUM_PKTS_OFF = 12
+#Posición de sll_pkttype dentro de cada trama: sockaddr_ll va tras tpacket3_hdr alineada a 16 bytes (48)
+PKT_SLL_PKTTYPE_OFF = 48 + 10
+
+#Tamaños por defecto del anillo: 64 bloques de 256 KiB
+RING_BLOCK_SIZE = 1 << 18
+RING_BLOCK_NR = 64
+RING_FRAME_SIZE = 2048
+
+TPACKET3_HDR = struct.Struct('=IIIIIIH')
+BLOCK_HDR = struct.Struct('=II')
+STATUS = struct.Struct('=I')
+
+
+class pcap_ring_t():
+    # Descriptor de una captura abierta con pcap_ring_open_live
+    def __init__(self, device:str, snaplen:int, promisc:int, to_ms:int, blockSize:int, blockNr:int):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            req = struct.pack('=IIIIIII', blockSize, blockNr, RING_FRAME_SIZE, blockSize * blockNr // RING_FRAME_SIZE,
+                              max(to_ms, 1), 0, 0)
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+            self.mm = mmap.mmap(self.sock.fileno(), blockSize * blockNr, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.sock.bind((device, ETH_P_ALL))
+            if promisc:
+                ifindex = socket.if_nametoindex(device)
+                self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, struct.pack('=iHH8s', ifindex, PACKET_MR_PROMISC, 0, bytes(8)))
+        except OSError:
+            self.sock.close()
+            raise
+        self.view = memoryview(self.mm)
+        self.snaplen = snaplen
+        self.to_ms = to_ms
+        self.blockSize = blockSize
+        self.blockNr = blockNr
+        self.block = 0
+        self.breakloop = False
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        #Tramas entregadas y tramas propias (salientes) ignoradas
+        self.packets = 0
+        self.outgoing = 0
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+        self.sock.close()
+
+
+def pcap_ring_open_live(device:str,snaplen:int,promisc:int,to_ms:int,errbuf:bytearray,blockSize:int=RING_BLOCK_SIZE,blockNr:int=RING_BLOCK_NR) -> pcap_ring_t:
+    #Equivalente a pcap_open_live. Devuelve None y rellena errbuf en caso de error (por ejemplo sin permisos)
+    if device is None:
+        raise ValueError("El objeto device no puede ser None")
+    if errbuf is None:
+        raise ValueError("El objeto errbuf no puede ser None")
+    try:
+        return pcap_ring_t(device,snaplen,promisc,to_ms,blockSize,blockNr)
+    except (OSError,ValueError) as e:
+        errbuf.extend(str(e).encode('utf-8'))
+        return None
+
+def _ring_block(handle:pcap_ring_t,callback_fun:Callable,user) -> int:
+    # Procesa el siguiente bloque del anillo si el núcleo ya lo ha entregado y lo devuelve al núcleo.
+    # Retorno: número de tramas entregadas al callback o -1 si el bloque todavía no está listo
+    mm = handle.mm
+    off = handle.block * handle.blockSize
+    if not STATUS.unpack_from(mm, off + BLOCK_STATUS_OFF)[0] & TP_STATUS_USER:
+        return -1
+    view = handle.view
+    snaplen = handle.snaplen
+    unpackPkt = TPACKET3_HDR.unpack_from
+    num, pos = BLOCK_HDR.unpack_from(mm, off + BLOCK_NUM_PKTS_OFF)
+    pos += off
+    delivered = 0
+    for _ in range(num):
+        nextOff, sec, nsec, caplen, length, status, mac = unpackPkt(mm, pos)
+        if mm[pos + PKT_SLL_PKTTYPE_OFF] == PACKET_OUTGOING:
+            handle.outgoing += 1
+        else:
+            caplen = min(caplen, snaplen)
+            header = pcap_mmap_pkthdr(length, caplen, sec, nsec // 1000, nsec)
+            callback_fun(user, header, view[pos + mac:pos + mac + caplen])
+            delivered += 1
+        pos += nextOff
+    #Se devuelve el bloque al núcleo y se pasa al siguiente
+    STATUS.pack_into(mm, off + BLOCK_STATUS_OFF, TP_STATUS_KERNEL)
+    handle.block = (handle.block + 1) % handle.blockNr
+    handle.packets += delivered
+    return delivered
+
+def pcap_ring_loop(handle:pcap_ring_t,cnt:int,callback_fun:Callable,user) -> int:
+    # Equivalente a pcap_loop: llama a callback_fun(user,header,data) por cada trama recibida hasta procesar cnt
+    # tramas (indefinidamente si cnt <= 0). data es un memoryview sobre el anillo que solo es válido durante la llamada.
+    # Las tramas enviadas por la propia máquina no se entregan. Los bloques se procesan completos, por lo que pueden
+    # entregarse algunas tramas más de cnt.
+    # Retorno: 0 si se han procesado las tramas pedidas y -2 si se ha llamado a pcap_ring_breakloop
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.breakloop = False
+    n = 0
+    while True:
+        delivered = _ring_block(handle, callback_fun, user)
+        if delivered < 0:
+            if handle.breakloop:
+                handle.breakloop = False
+                return -2
+            handle.poller.poll(handle.to_ms)
+            continue
+        n += delivered
+        if cnt > 0 and n >= cnt:
+            return 0
+        if handle.breakloop:
+            handle.breakloop = False
+            return -2
+
+def pcap_ring_dispatch(handle:pcap_ring_t,cnt:int,callback_fun:Callable,user) -> int:
+    # Equivalente a pcap_dispatch en modo no bloqueante: procesa los bloques ya entregados por el núcleo (hasta
+    # entregar al menos cnt tramas si cnt > 0) y vuelve sin esperar.
+    # Retorno: número de tramas entregadas
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    n = 0
+    while cnt <= 0 or n < cnt:
+        delivered = _ring_block(handle, callback_fun, user)
+        if delivered < 0:
+            break
+        n += delivered
+    return n
+
+def pcap_ring_breakloop(handle:pcap_ring_t):
+    # El bucle termina como mucho to_ms milisegundos después (tiempo máximo de espera en poll)
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.breakloop = True
+
+def pcap_ring_get_selectable_fd(handle:pcap_ring_t) -> int:
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    return handle.sock.fileno()
+
+def pcap_ring_setfilter(handle:pcap_ring_t,prog:list):
+    # Equivalente a pcap_setfilter con un programa BPF clásico (ver bpf.filterProgram). Con prog None se quita el filtro.
+    # Lanza OSError si el núcleo rechaza el programa
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    if prog is None:
+        detachFilter(handle.sock)
+    else:
+        attachFilter(handle.sock,prog)
+
+def pcap_ring_close(handle:pcap_ring_t):
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    handle.close()
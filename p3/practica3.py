@@ -18,6 +18,7 @@ from argparse import RawTextHelpFormatter
 import time
 import logging
 import socket
+import json
 
 DST_PORT = 443
 ICMP_ECHO_REQUEST_TYPE = 8
@@ -29,10 +30,18 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description='Envía datagramas UDP o mensajes ICMP con diferentes opciones',
 	formatter_class=RawTextHelpFormatter)
 	parser.add_argument('--itf', dest='interface', default=False,help='Interfaz a abrir')
-	parser.add_argument('--dstIP',dest='dstIP',default = False,help='Dirección IP destino')
+	parser.add_argument('--dstIP',dest='dstIP',default = False,help='Dirección IP destino (con --pingCount, lista de IP separadas por comas)')
 	parser.add_argument('--debug', dest='debug', default=False, action='store_true',help='Activar Debug messages')
 	parser.add_argument('--addOptions', dest='addOptions', default=False, action='store_true',help='Añadir opciones a los datagranas IP')
 	parser.add_argument('--dataFile',dest='dataFile',default = False,help='Fichero con datos a enviar')
+	parser.add_argument('--tx',dest='tx',default=TX_INJECT,choices=TX_BACKENDS,help='Backend de envío de tramas (pcap_inject, pcap_sendpacket o socket AF_PACKET)')
+	parser.add_argument('--rx',dest='rx',default=RX_PCAP,choices=RX_BACKENDS,help='Backend de captura (libpcap o anillo TPACKET_V3 sobre AF_PACKET)')
+	parser.add_argument('--arpLearning', dest='arpLearning', default=False, action='store_true',help='Aprender de forma pasiva las MAC de los vecinos que nos envían peticiones ARP o datagramas IP')
+	parser.add_argument('--routes',dest='routes',default = False,help='Fichero con rutas adicionales (red/prefijo gateway [mtu])')
+	parser.add_argument('--pingCount',dest='pingCount',type=int,default=0,help='Modo medida: envía este número de pings a cada destino y muestra las estadísticas')
+	parser.add_argument('--pingRate',dest='pingRate',type=float,default=1.0,help='Pings por segundo en modo medida (0: flood, tan rápido como se pueda)')
+	parser.add_argument('--pingTimeout',dest='pingTimeout',type=float,default=1.0,help='Tiempo (en segundos) tras el que un ping sin respuesta se da por perdido')
+	parser.add_argument('--pingExport',dest='pingExport',default=False,help='Fichero JSON en el que guardar las estadísticas e histogramas de RTT del modo medida')
 	args = parser.parse_args()
 
 	if args.debug:
@@ -62,12 +71,32 @@ if __name__ == "__main__":
 			#Pasamos los datos de cadena a bytes
 			data = data.encode()
 	
-	startEthernetLevel(args.interface)
+	if startEthernetLevel(args.interface,tx=args.tx,rx=args.rx) != 0:
+		logging.error('Inicializando nivel Ethernet')
+		sys.exit(-1)
 	initICMP()
 	initUDP()
+	configureARPLearning(args.arpLearning)
 	if initIP(args.interface,ipOpts) == False:
 		logging.error('Inicializando nivel IP')
 		sys.exit(-1)
+	if args.routes and not loadRoutes(args.routes):
+		sys.exit(-1)
+
+	if args.pingCount > 0:
+		targets = [struct.unpack('!I',socket.inet_aton(ip.strip()))[0] for ip in args.dstIP.split(',')]
+		interval = 1.0 / args.pingRate if args.pingRate > 0 else 0
+		try:
+			results = pingTargets(targets,args.pingCount,interval,args.pingTimeout,data)
+			for dst,stats in results.items():
+				print(socket.inet_ntoa(struct.pack('!I',dst)) + ': ' + stats.summary())
+			if args.pingExport:
+				with open(args.pingExport,'w') as f:
+					json.dump(exportPingStats(),f,indent=1)
+		except KeyboardInterrupt:
+			print('\n')
+		stopEthernetLevel()
+		sys.exit(0)
 
 	
 	
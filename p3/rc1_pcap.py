@@ -8,6 +8,7 @@
 import ctypes,sys
 from ctypes.util import find_library
 from typing import Callable
+from array import array
 
 
 
@@ -26,9 +27,22 @@ def mycallback(us,h,data):
     if user_callback is not None:
         user_callback (us,header,bytes(data[:header.caplen]))
 
+def mycallback_zerocopy(us,h,data):
+    # Modo sin copias: data es un memoryview sobre el buffer interno de libpcap, que se reutiliza
+    # para los siguientes paquetes. Solo es válido durante la llamada: si se quiere conservar hay que copiarlo (bytes(data))
+    hh = h[0]
+    header = pcap_pkthdr_lite(hh.len,hh.caplen,hh.tv_sec,hh.tv_usec)
+    if user_callback is not None:
+        buf = (ctypes.c_uint8 * hh.caplen).from_address(ctypes.addressof(data.contents))
+        user_callback (us,header,memoryview(buf).cast('B'))
+
 
 
-pcap = ctypes.cdll.LoadLibrary("libpcap.so")
+try:
+    pcap = ctypes.cdll.LoadLibrary("libpcap.so")
+except OSError:
+    # Sin libpcap el módulo se puede importar, pero solo funcionan los lectores de trazas que no dependen de ella (pcap_mmap)
+    pcap = None
 
 
 
@@ -47,9 +61,101 @@ class pcap_pkthdr():
         self.caplen=0
         self.ts=timeval(0,0)
 
+class pcap_pkthdr_lite():
+    # Cabecera ligera del modo sin copias. Es compatible con pcap_pkthdr: header.ts.tv_sec y header.ts.tv_usec
+    # se resuelven sobre el propio objeto, por lo que no se crea un timeval por paquete
+    __slots__ = ('len','caplen','tv_sec','tv_usec')
+    def __init__(self,len=0,caplen=0,tv_sec=0,tv_usec=0):
+        self.len = len
+        self.caplen = caplen
+        self.tv_sec = tv_sec
+        self.tv_usec = tv_usec
+    @property
+    def ts(self):
+        return self
+
 class pcappkthdr(ctypes.Structure):
     _fields_ = [("tv_sec", ctypes.c_long), ("tv_usec", ctypes.c_long), ("caplen", ctypes.c_uint32), ("len", ctypes.c_uint32)]
 
+#  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
+PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
+
+
+class pcap_batch():
+    '''
+        Lote de paquetes capturados por pcap_dispatch_batch. Los datos de todos los paquetes se guardan seguidos en un
+        único bytearray y, para cada paquete, su desplazamiento, longitudes y timestamp en arrays paralelos.
+        El lote se puede reutilizar entre llamadas, por lo que los memoryview que devuelve solo son válidos hasta la
+        siguiente captura sobre el mismo lote.
+    '''
+    __slots__ = ('capacity','buf','used','offsets','caplens','lens','tv_sec','tv_usec','ret')
+    def __init__(self,capacity:int,bufsize:int=0):
+        self.capacity = capacity
+        #Tamaño inicial pensado para tramas Ethernet; crece si llegan paquetes mayores
+        self.buf = bytearray(bufsize if bufsize > 0 else capacity*1514)
+        self.used = 0
+        self.offsets = array('I')
+        self.caplens = array('I')
+        self.lens = array('I')
+        self.tv_sec = array('q')
+        self.tv_usec = array('q')
+        #Valor devuelto por pcap_dispatch en la última captura
+        self.ret = 0
+
+    def clear(self):
+        self.used = 0
+        del self.offsets[:]
+        del self.caplens[:]
+        del self.lens[:]
+        del self.tv_sec[:]
+        del self.tv_usec[:]
+        self.ret = 0
+
+    def append(self,h,data):
+        caplen = h.caplen
+        off = self.used
+        end = off + caplen
+        if end > len(self.buf):
+            #Se cambia de buffer en lugar de redimensionarlo porque puede haber memoryview vivos sobre el anterior
+            buf = bytearray(max(end, 2*len(self.buf)))
+            buf[:off] = self.buf[:off]
+            self.buf = buf
+        self.buf[off:end] = (ctypes.c_uint8 * caplen).from_address(ctypes.addressof(data.contents))
+        self.used = end
+        self.offsets.append(off)
+        self.caplens.append(caplen)
+        self.lens.append(h.len)
+        self.tv_sec.append(h.tv_sec)
+        self.tv_usec.append(h.tv_usec)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self,i):
+        off = self.offsets[i]
+        caplen = self.caplens[i]
+        header = pcap_pkthdr_lite(self.lens[i],caplen,self.tv_sec[i],self.tv_usec[i])
+        return header,memoryview(self.buf)[off:off+caplen]
+
+    def __iter__(self):
+        view = memoryview(self.buf)
+        for i in range(len(self.offsets)):
+            off = self.offsets[i]
+            caplen = self.caplens[i]
+            yield pcap_pkthdr_lite(self.lens[i],caplen,self.tv_sec[i],self.tv_usec[i]),view[off:off+caplen]
+
+
+#Lote que se está rellenando en pcap_dispatch_batch
+batch_target = None
+
+def mycallback_batch(us,h,data):
+    batch_target.append(h[0],data)
+
+#Los callbacks de C se crean una única vez y no en cada llamada a pcap_loop/pcap_dispatch
+cf_copy = PCAP_HANDLER(mycallback)
+cf_zerocopy = PCAP_HANDLER(mycallback_zerocopy)
+cf_batch = PCAP_HANDLER(mycallback_batch)
+
 
 def pcap_open_offline(fname:str,errbuf:bytearray) -> ctypes.c_void_p:
     #pcap_t *pcap_open_offline(const char *fname, char *errbuf);
@@ -156,15 +262,14 @@ def pcap_next(handle:ctypes.c_void_p,header)-> bytes:
     return bytes(aux)
 
 
-def pcap_loop(handle:ctypes.c_void_p,cnt:int,callback_fun: Callable[[ctypes.c_void_p,pcap_pkthdr,bytes],None],user:ctypes.c_void_p) -> int:
+def pcap_loop(handle:ctypes.c_void_p,cnt:int,callback_fun: Callable[[ctypes.c_void_p,pcap_pkthdr,bytes],None],user:ctypes.c_void_p,zerocopy:bool=False) -> int:
     global user_callback
     if handle is None:
         raise ValueError("El objeto handle no puede ser None")
    
     user_callback = callback_fun
-    #  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
-    PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
-    cf = PCAP_HANDLER(mycallback)
+    # Con zerocopy=True el callback recibe una pcap_pkthdr_lite y un memoryview válido solo durante la llamada
+    cf = cf_zerocopy if zerocopy else cf_copy
     #int pcap_loop(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
     pl = pcap.pcap_loop
     pl.restype = ctypes.c_int
@@ -174,14 +279,13 @@ def pcap_loop(handle:ctypes.c_void_p,cnt:int,callback_fun: Callable[[ctypes.c_vo
     user_callback = None
     return ret
 
-def pcap_dispatch(handle:ctypes.c_void_p,cnt:int,callback_fun:Callable[[ctypes.c_void_p,pcap_pkthdr,bytes],None],user:ctypes.c_void_p) -> int:
+def pcap_dispatch(handle:ctypes.c_void_p,cnt:int,callback_fun:Callable[[ctypes.c_void_p,pcap_pkthdr,bytes],None],user:ctypes.c_void_p,zerocopy:bool=False) -> int:
     global user_callback
     if handle is None:
         raise ValueError("El objeto handle no puede ser None")
     user_callback = callback_fun
-    #  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
-    PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
-    cf = PCAP_HANDLER(mycallback)
+    # Con zerocopy=True el callback recibe una pcap_pkthdr_lite y un memoryview válido solo durante la llamada
+    cf = cf_zerocopy if zerocopy else cf_copy
     #int pcap_loop(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
     pd = pcap.pcap_dispatch
     pd.restype = ctypes.c_int
@@ -190,6 +294,27 @@ def pcap_dispatch(handle:ctypes.c_void_p,cnt:int,callback_fun:Callable[[ctypes.c
     ret = pd(handle,c,cf,us)
     user_callback = None
     return ret
+
+def pcap_dispatch_batch(handle:ctypes.c_void_p,max_pkts:int,batch:pcap_batch=None) -> pcap_batch:
+    # Captura con una única llamada a pcap_dispatch hasta max_pkts paquetes y los devuelve juntos en un pcap_batch.
+    # Si se pasa un lote se vacía y se reutiliza (sus memoryview anteriores dejan de ser válidos).
+    # El valor devuelto por pcap_dispatch (número de paquetes, -1 error, -2 pcap_breakloop) queda en batch.ret
+    global batch_target
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    if max_pkts <= 0:
+        raise ValueError("max_pkts debe ser mayor que 0")
+    if batch is None:
+        batch = pcap_batch(max_pkts)
+    else:
+        batch.clear()
+    batch_target = batch
+    pd = pcap.pcap_dispatch
+    pd.restype = ctypes.c_int
+    batch.ret = pd(handle,ctypes.c_int(max_pkts),cf_batch,None)
+    batch_target = None
+    return batch
+
 def pcap_breakloop(handle:ctypes.c_void_p):
     #void pcap_breakloop(pcap_t *);
     if handle is None:
@@ -203,13 +328,95 @@ def pcap_inject(handle:ctypes.c_void_p,buf:bytes,size:int) -> int:
         raise ValueError("El objeto handle no puede ser None")
     if buf is None:
         raise ValueError("El objeto buf no puede ser None")
-    if not isinstance(buf, bytes):
-        raise ValueError("El objeto buf debe ser de tipo bytes()")
     pi = pcap.pcap_inject
     pi.restype = ctypes.c_int
-    ret = pi(handle,ctypes.c_char_p(buf),ctypes.c_longlong(size))
+    ret = pi(handle,_txbuf(buf),ctypes.c_longlong(size))
+    return ret
+
+def _txbuf(buf):
+    #Convierte el buffer a enviar en un argumento de ctypes. Los bytearray se pasan sin copia a través de un array
+    #de ctypes sobre su memoria; también se admiten directamente arrays de ctypes (por ejemplo de un pool de buffers)
+    if isinstance(buf, bytes):
+        return ctypes.c_char_p(buf)
+    if isinstance(buf, bytearray):
+        return (ctypes.c_char * len(buf)).from_buffer(buf)
+    if isinstance(buf, ctypes.Array):
+        return buf
+    raise ValueError("El objeto buf debe ser de tipo bytes(), bytearray() o un array de ctypes")
+
+def pcap_sendpacket(handle:ctypes.c_void_p,buf:bytes,size:int) -> int:
+    #int pcap_sendpacket(pcap_t *p, const u_char *buf, int size);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    if buf is None:
+        raise ValueError("El objeto buf no puede ser None")
+    ps = pcap.pcap_sendpacket
+    ps.restype = ctypes.c_int
+    ret = ps(handle,_txbuf(buf),ctypes.c_int(size))
+    return ret
+
+PCAP_NETMASK_UNKNOWN = 0xffffffff
+
+class bpf_program(ctypes.Structure):
+    _fields_ = [("bf_len", ctypes.c_uint), ("bf_insns", ctypes.c_void_p)]
+
+def pcap_compile(handle:ctypes.c_void_p,fp:bpf_program,expr:str,optimize:int,netmask:int) -> int:
+    #int pcap_compile(pcap_t *p, struct bpf_program *fp, const char *str, int optimize, bpf_u_int32 netmask);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    if fp is None:
+        raise ValueError("El objeto fp no puede ser None")
+    pc = pcap.pcap_compile
+    pc.restype = ctypes.c_int
+    ret = pc(handle,ctypes.byref(fp),bytes(str(expr),'ascii'),ctypes.c_int(optimize),ctypes.c_uint32(netmask))
+    return ret
+
+def pcap_setfilter(handle:ctypes.c_void_p,fp:bpf_program) -> int:
+    #int pcap_setfilter(pcap_t *p, struct bpf_program *fp);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    if fp is None:
+        raise ValueError("El objeto fp no puede ser None")
+    psf = pcap.pcap_setfilter
+    psf.restype = ctypes.c_int
+    ret = psf(handle,ctypes.byref(fp))
+    return ret
+
+def pcap_freecode(fp:bpf_program):
+    #void pcap_freecode(struct bpf_program *);
+    if fp is None:
+        raise ValueError("El objeto fp no puede ser None")
+    pf = pcap.pcap_freecode
+    pf(ctypes.byref(fp))
+
+def pcap_get_selectable_fd(handle:ctypes.c_void_p) -> int:
+    #int pcap_get_selectable_fd(pcap_t *p);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    pgs = pcap.pcap_get_selectable_fd
+    pgs.restype = ctypes.c_int
+    return pgs(handle)
+
+def pcap_setnonblock(handle:ctypes.c_void_p,nonblock:int,errbuf:bytearray) -> int:
+    #int pcap_setnonblock(pcap_t *p, int nonblock, char *errbuf);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    psn = pcap.pcap_setnonblock
+    psn.restype = ctypes.c_int
+    eb = ctypes.create_string_buffer(256)
+    ret = psn(handle,ctypes.c_int(nonblock),eb)
+    if errbuf is not None:
+        errbuf.extend(bytes(format(eb.value).encode('ascii')))
     return ret
 
+def pcap_geterr(handle:ctypes.c_void_p) -> str:
+    #char *pcap_geterr(pcap_t *p);
+    if handle is None:
+        raise ValueError("El objeto handle no puede ser None")
+    pge = pcap.pcap_geterr
+    pge.restype = ctypes.c_char_p
+    return pge(handle).decode('ascii','replace')
+
 
 
 
@@ -0,0 +1,160 @@
+'''
+    reassembly.py
+    Reensamblado de fragmentos IP.
+    Cada datagrama en reensamblado se identifica por (IP origen, IP destino, protocolo, IPID) y tiene un buffer propio
+    que se reserva una sola vez al llegar el primer fragmento y se rellena en el sitio según llegan los demás. Si el
+    primer fragmento es el último (MF a 0) la longitud total ya se conoce y el buffer tiene ese tamaño; si no, se
+    reserva el máximo por datagrama (REASM_MAX_FLOW_BYTES), de forma que el buffer nunca se amplía ni se copia.
+    Los huecos pendientes se llevan con descriptores de hueco (RFC 815). Se limita la memoria por datagrama y la
+    memoria total, y los datagramas incompletos se descartan cuando vence su tiempo de reensamblado.
+    2022 EPS-UAM
+'''
+
+import time
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+#Tiempo máximo (en segundos) para completar un datagrama
+REASM_TIMEOUT = 30
+#Tamaño máximo de un datagrama reensamblado (payload IP)
+REASM_MAX_FLOW_BYTES = 65535
+#Memoria total máxima dedicada a buffers de reensamblado (64 datagramas de tamaño máximo)
+REASM_MAX_TOTAL_BYTES = 4 * 1024 * 1024
+#Marca de hueco abierto (hasta el final del datagrama, todavía desconocido)
+HOLE_INFINITY = 1 << 31
+
+
+class _Datagram():
+    ''' Estado de reensamblado de un datagrama
+    '''
+    __slots__ = ('buf', 'holes', 'total', 'end', 'created')
+    def __init__(self, size:int, now:float):
+        self.buf = bytearray(size)
+        #Lista de huecos (primer byte, último byte) todavía por recibir
+        self.holes = [(0, HOLE_INFINITY)]
+        #Longitud total del payload (se conoce al recibir el último fragmento)
+        self.total = None
+        #Fin (último byte + 1) de los datos ya recibidos
+        self.end = 0
+        self.created = now
+
+
+class IPReassembler():
+    ''' Motor de reensamblado de fragmentos IP. Es seguro llamarlo desde varios hilos.
+    '''
+    def __init__(self, timeout:float = REASM_TIMEOUT, maxFlowBytes:int = REASM_MAX_FLOW_BYTES, maxTotalBytes:int = REASM_MAX_TOTAL_BYTES):
+        self.timeout = timeout
+        self.maxFlowBytes = maxFlowBytes
+        self.maxTotalBytes = maxTotalBytes
+        self.lock = Lock()
+        #Datagramas en reensamblado por orden de creación (el primero es el más antiguo)
+        self.datagrams = OrderedDict()
+        self.allocated = 0
+        self.counters = {'fragments': 0, 'reassembled': 0, 'timeouts': 0, 'evicted': 0, 'dropped': 0}
+
+    def _release(self, key, counter:str = None):
+        d = self.datagrams.pop(key)
+        self.allocated -= len(d.buf)
+        if counter is not None:
+            self.counters[counter] += 1
+        return d
+
+    def _expire(self, now:float):
+        while self.datagrams:
+            key, d = next(iter(self.datagrams.items()))
+            if now - d.created < self.timeout:
+                break
+            logging.debug('Reensamblado: tiempo agotado para el datagrama {}'.format(key))
+            self._release(key, 'timeouts')
+
+    def _reserve(self, size:int) -> bool:
+        #Reserva size bytes respetando el límite global (expulsando los datagramas más antiguos)
+        if size > self.maxTotalBytes:
+            return False
+        while self.allocated + size > self.maxTotalBytes:
+            self._release(next(iter(self.datagrams)), 'evicted')
+        self.allocated += size
+        return True
+
+    def add(self, key, offset:int, mf:bool, payload, now:float = None):
+        '''
+            Nombre: add
+            Descripción: Añade un fragmento al datagrama identificado por key. Los bytes que solapan con datos ya
+                recibidos se ignoran (prevalece el primer fragmento recibido). Un fragmento que contradice la longitud
+                total ya conocida, o un último fragmento que la fija por debajo de datos ya recibidos, descarta el
+                datagrama completo.
+            Argumentos:
+                -key: identificador del datagrama (IP origen, IP destino, protocolo, IPID)
+                -offset: desplazamiento del fragmento en bytes
+                -mf: True si el fragmento tiene activo el bit More Fragments
+                -payload: datos del fragmento
+                -now: instante actual (por defecto time.monotonic())
+            Retorno: memoryview con el payload completo cuando el datagrama se ha completado, None en otro caso
+        '''
+        if now is None:
+            now = time.monotonic()
+        first = offset
+        last = offset + len(payload) - 1
+        with self.lock:
+            self.counters['fragments'] += 1
+            self._expire(now)
+
+            #Un fragmento intermedio vacío o fuera de los límites no es válido
+            if last < first or last >= self.maxFlowBytes:
+                self.counters['dropped'] += 1
+                if key in self.datagrams:
+                    self._release(key)
+                return None
+
+            d = self.datagrams.get(key)
+            if d is None:
+                size = last + 1 if not mf else self.maxFlowBytes
+                if not self._reserve(size):
+                    self.counters['dropped'] += 1
+                    return None
+                d = _Datagram(size, now)
+                self.datagrams[key] = d
+
+            if not mf:
+                if (d.total is not None and d.total != last + 1) or d.end > last + 1:
+                    self._release(key, 'dropped')
+                    return None
+                d.total = last + 1
+                #Los huecos más allá del final dejan de existir
+                d.holes = [(hf, min(hl, last)) for hf, hl in d.holes if hf <= last]
+            elif d.total is not None and last >= d.total:
+                self._release(key, 'dropped')
+                return None
+
+            holes = []
+            for hf, hl in d.holes:
+                if first > hl or last < hf:
+                    holes.append((hf, hl))
+                    continue
+                #Se copia solo la parte del fragmento que rellena este hueco
+                cf = max(first, hf)
+                cl = min(last, hl)
+                d.buf[cf:cl + 1] = payload[cf - first:cl - first + 1]
+                if first > hf:
+                    holes.append((hf, first - 1))
+                if last < hl:
+                    holes.append((last + 1, hl))
+            d.holes = holes
+            d.end = max(d.end, last + 1)
+
+            if holes:
+                return None
+
+            self._release(key, 'reassembled')
+        return memoryview(d.buf)[:d.total]
+
+    def stats(self) -> dict:
+        '''
+            Devuelve los contadores del reensamblado, el número de datagramas pendientes y la memoria reservada
+        '''
+        with self.lock:
+            s = dict(self.counters)
+            s['pending'] = len(self.datagrams)
+            s['allocated'] = self.allocated
+        return s
@@ -0,0 +1,153 @@
+'''
+    routing.py
+    Tabla de rutas IP con búsqueda por prefijo más largo (longest-prefix-match).
+    Las rutas se guardan agrupadas por longitud de prefijo: un diccionario red -> ruta para cada longitud, y la lista
+    de longitudes presentes ordenada de mayor a menor. Una búsqueda recorre esa lista (como mucho 33 entradas) y hace
+    una consulta a diccionario por longitud.
+    Formato del fichero de rutas (una ruta por línea, '#' inicia un comentario):
+        red/prefijo gateway [mtu]
+    donde gateway es 0.0.0.0 o '-' para redes directamente conectadas.
+    2022 EPS-UAM
+'''
+
+import socket
+import struct
+from threading import Lock
+
+
+def prefixToMask(prefixlen:int) -> int:
+    return (0xffffffff << (32 - prefixlen)) & 0xffffffff
+
+def maskToPrefix(netmask:int) -> int:
+    return bin(netmask & 0xffffffff).count('1')
+
+def ipToInt(ip:str) -> int:
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def intToIp(ip:int) -> str:
+    return socket.inet_ntoa(struct.pack('!I', ip))
+
+
+class Route():
+    ''' Entrada de la tabla de rutas. gateway vale 0 si la red está directamente conectada
+    '''
+    __slots__ = ('network', 'prefixlen', 'gateway', 'mtu')
+    def __init__(self, network:int, prefixlen:int, gateway:int, mtu:int):
+        self.network = network
+        self.prefixlen = prefixlen
+        self.gateway = gateway
+        self.mtu = mtu
+
+    def __repr__(self):
+        return '{}/{} via {} mtu {}'.format(intToIp(self.network), self.prefixlen,
+            intToIp(self.gateway) if self.gateway else 'on-link', self.mtu)
+
+
+class RoutingTable():
+    ''' Tabla de rutas con búsqueda por prefijo más largo. Es segura para varios hilos: las modificaciones se
+        serializan con un cerrojo y las búsquedas leen una copia inmutable de la lista de longitudes.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        #Longitud de prefijo -> {red: Route}
+        self.buckets = {}
+        #Longitudes con alguna ruta, de mayor a menor
+        self.prefixes = ()
+        #Se incrementa con cada cambio, para invalidar las cachés que dependen de la tabla
+        self.version = 0
+
+    def add(self, network:int, prefixlen:int, gateway:int = 0, mtu:int = None) -> Route:
+        '''
+            Nombre: add
+            Descripción: Añade (o reemplaza) la ruta hacia network/prefixlen
+            Argumentos:
+                -network: entero de 32 bits con la dirección de red (se le aplica la máscara)
+                -prefixlen: longitud del prefijo (0-32)
+                -gateway: entero de 32 bits con la IP del siguiente salto, 0 si la red está directamente conectada
+                -mtu: MTU de la ruta o None para usar la de la interfaz
+            Retorno: La ruta añadida
+        '''
+        if not 0 <= prefixlen <= 32:
+            raise ValueError('Longitud de prefijo no válida: {}'.format(prefixlen))
+        network &= prefixToMask(prefixlen)
+        route = Route(network, prefixlen, gateway, mtu)
+        with self.lock:
+            bucket = self.buckets.setdefault(prefixlen, {})
+            bucket[network] = route
+            self.prefixes = tuple(sorted(self.buckets, reverse=True))
+            self.version += 1
+        return route
+
+    def remove(self, network:int, prefixlen:int) -> bool:
+        network &= prefixToMask(prefixlen)
+        with self.lock:
+            bucket = self.buckets.get(prefixlen)
+            if bucket is None or bucket.pop(network, None) is None:
+                return False
+            if not bucket:
+                del self.buckets[prefixlen]
+                self.prefixes = tuple(sorted(self.buckets, reverse=True))
+            self.version += 1
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.buckets = {}
+            self.prefixes = ()
+            self.version += 1
+
+    def lookup(self, ip:int) -> Route:
+        '''
+            Nombre: lookup
+            Descripción: Busca la ruta con el prefijo más largo que contiene a ip
+            Argumentos:
+                -ip: entero de 32 bits con la IP destino
+            Retorno: La ruta (Route) o None si no hay ninguna
+        '''
+        buckets = self.buckets
+        for prefixlen in self.prefixes:
+            bucket = buckets.get(prefixlen)
+            if bucket is None:
+                continue
+            route = bucket.get(ip & prefixToMask(prefixlen))
+            if route is not None:
+                return route
+        return None
+
+    def load(self, fname:str) -> int:
+        '''
+            Nombre: load
+            Descripción: Añade a la tabla las rutas de un fichero (ver formato en la cabecera del módulo)
+            Argumentos:
+                -fname: nombre del fichero
+            Retorno: Número de rutas añadidas. Lanza ValueError si alguna línea no es válida
+        '''
+        n = 0
+        with open(fname, 'r') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                try:
+                    if len(fields) not in (2, 3):
+                        raise ValueError('número de campos incorrecto')
+                    if '/' in fields[0]:
+                        network, prefixlen = fields[0].split('/')
+                        prefixlen = int(prefixlen)
+                    else:
+                        network, prefixlen = fields[0], 32
+                    if fields[0] == 'default':
+                        network, prefixlen = '0.0.0.0', 0
+                    gateway = 0 if fields[1] == '-' else ipToInt(fields[1])
+                    mtu = int(fields[2]) if len(fields) == 3 else None
+                    self.add(ipToInt(network), prefixlen, gateway, mtu)
+                except (ValueError, OSError) as e:
+                    raise ValueError('{}:{}: ruta no válida ({})'.format(fname, lineno, e))
+                n += 1
+        return n
+
+    def routes(self) -> list:
+        #Lista de rutas de la más específica a la menos específica
+        buckets = self.buckets
+        return [r for p in self.prefixes for r in buckets.get(p, {}).values()]
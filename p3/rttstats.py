@@ -0,0 +1,165 @@
+'''
+    rttstats.py
+    Estadísticas de RTT por destino para las medidas de ping: enviados, recibidos, pérdidas, mínimo, media, máximo,
+    desviación típica y percentiles. Los RTT se miden en microsegundos (enteros).
+    Los percentiles se estiman con un histograma logarítmico-lineal de tamaño fijo (al estilo de HDR Histogram): cada
+    potencia de dos se divide en el mismo número de cubetas, por lo que el error relativo de cualquier percentil está
+    acotado (1/128 con HIST_SUB_BITS = 8) y la memoria no depende del número de respuestas. Añadir una muestra es O(1):
+    el índice de la cubeta se calcula con bit_length y desplazamientos.
+    2022 EPS-UAM
+'''
+
+import math
+
+#Percentiles que se muestran en los informes
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+#Bits de precisión del histograma: los valores menores que 2^HIST_SUB_BITS son exactos y el resto se agrupan en
+#2^(HIST_SUB_BITS-1) cubetas por potencia de dos
+HIST_SUB_BITS = 8
+#Valor máximo representable (en microsegundos). Los valores mayores se cuentan en la última cubeta
+HIST_MAX_BITS = 32
+
+
+class RTTHistogram():
+    ''' Histograma logarítmico-lineal de enteros no negativos con memoria constante
+    '''
+    def __init__(self, subBits:int = HIST_SUB_BITS, maxBits:int = HIST_MAX_BITS):
+        self.subBits = subBits
+        self.maxBits = maxBits
+        self.half = 1 << (subBits - 1)
+        self.maxValue = (1 << maxBits) - 1
+        self.counts = [0] * self.index(self.maxValue) + [0]
+        self.total = 0
+
+    def index(self, value:int) -> int:
+        #Índice de la cubeta de value
+        shift = value.bit_length() - self.subBits
+        if shift <= 0:
+            return value
+        return (shift << (self.subBits - 1)) + (value >> shift)
+
+    def bounds(self, index:int) -> tuple:
+        #Valores mínimo y máximo de la cubeta index
+        if index < (1 << self.subBits):
+            return index, index
+        shift = (index >> (self.subBits - 1)) - 1
+        low = (self.half + (index & (self.half - 1))) << shift
+        return low, low + (1 << shift) - 1
+
+    def add(self, value:int):
+        if value < 0:
+            value = 0
+        elif value > self.maxValue:
+            value = self.maxValue
+        self.counts[self.index(value)] += 1
+        self.total += 1
+
+    def quantile(self, q:float) -> int:
+        '''
+            Nombre: quantile
+            Descripción: Estima un cuantil recorriendo las cubetas acumuladas
+            Argumentos:
+                -q: cuantil entre 0 y 1
+            Retorno: Punto medio de la cubeta que contiene el cuantil o None si el histograma está vacío
+        '''
+        if self.total == 0:
+            return None
+        rank = max(1, math.ceil(q * self.total))
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                low, high = self.bounds(i)
+                return (low + high) // 2
+        return self.maxValue
+
+    def merge(self, other:'RTTHistogram'):
+        if other.subBits != self.subBits or other.maxBits != self.maxBits:
+            raise ValueError('Los histogramas tienen distinta precisión')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def export(self) -> dict:
+        #Representación serializable (por ejemplo con json): solo se incluyen las cubetas no vacías
+        return {'subBits': self.subBits, 'maxBits': self.maxBits, 'total': self.total,
+                'buckets': [[low, high, c] for low, high, c in
+                            ((*self.bounds(i), c) for i, c in enumerate(self.counts) if c)]}
+
+    @classmethod
+    def load(cls, exported:dict) -> 'RTTHistogram':
+        hist = cls(exported['subBits'], exported['maxBits'])
+        for low, high, c in exported['buckets']:
+            hist.counts[hist.index(low)] += c
+            hist.total += c
+        return hist
+
+
+class RTTStats():
+    ''' Estadísticas de RTT de un destino. La media y la desviación se calculan de forma incremental (Welford) y los
+        percentiles con un RTTHistogram, por lo que la memoria es constante
+    '''
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.histogram = RTTHistogram()
+
+    def add(self, rtt:int):
+        '''
+            Nombre: add
+            Descripción: Añade una muestra de RTT
+            Argumentos:
+                -rtt: RTT en microsegundos
+            Retorno: Ninguno
+        '''
+        self.received += 1
+        if self.min is None or rtt < self.min:
+            self.min = rtt
+        if self.max is None or rtt > self.max:
+            self.max = rtt
+        delta = rtt - self.mean
+        self.mean += delta / self.received
+        self.m2 += delta * (rtt - self.mean)
+        self.histogram.add(rtt)
+
+    def stddev(self) -> float:
+        if self.received < 2:
+            return 0.0
+        return math.sqrt(self.m2 / self.received)
+
+    def percentile(self, p:float) -> int:
+        '''
+            Nombre: percentile
+            Descripción: Estima un percentil de los RTT recibidos a partir del histograma
+            Argumentos:
+                -p: percentil entre 0 y 100
+            Retorno: RTT en microsegundos o None si no hay muestras
+        '''
+        value = self.histogram.quantile(p / 100)
+        if value is None:
+            return None
+        #El punto medio de la cubeta puede quedar fuera del rango observado
+        return min(max(value, self.min), self.max)
+
+    def loss(self) -> float:
+        #Porcentaje de peticiones sin respuesta
+        return 100.0 * self.lost / self.sent if self.sent else 0.0
+
+    def export(self) -> dict:
+        #Estadísticas e histograma en un diccionario serializable
+        return {'sent': self.sent, 'received': self.received, 'lost': self.lost, 'min': self.min, 'max': self.max,
+                'mean': self.mean, 'stddev': self.stddev(),
+                'percentiles': {str(p): self.percentile(p) for p in REPORT_PERCENTILES},
+                'histogram': self.histogram.export()}
+
+    def summary(self) -> str:
+        line = '{} enviados, {} recibidos, {:.1f}% pérdidas'.format(self.sent, self.received, self.loss())
+        if self.received:
+            line += ', rtt min/avg/max/stddev = {:.3f}/{:.3f}/{:.3f}/{:.3f} ms'.format(
+                self.min / 1000, self.mean / 1000, self.max / 1000, self.stddev() / 1000)
+            line += ', ' + ' '.join('p{}={:.3f}'.format(p, self.percentile(p) / 1000) for p in REPORT_PERCENTILES) + ' ms'
+        return line
@@ -0,0 +1,103 @@
+'''
+    test_ip.py
+    Pruebas de la fragmentación IP: se comprueban offsets, MF y payload de los fragmentos que genera buildIPFragments,
+    directamente y tras volcarlos a una traza con un handle de pcap_open_dead y pcap_dump (esta última prueba necesita
+    libpcap) y volver a leerlos con pcap_mmap.
+    Uso: python3 -m pytest -q test_ip.py
+    2022 EPS-UAM
+'''
+
+import struct
+import pytest
+import rc1_pcap
+from rc1_pcap import *
+from pcap_mmap import *
+import ip
+
+SRC_IP = 0x0a000001
+DST_IP = 0x0a000002
+ETH_HEADER = bytes([0x02,0,0,0,0,0x02]) + bytes([0x02,0,0,0,0,0x01]) + bytes([0x08,0x00])
+
+
+def dumpFragments(fname:str, fragments:list) -> None:
+    #Vuelca los fragmentos (con una cabecera Ethernet) a una traza
+    handle = pcap_open_dead(DLT_EN10MB, 65535)
+    dumper = pcap_dump_open(handle, fname)
+    assert dumper
+    for i, frag in enumerate(fragments):
+        frame = ETH_HEADER + bytes(frag)
+        header = pcap_pkthdr()
+        header.len = header.caplen = len(frame)
+        header.ts = timeval(1, i)
+        pcap_dump(dumper, header, frame)
+    pcap_dump_close(dumper)
+    pcap_close(handle)
+
+
+def parseIPHeader(packet:bytes) -> tuple:
+    #Devuelve (longitud total, IPID, MF, offset en bytes, payload) de un datagrama IP
+    tlen, ipid, flagsandoffset = struct.unpack_from('!HHH', packet, 2)
+    hlen = (packet[0] & 0x0f) * 4
+    return tlen, ipid, flagsandoffset >> 13 & 1, (flagsandoffset & 0x1fff) * 8, packet[hlen:tlen]
+
+
+def readIPHeaders(fname:str) -> list:
+    #Devuelve la cabecera analizada con parseIPHeader de cada datagrama IP de la traza
+    errbuf = bytearray()
+    handle = pcap_mmap_open_offline(fname, errbuf)
+    assert handle is not None, errbuf
+    headers = [parseIPHeader(bytes(data[14:])) for header, data in pcap_mmap_iter(handle)]
+    pcap_mmap_close(handle)
+    return headers
+
+
+@pytest.fixture
+def ipState(monkeypatch):
+    monkeypatch.setattr(ip, 'myIP', SRC_IP, raising=False)
+    monkeypatch.setattr(ip, 'ipHeaderTemplates', {})
+
+
+@pytest.mark.parametrize('size, mtu, opts', [
+    (1, 1500, None),
+    (1480, 1500, None),
+    (1481, 1500, None),
+    (3000, 1500, None),
+    (5000, 576, None),
+    (4000, 1006, None),
+    (2000, 1000, bytes([0x94, 0x04, 0, 0])),
+])
+def test_build_fragments(ipState, size, mtu, opts):
+    data = (bytes(range(256)) * (size // 256 + 1))[:size]
+    tpl = ip.getIPHeaderTemplate(DST_IP, bytes([0x11]), opts)
+    fragments = ip.buildIPFragments(tpl, data, 0x1234, mtu)
+    headers = [parseIPHeader(bytes(frag)) for frag in fragments]
+
+    assert all(len(frag) <= mtu for frag in fragments)
+    assert all(tlen == len(frag) for frag, (tlen, ipid, mf, offset, payload) in zip(fragments, headers))
+    assert all(offset % 8 == 0 for tlen, ipid, mf, offset, payload in headers)
+    assert [mf for tlen, ipid, mf, offset, payload in headers] == [1] * (len(headers) - 1) + [0]
+    assert all(ipid == 0x1234 for tlen, ipid, mf, offset, payload in headers)
+    #Cada fragmento empieza donde termina el anterior y juntos reconstruyen el payload
+    pos = 0
+    for tlen, ipid, mf, offset, payload in headers:
+        assert offset == pos
+        pos += len(payload)
+    assert b''.join(payload for tlen, ipid, mf, offset, payload in headers) == data
+
+
+@pytest.mark.skipif(rc1_pcap.pcap is None, reason='Se necesita libpcap para pcap_open_dead y pcap_dump')
+def test_fragments_offsets_and_mf(tmp_path, ipState):
+    data = bytes(range(256)) * 11 + bytes(184)
+    assert len(data) == 3000
+
+    tpl = ip.getIPHeaderTemplate(DST_IP, bytes([0x11]), None)
+    fragments = ip.buildIPFragments(tpl, data, 0x1234, 1500)
+    fname = str(tmp_path / 'fragmentos.pcap')
+    dumpFragments(fname, fragments)
+    headers = readIPHeaders(fname)
+
+    assert [offset for tlen, ipid, mf, offset, payload in headers] == [0, 1480, 2960]
+    assert [mf for tlen, ipid, mf, offset, payload in headers] == [1, 1, 0]
+    assert [tlen for tlen, ipid, mf, offset, payload in headers] == [1500, 1500, 60]
+    assert all(ipid == 0x1234 for tlen, ipid, mf, offset, payload in headers)
+    assert b''.join(payload for tlen, ipid, mf, offset, payload in headers) == data
@@ -0,0 +1,110 @@
+'''
+    test_reassembly.py
+    Pruebas del reensamblado IP: se entregan fragmentos construidos a mano a IPReassembler (no necesita libpcap).
+    Uso: python3 -m pytest -q test_reassembly.py
+    2022 EPS-UAM
+'''
+
+from reassembly import *
+
+KEY = (0x0a000001, 0x0a000002, 17, 0x1234)
+DATA = bytes(range(256)) * 4
+
+
+def fragment(data:bytes, offset:int, length:int) -> tuple:
+    #Devuelve (offset, MF, payload) del fragmento de data que empieza en offset
+    return offset, offset + length < len(data), data[offset:offset + length]
+
+
+def test_in_order():
+    r = IPReassembler()
+    assert r.add(KEY, *fragment(DATA, 0, 512), now=0) is None
+    assert r.add(KEY, *fragment(DATA, 512, 512), now=0) == DATA
+    s = r.stats()
+    assert s['reassembled'] == 1 and s['pending'] == 0 and s['allocated'] == 0
+
+
+def test_holes():
+    r = IPReassembler()
+    assert r.add(KEY, *fragment(DATA, 256, 256), now=0) is None
+    assert r.datagrams[KEY].holes == [(0, 255), (512, HOLE_INFINITY)]
+    assert r.add(KEY, *fragment(DATA, 768, 256), now=0) is None
+    assert r.datagrams[KEY].holes == [(0, 255), (512, 767)]
+    assert r.add(KEY, *fragment(DATA, 0, 256), now=0) is None
+    assert r.datagrams[KEY].holes == [(512, 767)]
+    assert r.add(KEY, *fragment(DATA, 512, 256), now=0) == DATA
+
+
+def test_out_of_order():
+    r = IPReassembler()
+    for offset in (768, 256, 512):
+        assert r.add(KEY, *fragment(DATA, offset, 256), now=0) is None
+    assert r.add(KEY, *fragment(DATA, 0, 256), now=0) == DATA
+
+
+def test_last_fragment_first_sizes_buffer():
+    r = IPReassembler()
+    assert r.add(KEY, *fragment(DATA, 512, 512), now=0) is None
+    assert r.stats()['allocated'] == len(DATA)
+    assert r.add(KEY, *fragment(DATA, 0, 512), now=0) == DATA
+
+
+def test_overlap_first_wins():
+    r = IPReassembler()
+    assert r.add(KEY, 0, True, bytes(512), now=0) is None
+    #El fragmento solapado trae otros bytes en [256, 512): se conservan los del primer fragmento
+    assert r.add(KEY, 256, False, b'\xff' * 768, now=0) == bytes(512) + b'\xff' * 512
+
+
+def test_short_final_fragment_dropped():
+    r = IPReassembler()
+    assert r.add(KEY, *fragment(DATA, 0, 512), now=0) is None
+    #Último fragmento que fija la longitud total por debajo de los datos ya recibidos
+    assert r.add(KEY, 0, False, DATA[:256], now=0) is None
+    s = r.stats()
+    assert s['dropped'] == 1 and s['pending'] == 0 and s['allocated'] == 0
+
+
+def test_fragment_beyond_total_dropped():
+    r = IPReassembler()
+    assert r.add(KEY, *fragment(DATA, 512, 512), now=0) is None
+    assert r.add(KEY, 1024, True, DATA[:256], now=0) is None
+    assert r.stats()['dropped'] == 1 and r.stats()['pending'] == 0
+
+
+def test_flow_cap():
+    r = IPReassembler(maxFlowBytes=512)
+    assert r.add(KEY, *fragment(DATA, 0, 256), now=0) is None
+    assert r.stats()['allocated'] == 512
+    #El fragmento sobrepasa el máximo por datagrama y descarta el datagrama completo
+    assert r.add(KEY, *fragment(DATA, 256, 512), now=0) is None
+    s = r.stats()
+    assert s['dropped'] == 1 and s['pending'] == 0 and s['allocated'] == 0
+
+
+def test_global_cap_evicts_oldest():
+    r = IPReassembler(maxFlowBytes=512, maxTotalBytes=1024)
+    keys = [KEY[:3] + (ipid,) for ipid in range(3)]
+    for key in keys:
+        assert r.add(key, 0, True, DATA[:256], now=0) is None
+    s = r.stats()
+    assert s['evicted'] == 1 and s['pending'] == 2 and s['allocated'] == 1024
+    assert keys[0] not in r.datagrams
+    assert r.add(keys[2], 256, False, DATA[256:512], now=0) == DATA[:512]
+
+
+def test_global_cap_too_small():
+    r = IPReassembler(maxFlowBytes=512, maxTotalBytes=256)
+    assert r.add(KEY, 0, True, DATA[:256], now=0) is None
+    s = r.stats()
+    assert s['dropped'] == 1 and s['pending'] == 0 and s['allocated'] == 0
+
+
+def test_timeout():
+    r = IPReassembler(timeout=30)
+    assert r.add(KEY, *fragment(DATA, 0, 512), now=100) is None
+    assert r.add(KEY, *fragment(DATA, 512, 256), now=129) is None
+    #El datagrama caduca antes de procesar el último fragmento, que abre uno nuevo
+    assert r.add(KEY, *fragment(DATA, 768, 256), now=130) is None
+    s = r.stats()
+    assert s['timeouts'] == 1 and s['pending'] == 1
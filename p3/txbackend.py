@@ -0,0 +1,206 @@
+'''
+    txbackend.py
+    Envío de tramas Ethernet: pool de buffers de transmisión reutilizables y backends de envío intercambiables.
+    Las tramas se construyen en el sitio sobre buffers preasignados del pool (cabecera con struct.pack_into y payload
+    copiado a continuación), de forma que el envío no crea objetos bytes nuevos por trama.
+    Backends disponibles:
+        -inject: pcap_inject sobre el handle de libpcap
+        -sendpacket: pcap_sendpacket sobre el handle de libpcap
+        -packet: socket AF_PACKET propio. Los lotes se envían con una sola llamada a sendmmsg (libc) cuando está
+        disponible, y trama a trama con send en otro caso
+    2022 EPS-UAM
+'''
+
+import ctypes
+import logging
+import socket
+import struct
+import threading
+from collections import deque
+from rc1_pcap import *
+
+TX_INJECT = 'inject'
+TX_SENDPACKET = 'sendpacket'
+TX_PACKET = 'packet'
+TX_BACKENDS = (TX_INJECT, TX_SENDPACKET, TX_PACKET)
+
+#Tamaño de cada buffer de transmisión (trama Ethernet máxima sin FCS)
+TX_BUFFER_SIZE = 1514
+#Número máximo de buffers libres que se conservan en el pool
+TX_POOL_SIZE = 256
+#Número máximo de tramas por llamada a sendmmsg
+TX_BATCH_MAX = 64
+
+ETH_HEADER = struct.Struct('!6s6s2s')
+
+
+class TxBuffer():
+    ''' Buffer de transmisión. La memoria del bytearray queda fijada por el array de ctypes que la envuelve, de forma
+        que se puede pasar a libpcap o a sendmmsg sin conversiones en cada envío.
+    '''
+    __slots__ = ('buf', 'view', 'cbuf', 'addr')
+    def __init__(self, size:int):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.cbuf = (ctypes.c_char * size).from_buffer(self.buf)
+        self.addr = ctypes.addressof(self.cbuf)
+
+
+class TxBufferPool():
+    ''' Pool de buffers de transmisión. get y put se pueden llamar desde varios hilos (deque es atómica y el contador
+        de buffers creados se protege con lock). Si el pool está vacío se crea un buffer nuevo; al devolverlos solo se
+        conservan hasta maxFree.
+    '''
+    def __init__(self, size:int = TX_BUFFER_SIZE, maxFree:int = TX_POOL_SIZE):
+        self.size = size
+        self.maxFree = maxFree
+        self.free = deque()
+        self.allocated = 0
+        self.lock = threading.Lock()
+
+    def get(self) -> TxBuffer:
+        try:
+            return self.free.pop()
+        except IndexError:
+            with self.lock:
+                self.allocated += 1
+            return TxBuffer(self.size)
+
+    def put(self, txb:TxBuffer):
+        if len(self.free) < self.maxFree:
+            self.free.append(txb)
+
+
+def buildFrame(txb:TxBuffer, dstMac:bytes, srcMac:bytes, etherType:bytes, data, minLen:int) -> int:
+    '''
+        Nombre: buildFrame
+        Descripción: Escribe una trama Ethernet en un buffer de transmisión: cabecera con pack_into, payload a
+            continuación y relleno con ceros hasta minLen
+        Argumentos:
+            -txb: buffer de transmisión
+            -dstMac, srcMac: direcciones MAC destino y origen
+            -etherType: bytes con el tipo Ethernet
+            -data: payload (bytes, bytearray o memoryview)
+            -minLen: longitud mínima de la trama
+        Retorno: Longitud de la trama, o -1 si no cabe en el buffer
+    '''
+    buf = txb.buf
+    n = 14 + len(data)
+    if n > len(buf):
+        return -1
+    ETH_HEADER.pack_into(buf, 0, dstMac, srcMac, etherType)
+    buf[14:n] = data
+    if n < minLen:
+        buf[n:minLen] = bytes(minLen - n)
+        n = minLen
+    return n
+
+
+class PcapTxBackend():
+    ''' Envío con pcap_inject o pcap_sendpacket sobre un handle de libpcap ya abierto
+    '''
+    def __init__(self, handle, sendpacket:bool = False):
+        self.handle = handle
+        self.name = TX_SENDPACKET if sendpacket else TX_INJECT
+        self.sendpacket = sendpacket
+
+    def send(self, txb:TxBuffer, length:int) -> int:
+        #Devuelve 0 si la trama se ha enviado y -1 en otro caso
+        if self.sendpacket:
+            return 0 if pcap_sendpacket(self.handle, txb.cbuf, length) == 0 else -1
+        return 0 if pcap_inject(self.handle, txb.cbuf, length) >= 0 else -1
+
+    def sendBatch(self, txbs:list, lengths:list) -> int:
+        #Devuelve el número de tramas enviadas
+        sent = 0
+        for txb, length in zip(txbs, lengths):
+            if self.send(txb, length) == 0:
+                sent += 1
+        return sent
+
+    def close(self):
+        pass
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.c_void_p), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+
+class PacketTxBackend():
+    ''' Envío con un socket AF_PACKET/SOCK_RAW propio asociado a la interfaz. Los lotes se envían con sendmmsg.
+        Los arrays iov y msgs son compartidos y ctypes suelta el GIL durante sendmmsg, por lo que se rellenan y se
+        envían con lock tomado (varios hilos pueden enviar a la vez: aplicación, recepción y resolución ARP)
+    '''
+    name = TX_PACKET
+    def __init__(self, interface:str, batchMax:int = TX_BATCH_MAX):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        self.sock.bind((interface, 0))
+        self.batchMax = batchMax
+        self.lock = threading.Lock()
+        #Array de struct iovec {void *iov_base; size_t iov_len;} como pares de enteros, para rellenar las direcciones y
+        #las longitudes de todo el lote con dos asignaciones por rebanada
+        self.iov = (ctypes.c_size_t * (2 * batchMax))()
+        self.msgs = (_mmsghdr * batchMax)()
+        iovSize = 2 * ctypes.sizeof(ctypes.c_size_t)
+        for i in range(batchMax):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.addressof(self.iov) + i * iovSize
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def send(self, txb:TxBuffer, length:int) -> int:
+        try:
+            return 0 if self.sock.send(txb.view[:length]) == length else -1
+        except OSError as e:
+            logging.debug('Error enviando trama: {}'.format(e))
+            return -1
+
+    def sendBatch(self, txbs:list, lengths:list) -> int:
+        if _sendmmsg is None:
+            return sum(1 for txb, length in zip(txbs, lengths) if self.send(txb, length) == 0)
+        fd = self.sock.fileno()
+        sent = 0
+        total = len(txbs)
+        while sent < total:
+            n = min(total - sent, self.batchMax)
+            with self.lock:
+                self.iov[0:2 * n:2] = [txb.addr for txb in txbs[sent:sent + n]]
+                self.iov[1:2 * n:2] = lengths[sent:sent + n]
+                ret = _sendmmsg(fd, self.msgs, n, 0)
+            if ret <= 0:
+                logging.debug('Error en sendmmsg: {}'.format(ctypes.get_errno()))
+                break
+            sent += ret
+        return sent
+
+    def close(self):
+        self.sock.close()
+
+
+def openTxBackend(name:str, handle = None, interface:str = None):
+    '''
+        Nombre: openTxBackend
+        Descripción: Crea un backend de envío
+        Argumentos:
+            -name: uno de TX_BACKENDS
+            -handle: handle de libpcap (backends inject y sendpacket)
+            -interface: nombre de la interfaz (backend packet)
+        Retorno: El backend creado. Lanza ValueError si el nombre no es válido y OSError si no se puede abrir el socket
+    '''
+    if name == TX_INJECT or name == TX_SENDPACKET:
+        return PcapTxBackend(handle, name == TX_SENDPACKET)
+    if name == TX_PACKET:
+        return PacketTxBackend(interface)
+    raise ValueError('Backend de envío desconocido: {}'.format(name))
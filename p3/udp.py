@@ -6,34 +6,160 @@
     2022 EPS-UAM
 '''
 from ip import *
+import ip as ipLayer
+import socket
 import struct
+from collections import deque
+from threading import Lock
 
 UDP_HLEN = 8
 UDP_PROTO = 17
+UDP_HEADER = struct.Struct('!HHHH')
+#Número de puertos origen reservados en initUDP para los datagramas enviados sin puerto origen. Cada destino
+#(IP y puerto) usa siempre el mismo de ellos
+UDP_FLOW_PORTS = 16
+#Número de puertos reservados en initUDP para los endpoints con puerto propio (se reservan más si se agotan)
+UDP_POOL_SIZE = 64
+#Sockets del sistema que mantienen reservados nuestros puertos para que el sistema no los asigne a otro proceso:
+#puerto -> socket
+udpReserved = {}
+#Puertos compartidos por destino y puertos libres para endpoints
+udpFlowPorts = ()
+udpFreePorts = deque()
+udpPortLock = Lock()
+#Si es True los datagramas se envían con checksum (si no, con checksum 0)
+udpSendChecksum = True
+#Puertos locales en los que no se comprueba el checksum de los datagramas recibidos
+udpNoVerifyPorts = set()
+#Datagramas descartados por checksum incorrecto. Se recibe desde varios hilos y desde asyncio: se protege con udpStatsLock
+udpChecksumErrors = 0
+udpStatsLock = Lock()
+#Funciones de recepción por puerto local. Cada función se llama como callback(us,header,data,srcIP,srcPort)
+#con data el payload UDP y srcIP en bytes
+udpBindings = {}
 
-def getUDPSourcePort():
+
+def registerUDPPort(port,callback):
     '''
-        Nombre: getUDPSourcePort
-        Descripción: Esta función obtiene un puerto origen libre en la máquina actual.
+        Nombre: registerUDPPort
+        Descripción: Esta función registra una función de recepción para los datagramas UDP dirigidos a un puerto local
+        Argumentos:
+            -port: entero de 16 bits con el puerto local
+            -callback: función callback(us,header,data,srcIP,srcPort) o None para eliminar el registro
+        Retorno: True o False en función de si se ha registrado o no (el puerto ya estaba en uso)
+    '''
+    if callback is None:
+        udpBindings.pop(port, None)
+        return True
+    if port in udpBindings:
+        return False
+    udpBindings[port] = callback
+    return True
+
+def reserveUDPPort():
+    '''
+        Nombre: reserveUDPPort
+        Descripción: Esta función obtiene un puerto libre en la máquina actual y lo mantiene reservado con un socket
+        abierto hasta releaseUDPPorts
         Argumentos:
             -Ninguno
-        Retorno: Entero de 16 bits con el número de puerto origen disponible
-          
+        Retorno: Entero de 16 bits con el número de puerto reservado
     '''
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.bind(('', 0))
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    portNum =  s.getsockname()[1]
-    s.close()
+    portNum = s.getsockname()[1]
+    udpReserved[portNum] = s
     return portNum
 
-def process_UDP_datagram(us,header,data,srcIP):
+def reserveUDPPorts(flowPorts=UDP_FLOW_PORTS, poolSize=UDP_POOL_SIZE):
+    '''
+        Nombre: reserveUDPPorts
+        Descripción: Esta función reserva de una vez los puertos origen de la pila: flowPorts puertos compartidos por
+        destino y poolSize puertos libres para endpoints. Si ya están reservados no hace nada
+        Argumentos:
+            -flowPorts: número de puertos compartidos
+            -poolSize: número de puertos para endpoints
+        Retorno: Ninguno
+    '''
+    global udpFlowPorts
+    with udpPortLock:
+        if udpFlowPorts:
+            return
+        udpFlowPorts = tuple(reserveUDPPort() for _ in range(flowPorts))
+        udpFreePorts.extend(reserveUDPPort() for _ in range(poolSize))
+
+def releaseUDPPorts():
+    #Cierra los sockets que mantienen reservados los puertos
+    global udpFlowPorts
+    with udpPortLock:
+        for s in udpReserved.values():
+            s.close()
+        udpReserved.clear()
+        udpFreePorts.clear()
+        udpFlowPorts = ()
+
+def getUDPSourcePort(dstIP=0,dstPort=0):
+    '''
+        Nombre: getUDPSourcePort
+        Descripción: Esta función obtiene el puerto origen para un destino entre los puertos compartidos reservados.
+        Un mismo destino obtiene siempre el mismo puerto, por lo que todos los datagramas de un flujo salen del mismo
+        puerto origen. No hace ninguna llamada al sistema salvo la primera vez si no se ha llamado a initUDP
+        Argumentos:
+            -dstIP: entero de 32 bits con la IP destino
+            -dstPort: entero de 16 bits con el puerto destino
+        Retorno: Entero de 16 bits con el número de puerto origen
+    '''
+    ports = udpFlowPorts
+    if not ports:
+        reserveUDPPorts()
+        ports = udpFlowPorts
+    return ports[hash((dstIP, dstPort)) % len(ports)]
+
+def allocUDPPort():
+    '''
+        Nombre: allocUDPPort
+        Descripción: Esta función obtiene un puerto de uso exclusivo (por ejemplo para un endpoint) del conjunto
+        reservado en initUDP. Si se han agotado se reserva uno nuevo
+        Argumentos:
+            -Ninguno
+        Retorno: Entero de 16 bits con el número de puerto
+    '''
+    with udpPortLock:
+        try:
+            return udpFreePorts.popleft()
+        except IndexError:
+            return reserveUDPPort()
+
+def releaseUDPPort(port):
+    #Devuelve un puerto obtenido con allocUDPPort
+    with udpPortLock:
+        if port in udpReserved and port not in udpFlowPorts and port not in udpFreePorts:
+            udpFreePorts.append(port)
+
+def setUDPChecksumVerification(port,enabled):
+    '''
+        Nombre: setUDPChecksumVerification
+        Descripción: Esta función activa o desactiva la comprobación del checksum de los datagramas recibidos en un
+        puerto local, por ejemplo para flujos masivos de confianza
+        Argumentos:
+            -port: entero de 16 bits con el puerto local
+            -enabled: True para comprobar el checksum (valor por defecto) y False para no hacerlo
+        Retorno: Ninguno
+    '''
+    if enabled:
+        udpNoVerifyPorts.discard(port)
+    else:
+        udpNoVerifyPorts.add(port)
+
+def process_UDP_datagram(us,header,data,srcIP,dstIP=None):
     '''
         Nombre: process_UDP_datagram
         Descripción: Esta función procesa un datagrama UDP. Esta función se ejecutará por cada datagrama IP que contenga
         un 17 en el campo protocolo de IP
         Esta función debe realizar, al menos, las siguientes tareas:
             -Extraer los campos de la cabecera UDP
+            -Comprobar el checksum con la pseudo-cabecera (con la IP destino real del datagrama, que puede ser broadcast o
+            multicast), salvo que sea 0 o esté desactivado para el puerto destino
             -Loggear (usando logging.debug) los siguientes campos:
                 -Puerto origen
                 -Puerto destino
@@ -44,29 +170,48 @@ def process_UDP_datagram(us,header,data,srcIP):
             -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
             -data: array de bytes con el conenido del datagrama UDP
             -srcIP: dirección IP que ha enviado el datagrama actual.
+            -dstIP: dirección IP destino del datagrama actual. Si es None se toma la propia
         Retorno: Ninguno
           
     '''
 
+    global udpChecksumErrors
     srcPort = data[:2]
     dstPort = data[2:4]
+    length = int.from_bytes(data[4:6], "big")
+    if length < UDP_HLEN or length > len(data):
+        return
+    data = data[:length]
     data_datagram = data[8:]
 
+    if data[6:8] != b'\x00\x00' and int.from_bytes(dstPort, "big") not in udpNoVerifyPorts:
+        dst = ipLayer.myIP if dstIP is None else int.from_bytes(dstIP, "big")
+        if not transportChecksumValid(pseudoHeaderPartial(int.from_bytes(srcIP, "big"), dst, UDP_PROTO), data):
+            #Solo se toma el cerrojo en la ruta de error, la recepción de datagramas correctos no lo usa
+            with udpStatsLock:
+                udpChecksumErrors += 1
+            logging.debug("Checksum UDP incorrecto")
+            return
+
     logging.debug("Puerto origen: " + str(int.from_bytes(srcPort, "big")))
     logging.debug("Puerto destino: " + str(int.from_bytes(dstPort, "big")))
-    logging.debug("Puerto datos: " + str(data_datagram))
+    logging.debug("Puerto datos: " + str(bytes(data_datagram)))
 
+    callback = udpBindings.get(int.from_bytes(dstPort, "big"))
+    if callback is not None:
+        callback(us, header, data_datagram, srcIP, int.from_bytes(srcPort, "big"))
 
 
 
-def sendUDPDatagram(data,dstPort,dstIP):
+
+def sendUDPDatagram(data,dstPort,dstIP,srcPort=None,done=None):
     '''
         Nombre: sendUDPDatagram
         Descripción: Esta función construye un datagrama UDP y lo envía
         Esta función debe realizar, al menos, las siguientes tareas:
             -Construir la cabecera UDP:
-                -El puerto origen lo obtendremos llamando a getUDPSourcePort
-                -El valor de checksum lo pondremos siempre a 0
+                -El puerto origen lo obtendremos llamando a getUDPSourcePort (el mismo para cada destino)
+                -El checksum se calcula con la pseudo-cabecera (cacheada por pareja de IP) si udpSendChecksum es True
             -Añadir los datos
             -Enviar el datagrama resultante llamando a sendIPDatagram
 
@@ -74,27 +219,79 @@ def sendUDPDatagram(data,dstPort,dstIP):
             -data: array de bytes con los datos a incluir como payload en el datagrama UDP
             -dstPort: entero de 16 bits que indica el número de puerto destino a usar
             -dstIP: entero de 32 bits con la IP destino del datagrama UDP
-        Retorno: True o False en función de si se ha enviado el datagrama correctamente o no
+            -srcPort: puerto origen a usar. Si es None se obtiene llamando a getUDPSourcePort
+            -done: función done(ok) con el resultado final del envío o None (ver sendIPDatagram)
+        Retorno: True o False en función de si se ha enviado el datagrama correctamente (o ha quedado en espera de la
+        resolución ARP) o no
           
     '''
-    udp_datagram = bytes()
-    srcPort = getUDPSourcePort().to_bytes(2, "big")
-    
+    if srcPort is None:
+        srcPort = getUDPSourcePort(dstIP, dstPort)
 
-    udp_datagram = srcPort 
+    udp_datagram = bytearray(UDP_HEADER.pack(srcPort, dstPort, UDP_HLEN + len(data), 0))
+    udp_datagram += data
+    if udpSendChecksum:
+        struct.pack_into('!H', udp_datagram, 6, transportChecksum(pseudoHeaderPartial(ipLayer.myIP, dstIP, UDP_PROTO), udp_datagram))
 
-    udp_datagram += dstPort.to_bytes(2, "big")
+    return sendIPDatagram(dstIP, udp_datagram, bytes([0x11]), done)
 
-    length = len(udp_datagram + data)
-    
-    length = length.to_bytes(2, "big")  
-    
-    udp_datagram += length
 
-    udp_datagram += bytes([0x00, 0x00])
-    udp_datagram += data
+class UDPEndpoint():
+    ''' Endpoint UDP "conectado" a un destino fijo, con un puerto origen exclusivo. Los puertos de la cabecera UDP se
+        empaquetan una vez y en cada envío solo se añaden la longitud y el checksum, en un buffer propio del envío para
+        que se pueda enviar desde varios hilos a la vez. La suma de la pseudo-cabecera se obtiene al crearlo, por lo
+        que se debe crear después de initIP
+    '''
+    def __init__(self, dstIP, dstPort, srcPort=None, callback=None):
+        '''
+            Argumentos:
+                -dstIP: entero de 32 bits con la IP destino
+                -dstPort: entero de 16 bits con el puerto destino
+                -srcPort: puerto origen o None para obtener uno con allocUDPPort
+                -callback: función callback(us,header,data,srcIP,srcPort) para los datagramas recibidos del destino o
+                None. Lanza OSError si el puerto origen ya tiene una función de recepción registrada
+        '''
+        self.dstIP = dstIP
+        self.dstPort = dstPort
+        self.ownPort = srcPort is None
+        self.srcPort = allocUDPPort() if srcPort is None else srcPort
+        self.ports = struct.pack('!HH', self.srcPort, dstPort)
+        self.pseudo = pseudoHeaderPartial(ipLayer.myIP, dstIP, UDP_PROTO)
+        self.callback = callback
+        if callback is not None and not registerUDPPort(self.srcPort, self._received):
+            self.close()
+            raise OSError('El puerto UDP {} ya está en uso'.format(self.srcPort))
+
+    def send(self, data, done=None):
+        '''
+            Nombre: send
+            Descripción: Envía un datagrama al destino del endpoint
+            Argumentos:
+                -data: array de bytes con el payload
+                -done: función done(ok) con el resultado final del envío o None (ver sendIPDatagram)
+            Retorno: True o False en función de si se ha enviado el datagrama correctamente (o ha quedado en espera de
+            la resolución ARP) o no
+        '''
+        udp_datagram = bytearray(self.ports)
+        udp_datagram += struct.pack('!HH', UDP_HLEN + len(data), 0)
+        udp_datagram += data
+        if udpSendChecksum:
+            struct.pack_into('!H', udp_datagram, 6, transportChecksum(self.pseudo, udp_datagram))
+        return sendIPDatagram(self.dstIP, udp_datagram, bytes([0x11]), done)
+
+    def _received(self, us, header, data, srcIP, srcPort):
+        #Solo se entregan los datagramas del destino conectado
+        if srcPort == self.dstPort and int.from_bytes(srcIP, "big") == self.dstIP:
+            self.callback(us, header, data, srcIP, srcPort)
 
-    return sendIPDatagram(dstIP, udp_datagram, bytes([0x11]))
+    def close(self):
+        if self.callback is not None:
+            if udpBindings.get(self.srcPort) == self._received:
+                registerUDPPort(self.srcPort, None)
+            self.callback = None
+        if self.ownPort:
+            releaseUDPPort(self.srcPort)
+            self.ownPort = False
 
 
 def initUDP():
@@ -103,6 +300,7 @@ def initUDP():
         Descripción: Esta función inicializa el nivel UDP
         Esta función debe realizar, al menos, las siguientes tareas:
             -Registrar (llamando a registerIPProtocol) la función process_UDP_datagram con el valor de protocolo 17
+            -Reservar los puertos origen (reserveUDPPorts)
 
         Argumentos:
             -Ninguno
@@ -110,4 +308,5 @@ def initUDP():
           
     '''
 
-    registerIPProtocol(process_UDP_datagram, bytes([0x11]))
\ No newline at end of file
+    registerIPProtocol(process_UDP_datagram, bytes([0x11]))
+    reserveUDPPorts()
\ No newline at end of file